@@ -0,0 +1,88 @@
+"""Highlight engine benchmark on a real filing with thousands of synthetic CUSIP/person hits.
+
+Usage: python benchmarks/bench_highlight.py [portfolio] [accession] [document index] [matches]
+"""
+import random
+import sys
+import time
+
+from datamule import Portfolio
+
+from secbrowser.highlight import bucket_by_fragment, highlight_text
+from secbrowser.index import PortfolioIndex
+
+
+def naive_highlight(text, matches):
+    """The old per-match slicing approach, kept here as the baseline"""
+    highlighted = text
+    for match in sorted(matches, key=lambda x: x['start'], reverse=True):
+        start, end = match['start'], match['end']
+        original = highlighted[start:end]
+        span = f'<span style="background-color: {match["color"]}; color: white; padding: 2px; border-radius: 3px;" title="{match["type"]}: {original}">{original}</span>'
+        highlighted = highlighted[:start] + span + highlighted[end:]
+    return highlighted
+
+
+def naive_fragments(fragments, matches):
+    """The old visualize path: filter the full match list for every fragment"""
+    out = []
+    for fragment_id, text in fragments:
+        fragment_matches = [m for m in matches if m.get('fragment_id') == fragment_id]
+        out.append(naive_highlight(text, fragment_matches) if fragment_matches else text)
+    return out
+
+
+def engine_fragments(fragments, matches):
+    buckets = bucket_by_fragment(matches)
+    return [highlight_text(text, buckets.get(str(fragment_id), [])) for fragment_id, text in fragments]
+
+
+def synthetic_matches(length, count, fragment_id=None, rng=random):
+    matches = []
+    for _ in range(count):
+        match_type, width = rng.choice([('cusips', 9), ('persons', 14)])
+        start = rng.randrange(0, max(1, length - width))
+        matches.append({'match': '', 'fragment_id': fragment_id, 'start': start, 'end': start + width,
+                        'color': '#0000ff', 'type': match_type})
+    return matches
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed * 1000:10.1f} ms")
+    return elapsed
+
+
+def main():
+    portfolio_path = sys.argv[1] if len(sys.argv) > 1 else 'test'
+    accession = sys.argv[2] if len(sys.argv) > 2 else '000104746904035975'
+    index = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    count = int(sys.argv[4]) if len(sys.argv) > 4 else 5000
+
+    rng = random.Random(0)
+    portfolio = Portfolio(portfolio_path)
+    submission = PortfolioIndex(portfolio_path).load_submission(portfolio, accession)
+    document = submission._load_document_by_index(index)
+
+    text = str(document.text)
+    fragments = [(t[0], t[2]) for t in document.data_tuples if t[1] in ('text', 'title', 'textsmall') and t[2]]
+    print(f"{accession}/{index}: {len(text)} chars, {len(fragments)} fragments, {count} matches")
+
+    # text view: matches over the whole document text
+    matches = synthetic_matches(len(text), count, rng=rng)
+    timed('text view, per-match slicing', naive_highlight, text, matches)
+    timed('text view, highlight engine', highlight_text, text, matches)
+
+    # visualize view: matches spread across fragments
+    fragment_matches = []
+    per_fragment = max(1, count // max(1, len(fragments)))
+    for fragment_id, fragment_text in fragments:
+        fragment_matches.extend(synthetic_matches(len(fragment_text), per_fragment, fragment_id, rng))
+    timed('visualize view, filter per fragment', naive_fragments, fragments, fragment_matches)
+    timed('visualize view, bucketed engine', engine_fragments, fragments, fragment_matches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Cold start budget: how long a fresh interpreter takes to import the server, and that it stays headless.
+
+Each run imports secbrowser.server in a new process, so nothing is shared between runs except the OS page
+cache. Exits non-zero if the median import time is over budget, or if a module that should only load on
+first use (datamule, tkinter, ...) was imported, so it can gate a container image build. The test suite runs
+the same check, see tests/test_startup.py.
+
+Usage: python benchmarks/bench_startup.py [runs] [budget ms]
+"""
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+# median import time of secbrowser.server allowed, in milliseconds
+BUDGET_MS = 500
+
+# imported on first use only, never just by starting the server
+DEFERRED_MODULES = ('datamule', 'tkinter', 'doc2dict', 'secxbrl', 'pandas')
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import secbrowser.server
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'loaded': [name for name in %r if name in sys.modules]}))
+""" % (DEFERRED_MODULES,)
+
+
+def probe():
+    output = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True, cwd=REPO).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    budget_ms = float(sys.argv[2]) if len(sys.argv) > 2 else BUDGET_MS
+
+    # the first import compiles bytecode, which a built image already has
+    probe()
+    results = [probe() for _ in range(runs)]
+    times = sorted(result['seconds'] * 1000 for result in results)
+    median = statistics.median(times)
+    print(f"{'import secbrowser.server, median':<40} {median:10.1f} ms")
+    print(f"{'min / max':<40} {times[0]:10.1f} / {times[-1]:.1f} ms")
+
+    failed = False
+    loaded = sorted({name for result in results for name in result['loaded']})
+    if loaded:
+        print(f"imported at startup, should be deferred: {', '.join(loaded)}")
+        failed = True
+    if median > budget_ms:
+        print(f"over the {budget_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
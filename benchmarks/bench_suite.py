@@ -0,0 +1,313 @@
+"""Benchmark suite over the bundled test/ and tsla/ portfolios, with results checked against a stored baseline.
+
+Runs offline. Each portfolio is copied to a temporary directory first, so the accession index can be built
+cold and the bundled folders are left untouched. The benchmarked document is the largest one in each
+portfolio. Every case is timed at least --repeat times, fast ones for longer, see measure.
+Document cases are skipped for portfolios whose documents don't parse into a section tree (tsla/ only has
+ownership XML, which datamule parses to an empty dict).
+
+    python benchmarks/bench_suite.py                            # run and compare with benchmarks/baseline.json
+    python benchmarks/bench_suite.py --json results.json        # also write the results
+    python benchmarks/bench_suite.py --save-baseline            # record this machine's numbers as the baseline
+
+Exits non-zero if any case's fastest run is more than --tolerance slower than the baseline's, and by more
+than that case's noise: --min-delta-ms, or NOISE_FACTOR times the spread between the baseline's median and
+fastest run if that is larger, so a case that jitters by milliseconds doesn't fail on a few of them. A
+portfolio with a case over that is run again, up to --retries times, keeping each case's fastest run. The
+fastest run is compared rather than the median because it is the least affected by whatever else the
+machine is doing. Cases missing from the baseline are reported but not checked, re-record it when cases are
+added. Baselines are only comparable on the machine that recorded them.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+# runnable from a checkout without installing the package
+sys.path.insert(0, str(REPO))
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+PORTFOLIOS = ('test', 'tsla')
+
+# synthetic highlight density: one match per this many characters of text
+MATCH_SPACING = 40
+
+# the diff cases compare the document with a copy that has one in this many text fragments edited
+EDIT_SPACING = 50
+
+# fast cases are repeated until their runs add up to this many seconds, up to MAX_RUNS runs
+MIN_SECONDS = 1.0
+MAX_RUNS = 2000
+
+# a case has to be slower than the baseline by this many times the baseline's own median to fastest spread
+NOISE_FACTOR = 2
+
+
+def measure(run, setup=None, repeat=5, warmup=1):
+    """Median and min in ms of run(setup()), setup not included, and how many times it ran. Runs at least
+    repeat times, and fast cases keep running until they have taken MIN_SECONDS, so their fastest run isn't
+    picked from a few milliseconds the machine happened to be busy for."""
+    times = []
+    measured = 0.0
+    i = 0
+    while len(times) < repeat or (measured < MIN_SECONDS and len(times) < MAX_RUNS):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        run(arg)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed * 1000)
+            measured += elapsed
+        i += 1
+    return {'median_ms': statistics.median(times), 'min_ms': min(times), 'runs': len(times)}
+
+
+def largest_document(index, portfolio):
+    """(accession, document index) of the biggest HTML document in the portfolio, which is what
+    doc2dict parses into a section tree, or of the biggest text/XML one if there is none"""
+    with index.connect() as conn:
+        rows = conn.execute("SELECT accession, name FROM members WHERE name NOT LIKE '%metadata.json' "
+                            "ORDER BY size DESC").fetchall()
+    for extensions in (('.htm', '.html'), ('.txt', '.xml')):
+        for row in rows:
+            filename = row['name'].split('/', 1)[1]
+            if not filename.lower().endswith(extensions):
+                continue
+            submission = index.load_submission(portfolio, row['accession'])
+            for doc_index, doc in enumerate(submission.metadata.content['documents']):
+                if (doc.get('filename') or doc['sequence'] + '.txt') == filename:
+                    return row['accession'], doc_index
+    return None
+
+
+def find_tables(node, found=None):
+    """Every table node in a parsed document.data tree"""
+    found = [] if found is None else found
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == 'table':
+                found.append(value)
+            else:
+                find_tables(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            find_tables(value, found)
+    return found
+
+
+def edited_copy(node, rng):
+    """A copy of a parsed document.data tree with a word added to one in EDIT_SPACING text fragments, standing in
+    for the same filing a year later. Unchanged text is shared with the original."""
+    if isinstance(node, dict):
+        edited = {}
+        for key, value in node.items():
+            if key == 'text' and isinstance(value, str) and ' ' in value and rng.randrange(EDIT_SPACING) == 0:
+                edited[key] = str(value).replace(' ', ' revised ', 1)
+            else:
+                edited[key] = edited_copy(value, rng)
+        return edited
+    if isinstance(node, list):
+        return [edited_copy(value, rng) for value in node]
+    return node
+
+
+def dense_matches(fragments, rng):
+    """Non-overlapping synthetic matches every MATCH_SPACING characters of each (fragment_id, text)"""
+    matches = []
+    for fragment_id, text in fragments:
+        for start in range(rng.randrange(MATCH_SPACING), max(0, len(text) - 10), MATCH_SPACING):
+            matches.append({'match': text[start:start + 9], 'fragment_id': fragment_id, 'start': start,
+                            'end': start + 9, 'color': '#0000ff', 'type': rng.choice(('cusips', 'persons'))})
+    return matches
+
+
+def bench_portfolio(name, workdir, repeat):
+    from datamule import Portfolio
+
+    from secbrowser import server
+    from secbrowser.diff import tree_hashes
+    from secbrowser.highlight import bucket_by_fragment, highlight_text
+    from secbrowser.index import INDEX_FILENAME, PortfolioIndex
+    from secbrowser.json_stream import iter_json
+
+    path = workdir / name
+    shutil.copytree(REPO / name, path, ignore=shutil.ignore_patterns('*.db'))
+    results = {}
+
+    def open_cold(_):
+        portfolio = Portfolio(str(path))
+        PortfolioIndex(path).refresh()
+        portfolio._close_batch_handles()
+
+    results['open_portfolio'] = measure(open_cold, lambda: (path / INDEX_FILENAME).unlink(missing_ok=True), repeat)
+    results['open_portfolio_indexed'] = measure(lambda _: PortfolioIndex(path).refresh(), None, repeat)
+
+    portfolio = Portfolio(str(path))
+    portfolio.MAX_WORKERS = 1
+    index = PortfolioIndex(path)
+    index.refresh()
+    with index.connect() as conn:
+        accessions = [row[0] for row in conn.execute('SELECT accession FROM submissions')]
+
+    def lookup_all(_):
+        for accession in accessions:
+            index.load_submission(portfolio, accession)
+
+    results['accession_lookup'] = measure(lookup_all, None, repeat)
+
+    accession, doc_index = largest_document(index, portfolio)
+    submission = index.load_submission(portfolio, accession)
+    results['load_document'] = measure(lambda _: submission._load_document_by_index(doc_index), None, repeat)
+    results['parse_data'] = measure(lambda document: document.data,
+                                    lambda: submission._load_document_by_index(doc_index), repeat)
+
+    document = submission._load_document_by_index(doc_index)
+    data = document.data
+    if not data:
+        print(f"{name}: {accession}/{doc_index} has no parsed data, skipping the document cases")
+        return finish(name, results, server, portfolio, path, accession, doc_index, repeat)
+
+    results['visualize_html'] = measure(lambda _: ''.join(server.iter_visualize_data_as_html(data)), None, repeat)
+
+    rng = random.Random(0)
+    text = str(document.text)
+    text_matches = dense_matches([(None, text)], rng)
+    results['highlight_text_dense'] = measure(lambda _: highlight_text(text, text_matches), None, repeat)
+
+    fragments = [(t[0], t[2]) for t in document.data_tuples or [] if t[1] in ('text', 'textsmall') and t[2]]
+    fragment_matches = dense_matches(fragments, rng)
+    results['visualize_html_dense'] = measure(
+        lambda _: ''.join(server.iter_visualize_data_as_html(data, bucket_by_fragment(fragment_matches))), None, repeat)
+
+    tables = find_tables(data)
+
+    def process_tables(_):
+        html = []
+        for table in tables:
+            server.process_table(table, html)
+
+    results['process_table'] = measure(process_tables, None, repeat)
+    results['document_data_json'] = measure(lambda _: b''.join(iter_json(data)), None, repeat)
+
+    previous = edited_copy(data, rng)
+    results['section_hashes'] = measure(lambda _: tree_hashes(data), None, repeat)
+    previous_hashes, hashes = tree_hashes(previous), tree_hashes(data)
+    results['diff_html'] = measure(
+        lambda _: ''.join(server.iter_diff_as_html(previous, data, previous_hashes, hashes)), None, repeat)
+
+    print(f"{name}: {len(accessions)} submissions, document {accession}/{doc_index} "
+          f"({len(document.content or b'')} bytes, {len(tables)} tables, {len(text_matches)} text matches, "
+          f"{len(fragment_matches)} fragment matches)")
+    return finish(name, results, server, portfolio, path, accession, doc_index, repeat)
+
+
+def finish(name, results, server, portfolio, path, accession, doc_index, repeat):
+    """Time the /document/data route end to end, with the document already in the server's cache"""
+    server.open_portfolio(str(path))
+    server.cache['portfolio'] = portfolio
+    client = server.app.test_client()
+    url = f'/document/data?accession={accession}&index={doc_index}'
+    client.get(url).close()
+    results['document_data_route'] = measure(lambda _: client.get(url).get_data(), None, repeat)
+
+    portfolio._close_batch_handles()
+    return {f'{name}/{case}': result for case, result in results.items()}
+
+
+def noise_ms(before, min_delta_ms):
+    """How much slower than the baseline a case may be and still be noise"""
+    return max(min_delta_ms, NOISE_FACTOR * (before['median_ms'] - before['min_ms']))
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Names of cases that got slower than the baseline allows"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        delta = result['min_ms'] - before['min_ms']
+        if delta > noise_ms(before, min_delta_ms) and result['min_ms'] > before['min_ms'] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark secbrowser on the bundled portfolios.')
+    parser.add_argument('--portfolio', action='append', choices=PORTFOLIOS, help='default: all of them')
+    parser.add_argument('--repeat', type=int, default=9)
+    parser.add_argument('--json', help='write results to this file, - for stdout')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to --baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, 0.25 = 25%%')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0)
+    parser.add_argument('--retries', type=int, default=2,
+                        help='times to run a portfolio again when it has cases over the baseline')
+    args = parser.parse_args()
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    workdir = Path(tempfile.mkdtemp(prefix='secbrowser-bench-'))
+    # keep rendered pages out of the user's cache directory
+    os.environ['SECBROWSER_RENDER_CACHE_DIR'] = str(workdir / 'render_cache')
+    try:
+        results = {}
+        for name in args.portfolio or PORTFOLIOS:
+            results.update(bench_portfolio(name, workdir, args.repeat))
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+
+        # a busy few seconds on the machine can slow a whole case down, a real regression shows up every time
+        for attempt in range(1, args.retries + 1):
+            if not regressions:
+                break
+            print(f"{len(regressions)} case(s) over the baseline, running their portfolios again")
+            for name in sorted({case.split('/')[0] for case in regressions}):
+                for case, result in bench_portfolio(name, workdir / f'retry{attempt}', args.repeat).items():
+                    if result['min_ms'] < results[case]['min_ms']:
+                        results[case] = result
+            regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, result in results.items():
+        line = f"{name:<40} {result['median_ms']:10.2f} ms median {result['min_ms']:10.2f} ms fastest"
+        if name in baseline:
+            change = (result['min_ms'] / baseline[name]['min_ms'] - 1) * 100 if baseline[name]['min_ms'] else 0
+            line += f"  {change:+7.1f}% vs baseline{'  REGRESSION' if name in regressions else ''}"
+        elif baseline:
+            line += '  not in baseline'
+        print(line)
+
+    report = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'repeat': args.repeat,
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'results': results,
+        'regressions': regressions,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'meta': report['meta'], 'results': results}, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
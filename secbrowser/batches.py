@@ -0,0 +1,164 @@
+"""Shared plumbing for the portfolio-wide indexes (tags, search, ...) built from a portfolio's batch tars."""
+import json
+import multiprocessing
+import os
+import sqlite3
+import tarfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from . import db
+
+
+def batch_signatures(portfolio_path):
+    """Map each batch tar in a portfolio to (mtime, size), which is how the indexes notice new or changed batches"""
+    portfolio_path = Path(portfolio_path)
+    if not portfolio_path.exists():
+        return {}
+    signatures = {}
+    for batch_tar in sorted(portfolio_path.iterdir()):
+        if batch_tar.is_file() and 'batch' in batch_tar.name and batch_tar.suffix == '.tar':
+            stat = batch_tar.stat()
+            signatures[str(batch_tar)] = (stat.st_mtime, stat.st_size)
+    return signatures
+
+
+def iter_batch_documents(batch_path, document_types=None, select=None):
+    """Yield (accession, document index, metadata, Document) for every document in a batch tar.
+
+    Walks the tar once. document_types, or a select(document metadata) predicate, limits which documents
+    are read at all.
+    """
+    from datamule import Document
+
+    with tarfile.open(batch_path, 'r') as tar:
+        members = {member.name: member for member in tar if member.isfile()}
+        for name, member in members.items():
+            if not name.endswith('/metadata.json'):
+                continue
+            accession = name.split('/')[0]
+            metadata = json.loads(tar.extractfile(member).read().decode('utf-8'))
+            fd = metadata.get('filing-date')
+            filing_date = f"{fd[:4]}-{fd[4:6]}-{fd[6:8]}" if fd else None
+
+            for doc_index, doc in enumerate(metadata.get('documents', [])):
+                if document_types and doc.get('type') not in document_types:
+                    continue
+                if select is not None and not select(doc):
+                    continue
+                filename = doc.get('filename') or doc['sequence'] + '.txt'
+                member_name = f'{accession}/{filename}'
+                if member_name not in members:
+                    continue
+                document = Document(type=doc.get('type'), content=tar.extractfile(members[member_name]).read(),
+                                    filename=filename, accession=accession, filing_date=filing_date)
+                yield accession, doc_index, metadata, document
+
+
+def run_batches(func, pending, args=(), workers=None, on_result=None, initializer=None, initargs=(), progress=print):
+    """Run func(batch_path, *args) for each (batch_path, signature) in pending on a process pool.
+
+    Results are handed to on_result(batch_path, signature, result) in the parent as they finish, so only
+    the parent writes to sqlite.
+    """
+    if not pending:
+        return 0
+
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer,
+                             initargs=initargs) as executor:
+        futures = {executor.submit(func, path, *args): (path, signature) for path, signature in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            path, signature = futures[future]
+            try:
+                on_result(path, signature, future.result())
+            except Exception as e:
+                print(f"Path: {path}. Exception: {e}")
+            progress(f"Processed {done}/{len(pending)} batches")
+    return len(pending)
+
+
+class SidecarStore(ABC):
+    """An index stored in a sqlite file next to a portfolio's batches, built batch tar by batch tar.
+
+    Each batch is extracted on a process pool and its rows written here in the parent. The processed table
+    records the (mtime, size) every batch was built from, so a build only extracts batches that are new or
+    changed, and forgets the rows of batches that are gone.
+
+    Subclasses set FILENAME and SCHEMA and implement drop_rows and write_rows. Stores that can be built in
+    more than one way (with other dictionaries, for another document type) name the processed column that
+    records how in BUILD_COLUMN and pass a build_key around.
+    """
+    FILENAME = None
+    SCHEMA = None
+    BUILD_COLUMN = None
+
+    def __init__(self, portfolio_path):
+        self.portfolio_path = Path(portfolio_path)
+        self.path = self.portfolio_path / self.FILENAME
+
+    def connect(self):
+        conn = db.connect(self.path, self.SCHEMA)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def exists(self):
+        return self.path.exists()
+
+    @abstractmethod
+    def drop_rows(self, conn, batch_path, build_key=None):
+        """Delete a batch's rows, only those built with build_key if given"""
+
+    @abstractmethod
+    def write_rows(self, conn, batch_path, rows, build_key=None):
+        """Store what the extract function returned for a batch"""
+
+    def updated(self, conn):
+        """Called after batches were written or dropped, in the same transaction"""
+
+    def pending_batches(self, build_key=None):
+        """Batch tars that are new or changed since they were last built (with build_key)"""
+        query, params = 'SELECT path, mtime, size FROM processed', ()
+        if self.BUILD_COLUMN:
+            query, params = query + f' WHERE {self.BUILD_COLUMN} = ?', (build_key,)
+        with self.connect() as conn:
+            done = {row['path']: (row['mtime'], row['size']) for row in conn.execute(query, params)}
+        return [(path, signature) for path, signature in batch_signatures(self.portfolio_path).items()
+                if done.get(path) != signature]
+
+    def _drop_batch(self, conn, batch_path, build_key=None):
+        self.drop_rows(conn, batch_path, build_key)
+        if build_key is not None and self.BUILD_COLUMN:
+            conn.execute(f'DELETE FROM processed WHERE path = ? AND {self.BUILD_COLUMN} = ?', (batch_path, build_key))
+        else:
+            conn.execute('DELETE FROM processed WHERE path = ?', (batch_path,))
+
+    def drop_missing_batches(self):
+        on_disk = batch_signatures(self.portfolio_path)
+        with self.connect() as conn:
+            for row in conn.execute('SELECT DISTINCT path FROM processed').fetchall():
+                if row['path'] not in on_disk:
+                    self._drop_batch(conn, row['path'])
+            self.updated(conn)
+
+    def write_batch(self, batch_path, signature, rows, build_key=None):
+        columns, values = ['path', 'mtime', 'size'], [batch_path, *signature]
+        if self.BUILD_COLUMN:
+            columns.append(self.BUILD_COLUMN)
+            values.append(build_key)
+        with self.connect() as conn:
+            self._drop_batch(conn, batch_path, build_key)
+            self.write_rows(conn, batch_path, rows, build_key)
+            conn.execute(f'INSERT OR REPLACE INTO processed ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                         values)
+            self.updated(conn)
+
+    def build_batches(self, extract, args=(), build_key=None, workers=None, progress=print, initializer=None, initargs=()):
+        """Run extract(batch_path, *args) over the new or changed batches and store the results. Returns the
+        number of batches built."""
+        self.drop_missing_batches()
+        return run_batches(extract, self.pending_batches(build_key), args=args, workers=workers,
+                           on_result=lambda path, signature, rows: self.write_batch(path, signature, rows, build_key),
+                           initializer=initializer, initargs=initargs, progress=progress)
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from threading import RLock
+
+
+def document_size(document):
+    """Rough in-memory footprint of a datamule Document in bytes"""
+    size = len(document.content or b'')
+    # parsed trees are not cheap to measure, so assume a multiple of the raw content
+    if getattr(document, '_data', None):
+        size += 2 * len(document.content or b'')
+    if getattr(document, '_text', None):
+        size += len(document._text)
+    if getattr(document, '_tables', None):
+        size += len(document.content or b'')
+    return size
+
+
+def submission_size(submission):
+    """Rough in-memory footprint of a datamule Submission in bytes"""
+    size = 1024 * (1 + len(submission.metadata.content.get('documents', [])))
+    if getattr(submission, '_xbrl', None):
+        size += 512 * len(submission._xbrl)
+    return size
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by an estimated byte budget"""
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # {key: (value, size)}
+        self._lock = RLock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            value, _ = self._entries[key]
+            self._entries.move_to_end(key)
+            # values grow as they are lazily parsed, so re-measure on every hit
+            self._store(key, value)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        return value
+
+    def get_or_load(self, key, loader):
+        """Cached value for key, else loader()'s. None (nothing found) is returned but not cached."""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self.current_bytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def _store(self, key, value):
+        size = self.sizeof(value)
+        if key in self._entries:
+            self.current_bytes -= self._entries[key][1]
+        self._entries[key] = (value, size)
+        self._entries.move_to_end(key)
+        self.current_bytes += size
+        self._evict()
+
+    def _evict(self):
+        # never evict the most recently used entry, even if it alone is over budget
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.current_bytes -= size
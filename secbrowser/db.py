@@ -0,0 +1,22 @@
+"""sqlite connections for the portfolio's derived index files (tags, search, entities, sentiment, fundamentals)."""
+import sqlite3
+from pathlib import Path
+
+# bytes of each index file sqlite reads through mmap, so processes serving the same portfolio share pages
+MMAP_SIZE = 256 * 1024 * 1024
+
+# serve workers only read the indexes, builds run in their own job processes. Set by serve.py after forking.
+read_only = False
+
+
+def connect(path, schema):
+    """Open an index file, creating its tables, or read-only when this process only serves requests"""
+    path = Path(path)
+    if read_only and path.exists():
+        conn = sqlite3.connect(f'{path.resolve().as_uri()}?mode=ro', uri=True, timeout=30)
+    else:
+        conn = sqlite3.connect(path, timeout=30)
+        if schema:
+            conn.executescript(schema)
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    return conn
@@ -0,0 +1,119 @@
+import sys
+import time
+from threading import Lock
+
+# every dictionary the tag and sentiment forms can pick from
+DICTIONARY_NAMES = ['ssa_baby_first_names', '8k_2024_persons', 'sc13dg_cusips', '13fhr_information_table_cusips',
+                    'npx_figis', 'npx_isins', 'loughran_mcdonald']
+
+
+def build_dictionary(name):
+    """Download (if needed) and load one dictionary with its lookup processor, like datamule's set_dictionaries"""
+    from datamule.tags.dictionaries import download_dictionary, load_dictionary
+
+    download_dictionary(name)
+    raw_data = load_dictionary(name)
+
+    processor = None
+    if name == '8k_2024_persons':
+        from flashtext import KeywordProcessor
+        processor = KeywordProcessor(case_sensitive=True)
+        for key in raw_data.keys():
+            processor.add_keyword(key, key)
+    elif name == 'loughran_mcdonald':
+        from datamule.tags.utils import create_lm_processors
+        processor = create_lm_processors(raw_data)
+
+    return {'data': raw_data, 'processor': processor}
+
+
+def deep_sizeof(obj):
+    """Approximate bytes held by obj and everything it references: the sets and dicts a dictionary loads to,
+    and the keyword tries and attributes of its processor. Objects reachable twice are counted once."""
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif not isinstance(obj, (str, bytes, int, float, bool, type(None), type)):
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for slot in getattr(type(obj), '__slots__', ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return size
+
+
+class DictionaryRegistry:
+    """Loads each tagging dictionary once and keeps it resident.
+
+    datamule's set_dictionaries swaps a module global and reloads everything on each call, so instead
+    every request builds its own Tags/Similarity objects and binds the dictionaries it asked for.
+    """
+    def __init__(self):
+        self._dictionaries = {}
+        self._stats = {}
+        self._lock = Lock()
+
+    def get(self, name):
+        entry = self._dictionaries.get(name)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            # another request may have loaded it while we waited
+            if name not in self._dictionaries:
+                self._dictionaries[name] = self._load(name)
+            return self._dictionaries[name]
+
+    def _load(self, name):
+        start = time.perf_counter()
+        entry = build_dictionary(name)
+        elapsed = time.perf_counter() - start
+        # measured from the loaded structures, tracing allocations would slow down every other request meanwhile
+        size = deep_sizeof(entry)
+
+        self._stats[name] = {'load_seconds': round(elapsed, 3), 'bytes': size}
+        print(f"Loaded dictionary {name} in {elapsed:.2f}s (~{size / 1024 / 1024:.1f} MiB)")
+        return entry
+
+    def warm(self, names):
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Could not load dictionary {name}: {e}")
+
+    def bind(self, analysis, names):
+        """Point a datamule Tags/Similarity object at the given dictionaries instead of the global ones"""
+        analysis.dictionaries = {}
+        analysis.processors = {}
+        for name in names:
+            entry = self.get(name)
+            analysis.dictionaries[name] = entry['data']
+            if entry['processor'] is not None:
+                analysis.processors[name] = entry['processor']
+        return analysis
+
+    def tags(self, document, mode, names):
+        from datamule.document.document import Tags
+        return self.bind(Tags(document, mode=mode), names)
+
+    def similarity(self, document, mode, names):
+        from datamule.document.document import Similarity
+        return self.bind(Similarity(document, mode=mode), names)
+
+    def stats(self):
+        return {name: {'loaded': name in self._dictionaries, **self._stats.get(name, {})} for name in DICTIONARY_NAMES}
+
+
+registry = DictionaryRegistry()
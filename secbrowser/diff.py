@@ -0,0 +1,212 @@
+"""Structural diff of two parsed document.data trees, for comparing a filing with an earlier one of the same
+kind, such as this year's 10-K against last year's.
+
+Every section and piece of content gets a hash of everything under it, computed once per tree. Siblings are
+aligned by those hashes first, so a section that didn't change is matched as a whole and never looked into,
+however large it is. What is left is paired up by section title (or content type and similarity), and only
+those pairs are descended into, down to word level diffs of text and cell level diffs of tables.
+"""
+import difflib
+import hashlib
+import re
+
+# section fields that aren't content, see iter_document in server.py
+SECTION_FIELDS = ('title', 'class', 'contents', 'standardized_title')
+
+# how far ahead among the changed siblings of the other filing to look for a piece of content's counterpart,
+# sections are looked for among all of them since comparing titles is cheap
+PAIR_WINDOW = 8
+
+# text pairs less similar than this are shown as removed and added rather than diffed word by word
+MIN_TEXT_RATIO = 0.4
+
+# texts with more words than this on both sides are diffed sentence by sentence, word diffs are quadratic
+MAX_DIFF_WORDS = 2000
+
+WORDS = re.compile(r'\s+|\S+\s*')
+SENTENCES = re.compile(r'[^.!?\n]+[.!?\n]*\s*|[.!?\n]+\s*')
+
+
+def _ordered_keys(children):
+    """Keys in the order iter_document renders them, numbered ones in numerical order"""
+    try:
+        return sorted(children.keys(), key=lambda x: (not x.lstrip('-').isdigit(), int(x) if x.lstrip('-').isdigit() else x))
+    except:
+        return list(children.keys())
+
+
+def children_items(children):
+    """A contents dict as a list of (kind, key, value), kind being 'section' or 'content'"""
+    return [('section' if isinstance(children[key], dict) else 'content', key, children[key]) for key in _ordered_keys(children)]
+
+
+def section_items(section):
+    """A section's own content fields followed by its subsections, as (kind, key, value)"""
+    items = [('content', key, value) for key, value in section.items() if key not in SECTION_FIELDS]
+    if section.get('contents'):
+        items.extend(children_items(section['contents']))
+    return items
+
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode('utf-8', 'surrogatepass'))
+        h.update(b'\0')
+    return h.digest()
+
+
+def _normalized(value):
+    """Text with runs of whitespace collapsed, filings reflow the same text from year to year"""
+    return ' '.join(value.split()) if isinstance(value, str) else repr(value)
+
+
+def tree_hashes(data):
+    """{id(node): digest} for every section and content value in a document.data tree. A section's digest
+    covers its title and everything under it but not its key, which is a position in the document and shifts
+    between filings. Whitespace is ignored. Only valid while the tree is alive and unchanged."""
+    hashes = {}
+
+    def visit(kind, value):
+        if id(value) in hashes:
+            return hashes[id(value)]
+        if kind == 'section':
+            parts = [_normalized(value.get('title', '')), value.get('class', '')]
+            for item_kind, key, child in section_items(value):
+                parts.extend((item_kind, key if item_kind == 'content' else '', visit(item_kind, child)))
+            digest = _digest('section', *parts)
+        else:
+            digest = _digest(_normalized(value))
+        hashes[id(value)] = digest
+        return digest
+
+    document = data.get('document') if isinstance(data, dict) else None
+    if isinstance(document, dict):
+        for item in children_items(document):
+            visit(item[0], item[2])
+    return hashes
+
+
+def item_key(item, hashes):
+    """What two items have to share to be the same: kind, content type and digest"""
+    kind, key, value = item
+    if kind == 'section':
+        return ('section', hashes[id(value)])
+    return ('content', str(key), hashes[id(value)])
+
+
+def _label(item):
+    """What two items have to share to be counterparts: the section's title, or the content type"""
+    kind, key, value = item
+    if kind == 'section':
+        return ('section', value.get('standardized_title') or ' '.join(str(value.get('title', '')).lower().split()))
+    return ('content', str(key))
+
+
+def _words(text):
+    return [token.strip() for token in WORDS.findall(text)]
+
+
+def _similar(old, new):
+    if not isinstance(old, str) or not isinstance(new, str):
+        # tables and images in the same place are taken to be the same one
+        return True
+    return difflib.SequenceMatcher(None, _words(old), _words(new), autojunk=False).quick_ratio() >= MIN_TEXT_RATIO
+
+
+def _counterpart(old, new_items, start):
+    """Index of the item from start on that old corresponds to, or None"""
+    label = _label(old)
+    end = len(new_items) if old[0] == 'section' else min(len(new_items), start + PAIR_WINDOW)
+    for j in range(start, end):
+        new = new_items[j]
+        if _label(new) == label and (old[0] == 'section' or _similar(old[2], new[2])):
+            return j
+    return None
+
+
+def _pair(old_items, new_items):
+    j = 0
+    for old in old_items:
+        match = _counterpart(old, new_items, j)
+        if match is None:
+            yield 'deleted', old, None
+            continue
+        for new in new_items[j:match]:
+            yield 'inserted', None, new
+        yield 'changed', old, new_items[match]
+        j = match + 1
+    for new in new_items[j:]:
+        yield 'inserted', None, new
+
+
+def align(old_items, new_items, old_hashes, new_hashes):
+    """Match up two lists of sibling items. Yields ('equal', old run, new run) for identical runs,
+    ('changed', old item, new item) for counterparts that differ, ('deleted', old item, None) and
+    ('inserted', None, new item)."""
+    old_keys = [item_key(item, old_hashes) for item in old_items]
+    new_keys = [item_key(item, new_hashes) for item in new_items]
+    matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            yield 'equal', old_items[i1:i2], new_items[j1:j2]
+        else:
+            yield from _pair(old_items[i1:i2], new_items[j1:j2])
+
+
+def _merge(segments):
+    merged = []
+    for op, text in segments:
+        if not text:
+            continue
+        if merged and merged[-1][0] == op:
+            merged[-1] = (op, merged[-1][1] + text)
+        else:
+            merged.append((op, text))
+    return merged
+
+
+def diff_text(old, new, by_sentence=None):
+    """Segments (op, text), op being 'equal', 'delete' or 'insert', that turn old into new. Whitespace
+    differences are ignored. Word by word, or sentence by sentence for long texts, with the changed sentences
+    then diffed by word."""
+    old, new = str(old), str(new)
+    if old == new:
+        return [('equal', new)]
+
+    old_words, new_words = WORDS.findall(old), WORDS.findall(new)
+    if by_sentence is None:
+        by_sentence = len(old_words) > MAX_DIFF_WORDS and len(new_words) > MAX_DIFF_WORDS
+    old_tokens, new_tokens = (SENTENCES.findall(old), SENTENCES.findall(new)) if by_sentence else (old_words, new_words)
+
+    matcher = difflib.SequenceMatcher(None, [t.strip() for t in old_tokens], [t.strip() for t in new_tokens], autojunk=False)
+    segments = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        removed, added = ''.join(old_tokens[i1:i2]), ''.join(new_tokens[j1:j2])
+        if tag == 'equal':
+            segments.append(('equal', added))
+        elif tag == 'replace' and by_sentence and len(WORDS.findall(removed)) <= MAX_DIFF_WORDS \
+                and len(WORDS.findall(added)) <= MAX_DIFF_WORDS:
+            segments.extend(diff_text(removed, added, by_sentence=False))
+        else:
+            segments.append(('delete', removed))
+            segments.append(('insert', added))
+    return _merge(segments)
+
+
+def diff_rows(old_rows, new_rows):
+    """(op, old row, new row) for two tables' rows, op being 'equal', 'changed', 'deleted' or 'inserted'.
+    Rows that differ are paired up in order, the extra ones on either side are deleted or inserted."""
+    matcher = difflib.SequenceMatcher(None, [repr(row) for row in old_rows], [repr(row) for row in new_rows], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for old, new in zip(old_rows[i1:i2], new_rows[j1:j2]):
+                yield 'equal', old, new
+            continue
+        paired = min(i2 - i1, j2 - j1)
+        for old, new in zip(old_rows[i1:i1 + paired], new_rows[j1:j1 + paired]):
+            yield 'changed', old, new
+        for old in old_rows[i1 + paired:i2]:
+            yield 'deleted', old, None
+        for new in new_rows[j1 + paired:j2]:
+            yield 'inserted', None, new
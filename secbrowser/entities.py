@@ -0,0 +1,147 @@
+"""Entity reverse index: which documents in a portfolio mention a given CUSIP, ISIN, FIGI, ticker or person.
+
+Mentions come from the same tag extraction the text view uses and are keyed by entity first, so a lookup is
+a single primary key range scan and the index never has to fit in memory.
+
+Usage: python -m secbrowser.entities <portfolio> [--dictionaries name,name] [--workers N] [--lookup type value]
+"""
+import argparse
+from array import array
+from collections import defaultdict
+
+from .batches import SidecarStore, iter_batch_documents
+from .dictionaries import registry
+from .tag_store import TAG_TYPES, dictionaries_key, extract_tags
+
+ENTITIES_FILENAME = 'secbrowser_entities.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    dictionaries TEXT
+);
+CREATE TABLE IF NOT EXISTS mentions (
+    entity_type TEXT,
+    value TEXT COLLATE NOCASE,
+    accession TEXT,
+    doc_index INTEGER,
+    batch TEXT,
+    count INTEGER,
+    offsets BLOB,
+    PRIMARY KEY (entity_type, value, accession, doc_index)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS mentions_batch ON mentions (batch);
+"""
+
+
+def normalize_entity(entity_type, value):
+    """Collapse whitespace, and upper case identifiers and tickers. Names keep their case for display."""
+    value = ' '.join(str(value).split())
+    return value if entity_type == 'persons' else value.upper()
+
+
+def pack_offsets(offsets):
+    return array('I', [position for span in offsets for position in span]).tobytes()
+
+
+def unpack_offsets(data):
+    flat = array('I', data)
+    return [(flat[i], flat[i + 1]) for i in range(0, len(flat), 2)]
+
+
+def _init_worker(dictionaries):
+    registry.warm(dictionaries)
+
+
+def entity_batch(batch_path, dictionaries):
+    """Worker: every entity mention in one batch tar, as rows for EntityIndex.write_batch"""
+    rows = []
+    for accession, doc_index, metadata, document in iter_batch_documents(batch_path):
+        if not document._data_bool:
+            continue
+        try:
+            for tag_type in TAG_TYPES:
+                # values are compared case-insensitively, the first spelling seen is the one stored
+                offsets = defaultdict(list)
+                spellings = {}
+                for match, start, end in extract_tags(document, 'text', tag_type, dictionaries):
+                    value = normalize_entity(tag_type, match)
+                    spellings.setdefault(value.lower(), value)
+                    offsets[value.lower()].append((start, end))
+                rows.extend((tag_type, spellings[key], accession, doc_index, len(spans), pack_offsets(spans))
+                            for key, spans in offsets.items())
+        except Exception as e:
+            print(f"Skipped: {accession}/{document.filename} due to {e}")
+    return rows
+
+
+class EntityIndex(SidecarStore):
+    """On-disk entity -> (accession, document index, offsets) index"""
+    FILENAME = ENTITIES_FILENAME
+    SCHEMA = SCHEMA
+    # a batch is indexed with one dictionary set at a time, processed is keyed by path alone
+    BUILD_COLUMN = 'dictionaries'
+
+    def drop_rows(self, conn, batch_path, build_key=None):
+        conn.execute('DELETE FROM mentions WHERE batch = ?', (batch_path,))
+
+    def write_rows(self, conn, batch_path, rows, build_key=None):
+        conn.executemany('INSERT OR REPLACE INTO mentions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         [(*row[:4], batch_path, *row[4:]) for row in rows])
+
+    def build(self, dictionaries=(), workers=None, progress=print):
+        """Index new or changed batches (or all of them if the dictionaries changed). Returns batches indexed."""
+        return self.build_batches(entity_batch, args=(tuple(dictionaries),), build_key=dictionaries_key(dictionaries),
+                                  workers=workers, progress=progress, initializer=_init_worker, initargs=(tuple(dictionaries),))
+
+    def lookup(self, entity_type, value, limit=1000, with_offsets=True):
+        """Documents mentioning an entity, most mentions first"""
+        if entity_type not in TAG_TYPES or not self.exists():
+            return []
+        columns = 'accession, doc_index, count' + (', offsets' if with_offsets else '')
+        with self.connect() as conn:
+            rows = conn.execute(f'SELECT {columns} FROM mentions WHERE entity_type = ? AND value = ? '
+                                'ORDER BY count DESC, accession LIMIT ?',
+                                (entity_type, normalize_entity(entity_type, value), limit)).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            if with_offsets:
+                result['offsets'] = unpack_offsets(result['offsets'])
+            results.append(result)
+        return results
+
+    def top(self, entity_type, limit=50):
+        """Most widely mentioned entities of a type, by number of documents"""
+        if entity_type not in TAG_TYPES or not self.exists():
+            return []
+        with self.connect() as conn:
+            rows = conn.execute('SELECT value, COUNT(*) AS documents, SUM(count) AS mentions FROM mentions '
+                                'WHERE entity_type = ? GROUP BY value ORDER BY documents DESC LIMIT ?',
+                                (entity_type, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the entity reverse index of a portfolio.')
+    parser.add_argument('portfolio')
+    parser.add_argument('--dictionaries', default='', help='comma separated datamule dictionaries, e.g. 8k_2024_persons')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--lookup', nargs=2, metavar=('TYPE', 'VALUE'), default=None)
+    args = parser.parse_args()
+
+    index = EntityIndex(args.portfolio)
+    if args.lookup:
+        for result in index.lookup(*args.lookup):
+            print(f"{result['accession']}/{result['doc_index']}  {result['count']} mentions  {result['offsets'][:5]}")
+        return
+
+    dictionaries = [name.strip() for name in args.dictionaries.split(',') if name.strip()]
+    processed = index.build(dictionaries, args.workers)
+    print(f"Processed {processed} batches")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Cross-filing fundamentals panel: CIK x metric x period for every submission in a portfolio.
+
+Each submission's XBRL is turned into fundamentals the same way Submission.parse_fundamentals does, and
+every reported value is kept with the filing it came from. When several filings (an original and its amendments, or later filings restating prior years) report the same
+period, the most recently filed value wins at query time, so a metric's history is one indexed query.
+
+Usage: python -m secbrowser.fundamentals <portfolio> [--workers N] [--history CIK METRIC]
+"""
+import argparse
+from decimal import Decimal
+
+from .batches import SidecarStore, iter_batch_documents
+from .index import _submission_metadata, normalize_cik
+from .xbrl_store import is_xbrl_document
+
+FUNDAMENTALS_FILENAME = 'secbrowser_fundamentals.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS filings (
+    accession TEXT PRIMARY KEY,
+    batch TEXT,
+    cik TEXT,
+    form TEXT,
+    filing_date TEXT
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY,
+    statement TEXT,
+    name TEXT,
+    UNIQUE (statement, name)
+);
+CREATE TABLE IF NOT EXISTS observations (
+    cik TEXT,
+    metric_id INTEGER,
+    period_end TEXT,
+    period_start TEXT,
+    filing_date TEXT,
+    accession TEXT,
+    value,
+    PRIMARY KEY (cik, metric_id, period_end, period_start, filing_date, accession)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS observations_accession ON observations (accession);
+CREATE INDEX IF NOT EXISTS filings_batch ON filings (batch);
+"""
+
+
+def fundamentals_records(records):
+    """secxbrl records in the shape construct_fundamentals expects, as in Submission.parse_fundamentals"""
+    xbrl = []
+    for record in records or []:
+        try:
+            value = record.get('_val', None)
+            taxonomy, name = record['_attributes']['name'].split(':')
+
+            if record.get('_attributes', {}).get('scale') is not None:
+                scale = int(record['_attributes']['scale'])
+                try:
+                    value = str(Decimal(value.replace(',', '')) * (Decimal(10) ** scale))
+                except Exception:
+                    pass
+
+            context = record.get('_context')
+            xbrl.append({
+                'taxonomy': taxonomy,
+                'name': name,
+                'value': value,
+                'period_start_date': (context.get('period_instant') or context.get('period_startdate')) if context else None,
+                'period_end_date': context.get('period_enddate') if context else None,
+                'context': context,
+            })
+        except Exception:
+            continue
+    return xbrl
+
+
+def panel_rows(fundamentals):
+    """Flatten {statement: {metric: [periods]}} into (statement, metric, period_start, period_end, value) rows.
+
+    Instants (balance sheet items) come back from datamule with only a start date, they are stored with the
+    instant as period end and an empty period start.
+    """
+    rows = []
+    for statement, metrics in (fundamentals or {}).items():
+        for metric, periods in (metrics or {}).items():
+            for period in periods or []:
+                start, end = period.get('period_start_date'), period.get('period_end_date')
+                if not end:
+                    start, end = '', start
+                if not end:
+                    continue
+                value = period.get('value')
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    pass
+                rows.append((statement, metric, start or '', end, value))
+    return rows
+
+
+def fundamentals_batch(batch_path):
+    """Worker: the fundamentals of every submission with XBRL in one batch tar"""
+    from company_fundamentals import construct_fundamentals
+    from secxbrl import parse_inline_xbrl
+
+    filings = []
+    seen = set()
+    for accession, doc_index, metadata, document in iter_batch_documents(batch_path, select=is_xbrl_document):
+        if accession in seen:
+            continue
+        seen.add(accession)
+        form, filing_date, cik, _ = _submission_metadata(metadata)
+        try:
+            records = parse_inline_xbrl(content=document.content, file_type='extracted_inline')
+            fundamentals = construct_fundamentals(fundamentals_records(records), taxonomy_key='taxonomy', concept_key='name',
+                                                  start_date_key='period_start_date', end_date_key='period_end_date')
+        except Exception as e:
+            print(f"Skipped: {accession}/{document.filename} due to {e}")
+            continue
+        filings.append((accession, normalize_cik(cik) if cik else '', form, filing_date, panel_rows(fundamentals)))
+    return filings
+
+
+class FundamentalsPanel(SidecarStore):
+    """Per-portfolio fundamentals panel"""
+    FILENAME = FUNDAMENTALS_FILENAME
+    SCHEMA = SCHEMA
+
+    def drop_rows(self, conn, batch_path, build_key=None):
+        conn.execute('DELETE FROM observations WHERE accession IN (SELECT accession FROM filings WHERE batch = ?)', (batch_path,))
+        conn.execute('DELETE FROM filings WHERE batch = ?', (batch_path,))
+
+    def _metric_ids(self, conn, keys):
+        keys = set(keys)
+        conn.executemany('INSERT OR IGNORE INTO metrics (statement, name) VALUES (?, ?)', keys)
+        return {key: conn.execute('SELECT id FROM metrics WHERE statement = ? AND name = ?', key).fetchone()[0] for key in keys}
+
+    def write_rows(self, conn, batch_path, filings, build_key=None):
+        for accession, cik, form, filing_date, rows in filings:
+            ids = self._metric_ids(conn, [row[:2] for row in rows])
+            conn.execute('DELETE FROM observations WHERE accession = ?', (accession,))
+            conn.execute('INSERT OR REPLACE INTO filings VALUES (?, ?, ?, ?, ?)', (accession, batch_path, cik, form, filing_date))
+            conn.executemany('INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             [(cik, ids[row[:2]], row[3], row[2], filing_date, accession, row[4]) for row in rows])
+
+    def build(self, workers=None, progress=print):
+        """Add the fundamentals of new or changed batches. Returns the number of batches processed."""
+        return self.build_batches(fundamentals_batch, workers=workers, progress=progress)
+
+    def filing(self, accession):
+        """One submission's fundamentals in datamule's {statement: {metric: [periods]}} shape, or None if not in the panel"""
+        if not self.exists():
+            return None
+        with self.connect() as conn:
+            if conn.execute('SELECT 1 FROM filings WHERE accession = ?', (accession,)).fetchone() is None:
+                return None
+            rows = conn.execute('SELECT m.statement, m.name, o.period_start, o.period_end, o.value FROM observations o '
+                                'JOIN metrics m ON m.id = o.metric_id WHERE o.accession = ? ORDER BY m.statement, m.name, '
+                                'o.period_end DESC', (accession,)).fetchall()
+        fundamentals = {}
+        for row in rows:
+            fundamentals.setdefault(row['statement'], {}).setdefault(row['name'], []).append(
+                {'value': row['value'], 'period_start_date': row['period_start'] or None, 'period_end_date': row['period_end']})
+        return fundamentals
+
+    def metrics(self, cik=None):
+        """(statement, metric) pairs in the panel, optionally only those reported by one CIK"""
+        if not self.exists():
+            return []
+        with self.connect() as conn:
+            if cik:
+                rows = conn.execute('SELECT DISTINCT m.statement, m.name FROM metrics m JOIN observations o ON o.metric_id = m.id '
+                                    'WHERE o.cik = ? ORDER BY 1, 2', (normalize_cik(cik),)).fetchall()
+            else:
+                rows = conn.execute('SELECT statement, name FROM metrics ORDER BY 1, 2').fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def ciks(self):
+        if not self.exists():
+            return []
+        with self.connect() as conn:
+            return [row[0] for row in conn.execute('SELECT DISTINCT cik FROM filings ORDER BY 1')]
+
+    def history(self, cik, metric, statement=None):
+        """A metric's full history for one CIK, one value per period, latest filing first among duplicates.
+
+        filings is how many submissions reported that period, accession the one whose value is returned.
+        """
+        if not self.exists():
+            return []
+        query = ('SELECT m.statement, o.period_start, o.period_end, o.value, o.accession, MAX(o.filing_date) AS filing_date, '
+                 'COUNT(*) AS filings FROM metrics m JOIN observations o ON o.metric_id = m.id '
+                 'WHERE o.cik = ? AND m.name = ?')
+        params = [normalize_cik(cik), metric]
+        if statement:
+            query += ' AND m.statement = ?'
+            params.append(statement)
+        query += ' GROUP BY m.statement, o.period_end, o.period_start ORDER BY o.period_end, o.period_start'
+
+        with self.connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [dict(row, period_start=row['period_start'] or None) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the fundamentals panel of a portfolio.')
+    parser.add_argument('portfolio')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--history', nargs=2, metavar=('CIK', 'METRIC'), default=None)
+    args = parser.parse_args()
+
+    panel = FundamentalsPanel(args.portfolio)
+    if args.history:
+        for row in panel.history(*args.history):
+            print(f"{row['period_start'] or '':10}  {row['period_end']}  {row['value']}  ({row['accession']}, {row['filings']} filings)")
+        return
+
+    processed = panel.build(args.workers)
+    print(f"Processed {processed} batches")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import heapq
+
+SPAN_STYLE = 'background-color: {color}; color: white; padding: 2px; border-radius: 3px;'
+
+
+def bucket_by_fragment(matches):
+    """Group matches by fragment id once, so each fragment only sees its own matches"""
+    buckets = {}
+    for match in matches:
+        fragment_id = match.get('fragment_id')
+        if fragment_id is None:
+            continue
+        # doc dict keys are strings while parsed fragment ids may be ints
+        buckets.setdefault(str(fragment_id), []).append(match)
+    return buckets
+
+
+def resolve_spans(matches, length):
+    """Turn possibly overlapping matches into a well-nested list of (start, end, match), sorted by start.
+
+    Matches are ordered by start, then longest first, so a match that starts inside another is nested in it.
+    A match that crosses the end of the span it starts in is split at that end, and the remainder is
+    placed after it. Exact duplicates (same span and type) are dropped.
+    """
+    heap = []
+    for seq, match in enumerate(matches):
+        start = max(0, match['start'])
+        end = min(length, match['end'])
+        if start < end:
+            heap.append((start, -end, seq, match))
+    heapq.heapify(heap)
+
+    spans = []
+    open_ends = []  # ends of the spans enclosing the current position, innermost last
+    seen = set()
+    while heap:
+        start, neg_end, seq, match = heapq.heappop(heap)
+        end = -neg_end
+
+        while open_ends and open_ends[-1] <= start:
+            open_ends.pop()
+
+        if open_ends and end > open_ends[-1]:
+            # crosses the enclosing span, keep the inner part here and push the rest back
+            heapq.heappush(heap, (open_ends[-1], neg_end, seq, match))
+            end = open_ends[-1]
+
+        key = (start, end, match.get('type'))
+        if key in seen:
+            continue
+        seen.add(key)
+
+        spans.append((start, end, match))
+        open_ends.append(end)
+
+    return spans
+
+
+def render_span_open(match, original):
+    style = SPAN_STYLE.format(color=match['color'])
+    return f'<span style="{style}" title="{match["type"]}: {original}">'
+
+
+def highlight_text(text, matches):
+    """Wrap every match in text with a highlight span in a single left-to-right pass"""
+    if not matches:
+        return text
+
+    spans = resolve_spans(matches, len(text))
+    out = []
+    pos = 0
+    open_ends = []
+
+    for start, end, match in spans:
+        # close spans that finish before this one starts
+        while open_ends and open_ends[-1] <= start:
+            close = open_ends.pop()
+            out.append(text[pos:close])
+            out.append('</span>')
+            pos = close
+
+        out.append(text[pos:start])
+        out.append(render_span_open(match, text[start:end]))
+        pos = start
+        open_ends.append(end)
+
+    while open_ends:
+        close = open_ends.pop()
+        out.append(text[pos:close])
+        out.append('</span>')
+        pos = close
+
+    out.append(text[pos:])
+    return ''.join(out)
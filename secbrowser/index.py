@@ -0,0 +1,353 @@
+import base64
+import io
+import json
+import os
+import sqlite3
+import tarfile
+import time
+from pathlib import Path
+from threading import Lock, local
+
+from . import db
+
+INDEX_FILENAME = 'secbrowser.db'
+
+# bump when the schema or the meaning of stored values changes, the index is rebuilt from the tars
+SCHEMA_VERSION = 3
+
+# batches modified more recently than this may still be being written by a download, so they are re-checked
+# even when the directory listing hasn't changed
+SETTLE_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    indexed REAL
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    accession TEXT PRIMARY KEY,
+    batch TEXT,
+    type TEXT,
+    filing_date TEXT,
+    cik TEXT,
+    document_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS members (
+    accession TEXT,
+    name TEXT,
+    offset INTEGER,
+    size INTEGER,
+    PRIMARY KEY (accession, name)
+);
+CREATE INDEX IF NOT EXISTS submissions_batch ON submissions (batch);
+CREATE INDEX IF NOT EXISTS submissions_filing_date ON submissions (filing_date, accession);
+CREATE INDEX IF NOT EXISTS submissions_type ON submissions (type, accession);
+CREATE INDEX IF NOT EXISTS submissions_document_count ON submissions (document_count, accession);
+CREATE INDEX IF NOT EXISTS submissions_type_filing_date ON submissions (type, filing_date, accession);
+CREATE INDEX IF NOT EXISTS submissions_cik_filing_date ON submissions (cik, filing_date, accession);
+"""
+
+
+class IndexedTar:
+    """Minimal stand-in for a tarfile handle that reads members by seeking to indexed offsets"""
+    def __init__(self, path, index):
+        self.path = str(path)
+        self.index = index
+        self._file = open(path, 'rb')
+
+    def extractfile(self, name):
+        location = self.index.member(name)
+        if location is None:
+            raise KeyError(f"filename {name!r} not found")
+        offset, size = location
+        self._file.seek(offset)
+        return io.BytesIO(self._file.read(size))
+
+    def close(self):
+        self._file.close()
+
+
+def _submission_metadata(metadata):
+    """Pull the core fields we index out of a metadata.json dict. Missing values are stored as '' so they sort and page cleanly."""
+    documents = metadata.get('documents') or []
+    fd = metadata.get('filing-date')
+    filing_date = f"{fd[:4]}-{fd[4:6]}-{fd[6:8]}" if fd else ''
+
+    # ownership filings have an issuer rather than a filer, and multi-filer submissions carry a list
+    cik = ''
+    for role in ('filer', 'issuer', 'subject-company'):
+        entity = metadata.get(role)
+        if isinstance(entity, list):
+            entity = entity[0] if entity else None
+        try:
+            cik = entity.get('company-data').get('cik') or ''
+        except:
+            continue
+        if cik:
+            break
+
+    submission_type = metadata.get('type')
+    if not submission_type and documents:
+        submission_type = documents[0].get('type')
+
+    return submission_type or '', filing_date, cik, len(documents)
+
+
+def normalize_cik(cik):
+    cik = str(cik).strip()
+    return cik.zfill(10) if cik.isdigit() else cik
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+
+
+SORT_COLUMNS = ('filing_date', 'type', 'document_count')
+
+
+class PortfolioIndex:
+    """On-disk accession index for a portfolio's batch tars, stored next to the batches.
+
+    One process owns the index and writes it. In read-only processes (secbrowser.serve's workers) refresh does
+    nothing, the serving parent indexes new batches and readers see them on their next query.
+    """
+    def __init__(self, portfolio_path):
+        self.portfolio_path = Path(portfolio_path)
+        self.path = self.portfolio_path / INDEX_FILENAME
+        self._lock = Lock()
+        self._local = local()
+        # directory mtime at the last scan, and batches that were still changing then
+        self._dir_mtime = None
+        self._settling = set()
+
+        if db.read_only and self.path.exists():
+            return
+        with self.connect() as conn:
+            if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                conn.executescript('DROP TABLE IF EXISTS batches; DROP TABLE IF EXISTS submissions; DROP TABLE IF EXISTS members;')
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        """This thread's connection, opened on first use. Every document read looks up its tar member here, a
+        connection per lookup cost more than the lookup."""
+        # a connection can't be used across a fork, serve's workers open their own
+        if getattr(self._local, 'pid', None) != os.getpid():
+            # the schema is created, or recreated for a new SCHEMA_VERSION, by __init__
+            conn = db.connect(self.path, '')
+            conn.row_factory = sqlite3.Row
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    def batch_tars(self):
+        if not self.portfolio_path.exists():
+            return []
+        return sorted(f for f in self.portfolio_path.iterdir()
+                      if f.is_file() and 'batch' in f.name and f.suffix == '.tar')
+
+    def refresh(self):
+        """Index new or modified batch tars and drop batches that no longer exist. Returns number of batches indexed."""
+        return sum(1 for _ in self.refresh_iter())
+
+    def refresh_iter(self):
+        """Index new or modified batch tars one at a time, yielding (batch path, submission rows) after each,
+        so callers can show submissions while the rest of the portfolio is still being indexed"""
+        if db.read_only:
+            return
+        with self._lock:
+            changed = self._scan()
+
+        for path, signature in changed:
+            with self._lock:
+                # another refresh may have got to it first
+                if self._signature(path) == signature:
+                    continue
+                rows = self._index_batch(path, signature)
+            if rows is not None:
+                yield path, rows
+
+    def _scan(self):
+        """Drop batches that no longer exist and return [(path, (mtime, size))] of those needing indexing.
+
+        The directory is only listed when its mtime changed, i.e. a batch was added, removed or renamed. Otherwise
+        only batches that were still being written at the last scan are stat'ed again.
+        """
+        with self.connect() as conn:
+            known = {row['path']: (row['mtime'], row['size']) for row in conn.execute('SELECT * FROM batches')}
+
+        try:
+            dir_mtime = self.portfolio_path.stat().st_mtime
+        except FileNotFoundError:
+            dir_mtime = None
+        now = time.time()
+
+        # a recent directory mtime can't be trusted to change again within its timestamp resolution
+        if dir_mtime is not None and dir_mtime == self._dir_mtime and now - dir_mtime > SETTLE_SECONDS:
+            paths = self._settling
+            removed = []
+        else:
+            paths = [str(batch_tar) for batch_tar in self.batch_tars()]
+            removed = [path for path in known if path not in set(paths)]
+
+        on_disk = {}
+        for path in paths:
+            try:
+                stat = Path(path).stat()
+            except FileNotFoundError:
+                continue
+            on_disk[path] = (stat.st_mtime, stat.st_size)
+
+        for path in removed:
+            self._drop_batch(path)
+
+        self._dir_mtime = dir_mtime
+        self._settling = {path for path, (mtime, _) in on_disk.items() if now - mtime < SETTLE_SECONDS}
+        return [(path, signature) for path, signature in sorted(on_disk.items()) if known.get(path) != signature]
+
+    def _signature(self, batch_path):
+        with self.connect() as conn:
+            row = conn.execute('SELECT mtime, size FROM batches WHERE path = ?', (batch_path,)).fetchone()
+        return (row['mtime'], row['size']) if row else None
+
+    def _drop_batch(self, batch_path):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM members WHERE accession IN (SELECT accession FROM submissions WHERE batch = ?)', (batch_path,))
+            conn.execute('DELETE FROM submissions WHERE batch = ?', (batch_path,))
+            conn.execute('DELETE FROM batches WHERE path = ?', (batch_path,))
+
+    def _index_batch(self, batch_path, signature):
+        """Walk one batch tar once, recording member offsets and submission metadata. Returns the submission rows,
+        or None if the tar couldn't be read (a batch that is still being written is retried on the next refresh)."""
+        members = []
+        submissions = []
+        try:
+            with tarfile.open(batch_path, 'r') as tar:
+                for member in tar:
+                    if not member.isfile() or '/' not in member.name:
+                        continue
+                    accession = member.name.split('/')[0]
+                    members.append((accession, member.name, member.offset_data, member.size))
+
+                    if member.name.endswith('metadata.json'):
+                        metadata = json.loads(tar.extractfile(member).read().decode('utf-8'))
+                        submissions.append((accession, batch_path, *_submission_metadata(metadata)))
+        except Exception as e:
+            print(f"Path: {batch_path}. Exception: {e}")
+            return
+
+        self._drop_batch(batch_path)
+        with self.connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO submissions VALUES (?, ?, ?, ?, ?, ?)', submissions)
+            conn.executemany('INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?)', members)
+            conn.execute('INSERT OR REPLACE INTO batches VALUES (?, ?, ?, ?)', (batch_path, *signature, time.time()))
+        return submissions
+
+    def last_indexed(self):
+        """When the most recently indexed batch was, a position to follow the index from with indexed_since"""
+        with self.connect() as conn:
+            return conn.execute('SELECT COALESCE(MAX(indexed), 0) FROM batches').fetchone()[0]
+
+    def indexed_since(self, since):
+        """[(batch path, indexed)] of the batches indexed after since, whichever process indexed them"""
+        with self.connect() as conn:
+            return [(row['path'], row['indexed']) for row in
+                    conn.execute('SELECT path, indexed FROM batches WHERE indexed > ? ORDER BY indexed', (since,))]
+
+    def batch_submissions(self, batch_path):
+        with self.connect() as conn:
+            return [dict(row) for row in conn.execute('SELECT accession, type, filing_date, cik, document_count FROM submissions '
+                                                      'WHERE batch = ? ORDER BY accession', (batch_path,))]
+
+    def lookup(self, accession):
+        """Return the indexed row for an accession, or None"""
+        with self.connect() as conn:
+            row = conn.execute('SELECT * FROM submissions WHERE accession = ?', (accession,)).fetchone()
+        return dict(row) if row else None
+
+    def previous_filing(self, accession):
+        """Return the row of the same filer's latest earlier submission of the same type, or None"""
+        row = self.lookup(accession)
+        if row is None or not row['cik']:
+            return None
+        with self.connect() as conn:
+            previous = conn.execute('SELECT * FROM submissions WHERE cik = ? AND type = ? AND (filing_date, accession) < (?, ?) '
+                                    'ORDER BY filing_date DESC, accession DESC LIMIT 1',
+                                    (row['cik'], row['type'], row['filing_date'], accession)).fetchone()
+        return dict(previous) if previous else None
+
+    def count(self):
+        with self.connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM submissions').fetchone()[0]
+
+    def page(self, sort='filing_date', descending=True, submission_types=None, cik=None, date_from=None, date_to=None,
+             limit=50, cursor=None):
+        """Return (rows, next_cursor) for one page of submissions, using keyset paging so every page costs the same"""
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort: {sort}")
+
+        where = []
+        params = []
+        if submission_types:
+            where.append(f"type IN ({', '.join('?' for _ in submission_types)})")
+            params.extend(submission_types)
+        if cik:
+            where.append('cik = ?')
+            params.append(normalize_cik(cik))
+        if date_from:
+            where.append('filing_date >= ?')
+            params.append(date_from)
+        if date_to:
+            where.append('filing_date <= ?')
+            params.append(date_to)
+        if cursor:
+            # resume strictly after the last row of the previous page
+            where.append(f"({sort}, accession) {'<' if descending else '>'} (?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        order = 'DESC' if descending else 'ASC'
+        sql = 'SELECT * FROM submissions'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {sort} {order}, accession {order} LIMIT ?'
+        params.append(limit + 1)
+
+        with self.connect() as conn:
+            rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][sort], rows[-1]['accession']])
+        return rows, next_cursor
+
+    def member(self, name):
+        """Return (offset, size) of a tar member such as '<accession>/<filename>', or None"""
+        accession = name.split('/')[0]
+        with self.connect() as conn:
+            row = conn.execute('SELECT offset, size FROM members WHERE accession = ? AND name = ?', (accession, name)).fetchone()
+        return (row['offset'], row['size']) if row else None
+
+    def load_submission(self, portfolio, accession):
+        """Build a Submission for an indexed accession without loading the rest of the portfolio"""
+        from datamule import Submission
+
+        row = self.lookup(accession)
+        if row is None:
+            self.refresh()
+            row = self.lookup(accession)
+            if row is None:
+                return None
+
+        batch_tar_path = Path(row['batch'])
+        # datamule keys handles by the path it found while scanning the portfolio directory
+        if batch_tar_path not in portfolio.batch_tar_handles:
+            portfolio.batch_tar_handles[batch_tar_path] = IndexedTar(batch_tar_path, self)
+            portfolio.batch_tar_locks[batch_tar_path] = Lock()
+
+        return Submission(batch_tar_path=batch_tar_path, accession=accession, portfolio_ref=portfolio)
@@ -0,0 +1,267 @@
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event, Lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT,
+    params TEXT,
+    status TEXT,
+    progress TEXT,
+    error TEXT,
+    created REAL,
+    started REAL,
+    finished REAL
+);
+"""
+
+# statuses a job can still move out of
+ACTIVE_STATUSES = ('queued', 'running')
+
+# jobs that only build sidecar indexes and leave the portfolio's batches untouched
+INDEX_KINDS = ('precompute_tags', 'build_search', 'build_entities', 'build_sentiment', 'build_xbrl', 'build_fundamentals')
+
+
+def terminate_children(signum=None, frame=None):
+    """SIGTERM handler of job processes: end the worker pools the job started before exiting, terminating only
+    the job process would leave them running, writing to the sidecar file"""
+    for child in multiprocessing.active_children():
+        child.terminate()
+    for child in multiprocessing.active_children():
+        child.join()
+    os._exit(128 + signal.SIGTERM)
+
+
+def run_job(kind, params):
+    """Entry point for the job subprocess. Imports datamule here so the parent never pays for it."""
+    signal.signal(signal.SIGTERM, terminate_children)
+    if kind in INDEX_KINDS:
+        # job processes are daemonic, which would stop the indexers from starting their worker pool
+        multiprocessing.current_process().daemon = False
+        if kind == 'precompute_tags':
+            from .tag_store import precompute
+            precompute(params['path'], params.get('dictionaries', []), params.get('workers'))
+        elif kind == 'build_search':
+            from .search import SearchIndex
+            SearchIndex(params['path']).build(params.get('workers'))
+        elif kind == 'build_entities':
+            from .entities import EntityIndex
+            EntityIndex(params['path']).build(params.get('dictionaries', []), params.get('workers'))
+        elif kind == 'build_xbrl':
+            from .xbrl_store import XBRLStore
+            XBRLStore(params['path']).build(params.get('workers'))
+        elif kind == 'build_fundamentals':
+            from .fundamentals import FundamentalsPanel
+            FundamentalsPanel(params['path']).build(params.get('workers'))
+        else:
+            from .sentiment import SentimentStore
+            SentimentStore(params['path']).build(params['document_type'], params.get('workers'))
+        return
+
+    from datamule import Portfolio
+
+    portfolio = Portfolio(params['path'])
+    if kind == 'download':
+        portfolio.download_submissions(**params.get('kwargs', {}))
+    elif kind == 'compress':
+        portfolio.compress()
+    elif kind == 'decompress':
+        portfolio.decompress()
+    elif kind == 'delete':
+        portfolio.delete()
+    else:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+
+def directory_progress(path):
+    """Cheap progress signal for portfolio jobs: how many batch tars and bytes are on disk"""
+    path = Path(path)
+    if not path.exists():
+        return {'files': 0, 'bytes': 0}
+    files = [f for f in path.iterdir() if f.is_file()]
+    return {
+        'files': len(files),
+        'batches': sum(1 for f in files if 'batch' in f.name and f.suffix == '.tar'),
+        'bytes': sum(f.stat().st_size for f in files),
+    }
+
+
+def recover_jobs(db_path):
+    """Flag jobs that were cut off by a restart as interrupted, and return the ids of jobs that never started"""
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        conn.executescript(SCHEMA)
+        conn.execute("UPDATE jobs SET status = 'interrupted', finished = ? WHERE status = 'running'", (time.time(),))
+        return [row[0] for row in conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created")]
+
+
+class JobManager:
+    """Runs long portfolio operations in subprocesses, supervised by a bounded thread pool, with state kept in sqlite.
+
+    Several managers (one per serve worker) can share a database as long as only one of them recovers it,
+    at startup, see recover_jobs.
+    """
+    def __init__(self, db_path, max_workers=2, poll_interval=1.0, on_finish=None, recover=True):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.on_finish = on_finish
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='secbrowser-job')
+        self._cancel_events = {}
+        self._lock = Lock()
+        # spawn so the job process doesn't inherit the server's threads and open tar handles
+        self._context = multiprocessing.get_context('spawn')
+
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+        if recover:
+            self.resume(recover_jobs(self.db_path))
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def resume(self, job_ids):
+        """Schedule queued jobs, e.g. the ones recover_jobs found after a restart"""
+        for job_id in job_ids:
+            self._schedule(job_id)
+
+    def _update(self, job_id, **fields):
+        if 'progress' in fields:
+            fields['progress'] = json.dumps(fields['progress'])
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        with self.connect() as conn:
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def submit(self, kind, **params):
+        """Queue a job and return its id immediately"""
+        job_id = uuid.uuid4().hex
+        with self.connect() as conn:
+            conn.execute('INSERT INTO jobs (id, kind, params, status, progress, created) VALUES (?, ?, ?, ?, ?, ?)',
+                         (job_id, kind, json.dumps(params), 'queued', json.dumps({}), time.time()))
+        self._schedule(job_id)
+        return job_id
+
+    def retry(self, job_id):
+        job = self.get(job_id)
+        if job is None or job['status'] in ACTIVE_STATUSES:
+            return None
+        return self.submit(job['kind'], **job['params'])
+
+    def _schedule(self, job_id):
+        with self._lock:
+            self._cancel_events[job_id] = Event()
+        self._executor.submit(self._supervise, job_id)
+
+    def _supervise(self, job_id):
+        """Run a queued job in its own process until it ends. Whatever happens the job's cancel event is dropped,
+        a job claimed here doesn't stay 'running', and on_finish hears of every job that ended here, one cancelled
+        before it started included."""
+        claimed, ended, process = False, False, None
+        try:
+            job = self.get(job_id)
+            cancel = self._cancel_events[job_id]
+            if job is None:
+                return
+            if job['status'] == 'queued' and cancel.is_set():
+                # cancel set the event but hasn't marked it in the database yet
+                self._update(job_id, status='cancelled', finished=time.time())
+                job['status'] = 'cancelled'
+            if job['status'] == 'cancelled':
+                # cancelled while it waited for a worker
+                ended = True
+                return
+
+            # claim it, another manager sharing the database may have been asked to cancel it meanwhile
+            with self.connect() as conn:
+                claimed = conn.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ? AND status = 'queued'",
+                                       (time.time(), job_id)).rowcount
+            if not claimed:
+                return
+
+            process = self._context.Process(target=run_job, args=(job['kind'], job['params']), daemon=True)
+            process.start()
+
+            while process.is_alive():
+                process.join(self.poll_interval)
+                # cancelled here, or by another manager that marked it in the database
+                if not cancel.is_set() and self.get(job_id)['status'] == 'cancelled':
+                    cancel.set()
+                if cancel.is_set():
+                    # the job process ends the pools it started on SIGTERM, see terminate_children
+                    process.terminate()
+                    process.join()
+                    break
+                self._update(job_id, progress=directory_progress(job['params']['path']))
+
+            if cancel.is_set():
+                status, error = 'cancelled', None
+            elif process.exitcode == 0:
+                status, error = 'done', None
+            else:
+                status, error = 'failed', f'exit code {process.exitcode}'
+
+            self._update(job_id, status=status, error=error, finished=time.time(),
+                         progress=directory_progress(job['params']['path']))
+            ended = True
+        except Exception as e:
+            print(f"Error supervising job {job_id}: {e}")
+            if process is not None and process.is_alive():
+                process.terminate()
+                process.join()
+            if claimed:
+                self._update(job_id, status='failed', error=str(e), finished=time.time())
+                ended = True
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+            if ended and self.on_finish is not None:
+                self.on_finish(self.get(job_id))
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or terminate a running one. Returns False if the job is already finished."""
+        job = self.get(job_id)
+        if job is None or job['status'] not in ACTIVE_STATUSES:
+            return False
+
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+        if job['status'] == 'queued' or event is None:
+            # a running job without an event here belongs to another manager, which picks this up when it polls
+            self._update(job_id, status='cancelled', finished=time.time())
+        return True
+
+    def get(self, job_id):
+        with self.connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, limit=100):
+        with self.connect() as conn:
+            rows = conn.execute('SELECT * FROM jobs ORDER BY created DESC LIMIT ?', (limit,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def _to_dict(self, row):
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['progress'] = json.loads(job['progress']) if job['progress'] else {}
+        end = job['finished'] or time.time()
+        job['elapsed'] = round(end - job['started'], 1) if job['started'] else None
+        return job
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def default_jobs_db():
+    return os.environ.get('SECBROWSER_JOBS_DB', os.path.join(os.path.expanduser('~'), '.secbrowser', 'jobs.db'))
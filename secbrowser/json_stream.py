@@ -0,0 +1,83 @@
+"""Streaming JSON for large parsed documents.
+
+The top levels of the tree are written piece by piece and everything below STREAM_DEPTH is encoded in one
+call, with orjson when it is installed, so memory is bounded by the largest subtree rather than the whole
+document, and the encoding itself stays in C.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# levels of nesting written incrementally, deeper values are encoded whole
+STREAM_DEPTH = 3
+
+# how much encoded output to collect before handing a chunk to the server
+CHUNK_SIZE = 64 * 1024
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def encode(value):
+    """One value as JSON bytes, with the fast backend if available"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS, default=str)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the stdlib encoder handles
+            pass
+    return _encoder.encode(value).encode('utf-8')
+
+
+def select_path(data, path):
+    """The subtree at a dotted path such as document.part1.item7. List items are addressed by index, and
+    numeric parts also match doc2dict's integer section ids.
+
+    Raises KeyError if the path doesn't exist.
+    """
+    node = data
+    for part in path.split('.') if path else []:
+        if isinstance(node, dict) and part in node:
+            node = node[part]
+        elif isinstance(node, dict) and part.lstrip('-').isdigit() and int(part) in node:
+            node = node[int(part)]
+        elif isinstance(node, list) and part.lstrip('-').isdigit() and -len(node) <= int(part) < len(node):
+            node = node[int(part)]
+        else:
+            raise KeyError(path)
+    return node
+
+
+def _iter_json(value, depth):
+    if depth >= STREAM_DEPTH or not isinstance(value, (dict, list)) or not value:
+        yield encode(value)
+    elif isinstance(value, dict):
+        separator = b'{'
+        for key, child in value.items():
+            yield separator + encode(key if isinstance(key, str) else str(key)) + b':'
+            yield from _iter_json(child, depth + 1)
+            separator = b','
+        yield b'}'
+    else:
+        separator = b'['
+        for child in value:
+            yield separator
+            yield from _iter_json(child, depth + 1)
+            separator = b','
+        yield b']'
+
+
+def iter_json(value):
+    """Yield value as JSON in chunks of roughly CHUNK_SIZE bytes"""
+    buffer = []
+    size = 0
+    for piece in _iter_json(value, 0):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
@@ -0,0 +1,177 @@
+"""In-process latency and counter metrics, exposed in the Prometheus text format on /metrics.
+
+Requests are timed per route, and the expensive steps inside them (loading from the batch tar, parsing
+document.data, tag extraction, similarity, rendering) per phase, so a slow page can be attributed to one of
+them. Phases timed while a request is being handled are also collected for its Server-Timing header.
+
+Metrics live in the process that recorded them, so under serve.py each worker reports its own.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# seconds, from a cached page hit to a full render of a large 10-K
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# phase name -> seconds for the request being handled in this context, None outside of one
+_request_timings = ContextVar('secbrowser_request_timings', default=None)
+
+
+def _label_text(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def lines(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_label_text(self.labelnames, key)} {_number(value)}' for key, value in values]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label combination"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}  # {label values: [bucket counts..., sum]}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def lines(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_label_text(self.labelnames, key, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{_label_text(self.labelnames, key)} {_number(counts[-1])}')
+            lines.append(f'{self.name}_count{_label_text(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('secbrowser_request_duration_seconds',
+                            'Time from receiving a request to the last byte of its response',
+                            ('route', 'method', 'status'))
+PHASE_SECONDS = Histogram('secbrowser_phase_duration_seconds', 'Time spent in one step of handling a request',
+                          ('phase',))
+BYTES_READ = Counter('secbrowser_document_bytes_read_total', 'Raw document bytes loaded from the portfolio')
+MATCHES_FOUND = Counter('secbrowser_tag_matches_total', 'Tag matches found, by tag type and where they came from',
+                        ('tag_type', 'source'))
+
+METRICS = [REQUEST_SECONDS, PHASE_SECONDS, BYTES_READ, MATCHES_FOUND]
+
+
+def start_request():
+    """Start collecting phase timings for the request handled in this context"""
+    _request_timings.set({})
+
+
+def request_timings():
+    """{phase: seconds} recorded so far for the current request, or None outside of one"""
+    return _request_timings.get()
+
+
+def observe_phase(name, seconds):
+    PHASE_SECONDS.observe(seconds, phase=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    """Time the enclosed block as one phase of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(name, time.perf_counter() - start)
+
+
+def timed_iter(name, iterable):
+    """Yield from iterable, timing only the work done producing items as phase name.
+
+    For streamed bodies, which are produced after the response headers went out, so they are in the
+    histograms but never in Server-Timing.
+    """
+    iterator = iter(iterable)
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        PHASE_SECONDS.observe(elapsed, phase=name)
+
+
+def server_timing(timings, total=None):
+    """Server-Timing header value for {phase: seconds}, in milliseconds"""
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def exposition(extra=()):
+    """All metrics in the Prometheus text format. extra is (name, kind, help, [(labels dict, value)]) for
+    values owned elsewhere, such as cache hit counts and sizes, read at scrape time."""
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.lines())
+    for name, kind, help, samples in extra:
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{_label_text(labels.keys(), labels.values())} {_number(value)}')
+    return '\n'.join(lines) + '\n'
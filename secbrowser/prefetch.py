@@ -0,0 +1,101 @@
+"""Background loading and parsing of a submission's documents, so opening one after the submission page is
+a cache hit instead of a tar read plus a doc2dict parse on the request thread.
+
+One submission is prefetched at a time: starting another (the user opened a different submission) or
+cancel() drops whatever hasn't started yet. A document that is already being parsed is finished, since
+the parse can't be interrupted, and a request for it waits for that instead of parsing it a second time.
+
+Workers are threads, not processes, because the results have to end up in this process's document cache
+and a parsed tree costs more to pickle across than to build. Keep the pool small, parsing holds the GIL.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# only these are parsed by datamule into document.data, images and PDFs are left alone
+PARSED_EXTENSIONS = ('.htm', '.html', '.txt', '.xml')
+
+# parsed trees are a few times the size of the raw document, see cache.document_size
+PARSED_SIZE_FACTOR = 3
+
+
+def prefetch_order(documents, submission_type, max_documents, max_bytes):
+    """Indexes of the documents worth prefetching, main document first then in sequence order, stopping at
+    max_documents or once their estimated parsed size would pass max_bytes"""
+    def priority(item):
+        doc_index, doc = item
+        sequence = doc.get('sequence', '')
+        return (doc.get('type') != submission_type, int(sequence) if sequence.isdigit() else doc_index)
+
+    order = []
+    total = 0
+    for doc_index, doc in sorted(enumerate(documents), key=priority):
+        filename = (doc.get('filename') or doc.get('sequence', '') + '.txt').lower()
+        if not filename.endswith(PARSED_EXTENSIONS):
+            continue
+        size = int(doc.get('secsgml_size_bytes') or 0) * PARSED_SIZE_FACTOR
+        if order and total + size > max_bytes:
+            break
+        order.append(doc_index)
+        total += size
+        if len(order) >= max_documents:
+            break
+    return order
+
+
+class Prefetcher:
+    """Runs one batch of prefetch tasks at a time on a small thread pool"""
+    def __init__(self, max_workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='secbrowser-prefetch') if max_workers else None
+        self._lock = threading.Lock()
+        self._name = None
+        self._cancelled = threading.Event()
+        self._futures = {}
+
+    def start(self, name, tasks):
+        """Cancel the current batch and queue tasks, a list of (key, function), in order"""
+        self.cancel()
+        if self._executor is None:
+            return
+        with self._lock:
+            self._name = name
+            self._cancelled = cancelled = threading.Event()
+            self._futures = {key: self._executor.submit(self._run, cancelled, key, function) for key, function in tasks}
+
+    def _run(self, cancelled, key, function):
+        if cancelled.is_set():
+            return
+        try:
+            function()
+        except Exception as e:
+            print(f"Prefetch of {key} failed: {e}")
+
+    def cancel(self, name=None):
+        """Drop the queued tasks of the current batch (only if it is name, when given). Returns how many."""
+        with self._lock:
+            if name is not None and name != self._name:
+                return 0
+            self._cancelled.set()
+            dropped = sum(future.cancel() for future in self._futures.values())
+            self._name = None
+            self._futures = {}
+        return dropped
+
+    def wait(self, key):
+        """Called before loading key on a request thread: waits if it is being prefetched right now, and
+        takes it out of the queue if it hasn't started, since the request is about to load it anyway"""
+        with self._lock:
+            future = self._futures.get(key)
+        if future is None or future.cancel():
+            return
+        future.result()
+
+    def status(self):
+        with self._lock:
+            futures = list(self._futures.values())
+            name = self._name
+        return {
+            'name': name,
+            'queued': sum(1 for f in futures if not f.running() and not f.done()),
+            'running': sum(1 for f in futures if f.running()),
+            'done': sum(1 for f in futures if f.done() and not f.cancelled()),
+        }
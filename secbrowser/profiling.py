@@ -0,0 +1,221 @@
+"""On-demand profiling of single requests, for finding out why one particular filing renders slowly.
+
+Only installed when a token is configured (SECBROWSER_PROFILE_TOKEN), so without one there is nothing in
+the request path at all. With it, a request carrying the token and a mode, either as headers
+
+    X-Secbrowser-Profile: cprofile | sample
+    X-Secbrowser-Profile-Token: <token>
+
+or as ?_profile=<mode>&_profile_token=<token>, is profiled from the start of the view to the last byte of
+its (possibly streamed) body. The response is served as usual with an X-Profile-Id header, and the profile
+is written to the profile directory once the body is done:
+
+    cprofile  deterministic, <id>.prof (pstats, for snakeviz or gprof2dot) and <id>.txt (call tree by
+              cumulative time)
+    sample    stack samples of the request's thread, <id>.folded (collapsed stacks for flamegraph.pl or
+              speedscope) and <id>.txt (hottest stacks). Lower overhead, resolution is limited by the GIL
+              switch interval.
+
+Profiles are listed on /api/profiles and fetched from /api/profiles/<file>, with the same token.
+"""
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from werkzeug.wrappers import Request, Response
+from werkzeug.wsgi import ClosingIterator
+
+MODES = ('cprofile', 'sample')
+
+# seconds between stack samples. In practice samples of CPU bound code are spaced by the GIL switch interval.
+SAMPLE_INTERVAL = 0.001
+
+# how many profiled requests to keep on disk, oldest are deleted first
+KEEP = 50
+
+
+class CProfiler:
+    """cProfile, enabled only while the request's own code runs"""
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+
+    def resume(self):
+        self.profile.enable()
+
+    def pause(self):
+        self.profile.disable()
+
+    def save(self, base):
+        import io
+        import pstats
+
+        self.profile.dump_stats(f'{base}.prof')
+        out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=out).sort_stats('cumulative')
+        stats.print_stats(80)
+        stats.print_callees(40)
+        Path(f'{base}.txt').write_text(out.getvalue())
+
+
+class Sampler:
+    """Samples the stack of one thread from a background thread, counting collapsed stacks"""
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.active = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='secbrowser-sampler', daemon=True)
+        self.thread.start()
+
+    def resume(self):
+        self.active.set()
+
+    def pause(self):
+        self.active.clear()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.active.wait(0.1)
+            if self.stopped.is_set() or not self.active.is_set():
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def save(self, base):
+        self.stopped.set()
+        self.active.set()
+        self.thread.join()
+
+        Path(f'{base}.folded').write_text(''.join(f'{stack} {count}\n' for stack, count in self.stacks.items()))
+        total = sum(self.stacks.values()) or 1
+        lines = [f'{total} samples']
+        for stack, count in self.stacks.most_common(40):
+            lines.append(f'{count / total:6.1%}  {" <- ".join(reversed(stack.split(";")[-3:]))}')
+        Path(f'{base}.txt').write_text('\n'.join(lines) + '\n')
+
+
+class ProfilingMiddleware:
+    """WSGI middleware profiling requests that ask for it with the right token"""
+    def __init__(self, wsgi_app, token, directory, keep=KEEP):
+        self.wsgi_app = wsgi_app
+        self.token = token
+        self.directory = Path(directory)
+        self.keep = keep
+        # one profiled request at a time, profiles of concurrent requests would be mixed up
+        self._lock = threading.Lock()
+
+    def authorized(self, request):
+        token = request.headers.get('X-Secbrowser-Profile-Token') or request.args.get('_profile_token') or ''
+        return hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        mode = request.headers.get('X-Secbrowser-Profile') or request.args.get('_profile')
+        if not mode:
+            return self.wsgi_app(environ, start_response)
+
+        if not self.authorized(request):
+            return Response('Invalid profile token', status=403)(environ, start_response)
+        if mode not in MODES:
+            return Response(f'Unknown profile mode, use one of {", ".join(MODES)}', status=400)(environ, start_response)
+        if not self._lock.acquire(blocking=False):
+            return Response('Another request is being profiled', status=429)(environ, start_response)
+
+        profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        profiler = CProfiler() if mode == 'cprofile' else Sampler()
+
+        def profiled_start_response(status, headers, exc_info=None):
+            headers.append(('X-Profile-Id', profile_id))
+            return start_response(status, headers, exc_info)
+
+        def finish():
+            try:
+                if hasattr(body, 'close'):
+                    body.close()
+            finally:
+                self.save(profiler, profile_id)
+
+        profiler.resume()
+        try:
+            body = self.wsgi_app(environ, profiled_start_response)
+        except BaseException:
+            self.save(profiler, profile_id)
+            raise
+        profiler.pause()
+        return ClosingIterator(self.profiled_body(body, profiler), [finish])
+
+    def save(self, profiler, profile_id):
+        try:
+            profiler.pause()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            profiler.save(self.directory / profile_id)
+            self.prune()
+        finally:
+            self._lock.release()
+
+    def profiled_body(self, body, profiler):
+        """Iterate the response body with the profiler running, paused while the server writes each chunk"""
+        iterator = iter(body)
+        while True:
+            profiler.resume()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                profiler.pause()
+            yield chunk
+
+    def prune(self):
+        ids = sorted({f.name.split('.')[0] for f in self.directory.iterdir()})
+        for stale in ids[:-self.keep] if len(ids) > self.keep else []:
+            for f in self.directory.glob(f'{stale}.*'):
+                f.unlink()
+
+    def listing(self):
+        """Stored profiles, newest first"""
+        if not self.directory.exists():
+            return []
+        files = {}
+        for f in self.directory.iterdir():
+            files.setdefault(f.name.split('.')[0], []).append(f.name)
+        return [{'id': profile_id, 'files': sorted(names)} for profile_id, names in sorted(files.items(), reverse=True)]
+
+
+def install(app, token, directory):
+    """Wrap app in the profiling middleware and add the routes serving stored profiles"""
+    from flask import abort, jsonify, request, send_from_directory
+
+    middleware = ProfilingMiddleware(app.wsgi_app, token, directory)
+    app.wsgi_app = middleware
+
+    def require_token():
+        if not middleware.authorized(request):
+            abort(403)
+
+    @app.route('/api/profiles')
+    def profiles_api():
+        require_token()
+        return jsonify(middleware.listing())
+
+    @app.route('/api/profiles/<name>')
+    def profile_file(name):
+        require_token()
+        mimetype = 'application/octet-stream' if name.endswith('.prof') else 'text/plain'
+        return send_from_directory(middleware.directory, name, mimetype=mimetype)
+
+    return middleware
@@ -0,0 +1,108 @@
+"""Serving a document's raw bytes straight from disk: where they live, a seekable view of a tar member,
+and streaming gzip/brotli for text types."""
+import io
+import zlib
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CHUNK_SIZE = 64 * 1024
+
+# below this, compressing costs more than it saves
+MIN_COMPRESS_SIZE = 1024
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/xml', 'image/svg+xml', 'text/javascript')
+
+
+class MemberFile(io.RawIOBase):
+    """Read-only, seekable view of size bytes at offset in a batch tar.
+
+    Deliberately has no fileno(), so a server's sendfile path can't send past the end of the member.
+    """
+    def __init__(self, path, offset, size):
+        self._file = open(path, 'rb')
+        self.offset = offset
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.size
+        self.position = max(0, min(position, self.size))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        self._file.seek(self.offset + self.position)
+        read = self._file.readinto(memoryview(buffer)[:length])
+        self.position += read
+        return read
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def document_location(submission, doc_index, index):
+    """Where a document's bytes are on disk: ('member', batch tar, offset, size), ('file', path), or None
+    when they are only available by loading the document (old style tar submissions)"""
+    doc = submission.metadata.content['documents'][doc_index]
+    filename = doc.get('filename') or doc['sequence'] + '.txt'
+
+    if getattr(submission, 'batch_tar_path', None) is not None:
+        location = index.member(f'{submission.accession}/{filename}')
+        if location is not None:
+            return ('member', str(submission.batch_tar_path), *location)
+        return None
+
+    path = getattr(submission, 'path', None)
+    if path is not None and Path(path).is_dir() and (Path(path) / filename).is_file():
+        return ('file', Path(path) / filename)
+    return None
+
+
+def is_compressible(mimetype):
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encodings, mimetype, size=None):
+    """Pick br or gzip from the request's Accept-Encoding for a text body (size None if not known up front),
+    or None to send it as is"""
+    if (size is not None and size < MIN_COMPRESS_SIZE) or not is_compressible(mimetype):
+        return None
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_chunks(chunks, encoding):
+    """Compress an iterable of byte chunks with encoding as it is consumed"""
+    compressor = brotli.Compressor(quality=5) if encoding == 'br' else zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.process(chunk) if encoding == 'br' else compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish() if encoding == 'br' else compressor.flush()
+
+
+def compress_stream(file, encoding):
+    """Yield file's contents compressed with encoding, a chunk at a time. The caller closes file."""
+    return compress_chunks(iter(lambda: file.read(CHUNK_SIZE), b''), encoding)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+from .cache import LRUCache
+
+_content_hashes = WeakKeyDictionary()
+
+PACKAGE_DIR = Path(__file__).resolve().parent
+
+
+def content_hash(document):
+    """sha256 of a document's raw content, computed once per Document object"""
+    digest = _content_hashes.get(document)
+    if digest is None:
+        content = document.content or b''
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        digest = hashlib.sha256(content).hexdigest()
+        _content_hashes[document] = digest
+    return digest
+
+
+@lru_cache(maxsize=None)
+def render_version():
+    """Hash of the package version, templates and code that render pages. Part of every key, so pages cached
+    on disk by an older install or before a template edit are never served."""
+    try:
+        from importlib.metadata import version
+        package_version = version('secbrowser')
+    except Exception:
+        package_version = 'unknown'
+
+    digest = hashlib.sha256(package_version.encode('utf-8'))
+    for path in sorted(PACKAGE_DIR.glob('templates/*.html')) + sorted(PACKAGE_DIR.glob('*.py')):
+        digest.update(path.name.encode('utf-8'))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def render_key(document, kind, options):
+    """Content-addressed key for one rendering of a document with the given (already flat) options"""
+    normalized = {k: sorted(v) if isinstance(v, (list, tuple)) else v for k, v in options.items()}
+    payload = json.dumps([render_version(), content_hash(document), kind, normalized], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Two tier cache of rendered pages: an in-memory LRU in front of a size-capped directory on disk"""
+    def __init__(self, memory_bytes, disk_dir, disk_bytes):
+        self.memory = LRUCache(memory_bytes, len)
+        self.disk_dir = Path(disk_dir)
+        self.disk_max_bytes = disk_bytes
+        self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_bytes = sum(f.stat().st_size for f in self.disk_dir.glob('*/*.html'))
+
+    def _path(self, key):
+        return self.disk_dir / key[:2] / f'{key}.html'
+
+    def get(self, key):
+        body = self.memory.get(key)
+        if body is not None:
+            self.hits += 1
+            return body
+
+        path = self._path(key)
+        try:
+            body = path.read_bytes()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        os.utime(path)  # mark as recently used for disk eviction
+        return self.memory.put(key, body)
+
+    def put(self, key, body):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.memory.put(key, body)
+
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            f.write(body)
+        self._commit(Path(f.name), path)
+        return body
+
+    def tee(self, key, chunks):
+        """Yield chunks through while spooling them to disk, then publish the page to both tiers once rendering
+        completes"""
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp = tempfile.NamedTemporaryFile(dir=path.parent, delete=False)
+        # kept for the memory tier unless the page outgrows it, the next hit then reads it back from disk
+        parts, size = [], 0
+        try:
+            for chunk in chunks:
+                data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                tmp.write(data)
+                if parts is not None:
+                    size += len(data)
+                    if size <= self.memory.max_bytes:
+                        parts.append(data)
+                    else:
+                        parts = None
+                yield chunk
+            tmp.close()
+            self._commit(Path(tmp.name), path)
+            if parts is not None:
+                self.memory.put(key, b''.join(parts))
+        finally:
+            # client went away or rendering failed, don't keep a partial page
+            if not tmp.closed:
+                tmp.close()
+                os.unlink(tmp.name)
+
+    def _commit(self, tmp_path, path):
+        size = tmp_path.stat().st_size
+        with self._lock:
+            if path.exists():
+                self.disk_bytes -= path.stat().st_size
+            os.replace(tmp_path, path)
+            self.disk_bytes += size
+            if self.disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # drop least recently used files until we are back under 90% of the budget
+        files = sorted(self.disk_dir.glob('*/*.html'), key=lambda f: f.stat().st_mtime)
+        target = self.disk_max_bytes * 0.9
+        for f in files:
+            if self.disk_bytes <= target:
+                break
+            self.disk_bytes -= f.stat().st_size
+            f.unlink()
+
+    def clear(self):
+        self.memory.clear()
+        with self._lock:
+            for f in self.disk_dir.glob('*/*.html'):
+                f.unlink()
+            self.disk_bytes = 0
@@ -0,0 +1,320 @@
+"""Full-text search over every document in a portfolio.
+
+A positional inverted index over document.text. Postings keep the term frequency next to delta encoded token positions, so ranking only
+reads the frequencies and positions are decoded for phrase queries alone.
+
+Usage: python -m secbrowser.search <portfolio> [--workers N] [--query "..."]
+"""
+import argparse
+import heapq
+import html
+import math
+import re
+import zlib
+from array import array
+from collections import defaultdict
+from itertools import accumulate
+
+from .batches import SidecarStore, iter_batch_documents
+from .cache import LRUCache
+
+SEARCH_FILENAME = 'secbrowser_search.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id INTEGER PRIMARY KEY,
+    accession TEXT,
+    doc_index INTEGER,
+    batch TEXT,
+    type TEXT,
+    filing_date TEXT,
+    length INTEGER
+);
+CREATE TABLE IF NOT EXISTS texts (
+    doc_id INTEGER PRIMARY KEY,
+    text BLOB
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT,
+    doc_id INTEGER,
+    tf INTEGER,
+    positions BLOB,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    documents INTEGER,
+    total_length INTEGER,
+    generation INTEGER
+);
+CREATE INDEX IF NOT EXISTS documents_batch ON documents (batch);
+CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+"""
+
+TOKEN_RE = re.compile(r'[A-Za-z0-9]+')
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+# bm25 parameters
+K1 = 1.2
+B = 0.75
+
+SNIPPET_CHARS = 160
+
+# position lists shorter than this are stored raw, zlib only pays off on longer ones
+COMPRESS_MIN_POSITIONS = 8
+
+POSTINGS_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def tokenize(text):
+    """Yield (term, start, end) for each token, with offsets into the original text"""
+    for match in TOKEN_RE.finditer(text):
+        yield match.group().lower(), match.start(), match.end()
+
+
+def encode_positions(positions):
+    """Delta encode sorted positions as uint32, zlib compressed for longer lists.
+
+    Decoding stays in C (zlib, array, accumulate), which matters when a phrase query has to check every
+    document containing a common word.
+    """
+    deltas = array('I', (position - previous for previous, position in zip([0] + positions, positions)))
+    if len(positions) < COMPRESS_MIN_POSITIONS:
+        return deltas.tobytes()
+    return zlib.compress(deltas.tobytes())
+
+
+def decode_positions(data, tf):
+    """Inverse of encode_positions. tf is stored next to the positions and tells the two layouts apart."""
+    if tf >= COMPRESS_MIN_POSITIONS:
+        data = zlib.decompress(data)
+    return list(accumulate(array('I', data)))
+
+
+def parse_query(query):
+    """Split a query into clauses of terms. Every clause must match, and a clause of several terms is a phrase.
+
+    Quoted text is a phrase, and so is a bare word like 10-K that tokenizes into more than one term.
+    """
+    clauses = []
+    for phrase, word in QUERY_RE.findall(query or ''):
+        terms = [term for term, _, _ in tokenize(phrase or word)]
+        if terms:
+            clauses.append(terms)
+    return clauses
+
+
+def index_document(text):
+    """Return (token count, {term: positions}) for one document"""
+    positions = defaultdict(list)
+    count = 0
+    for count, (term, _, _) in enumerate(tokenize(text), 1):
+        positions[term].append(count - 1)
+    return count, positions
+
+
+def index_batch(batch_path):
+    """Worker: tokenize every parseable document in one batch tar"""
+    documents = []
+    for accession, doc_index, metadata, document in iter_batch_documents(batch_path):
+        if not document._data_bool:
+            continue
+        try:
+            text = str(document.text or '')
+        except Exception as e:
+            print(f"Skipped: {accession}/{document.filename} due to {e}")
+            continue
+
+        length, positions = index_document(text)
+        postings = [(term, len(term_positions), encode_positions(term_positions))
+                    for term, term_positions in positions.items()]
+        documents.append((accession, doc_index, document.type, document.filing_date, length,
+                          zlib.compress(text.encode('utf-8')), postings))
+    return documents
+
+
+def postings_size(postings):
+    """Rough in-memory size of a term's postings dict (or a phrase's document set), for the postings cache"""
+    size = 100 * len(postings)
+    if isinstance(postings, dict):
+        for value in postings.values():
+            if isinstance(value, tuple):
+                size += len(value[1])
+    return size
+
+
+def phrase_matches(position_lists):
+    """Positions where the terms occur consecutively, given each term's positions in order"""
+    matches = set(position_lists[0])
+    for offset, positions in enumerate(position_lists[1:], 1):
+        matches &= {position - offset for position in positions}
+        if not matches:
+            break
+    return matches
+
+
+def make_snippet(text, terms, width=SNIPPET_CHARS):
+    """A short window of text around the first matching term, html escaped with the terms marked"""
+    # same token boundaries as TOKEN_RE, without tokenizing the whole document
+    pattern = re.compile(r'(?<![A-Za-z0-9])(?:' + '|'.join(map(re.escape, terms)) + r')(?![A-Za-z0-9])', re.IGNORECASE)
+    first = pattern.search(text)
+    if first is None:
+        return html.escape(text[:width])
+
+    window_start = max(0, first.start() - width // 3)
+    window_end = min(len(text), window_start + width)
+    parts = ['…' if window_start else '']
+    pos = window_start
+    for hit in pattern.finditer(text, window_start, window_end):
+        parts.append(html.escape(text[pos:hit.start()]))
+        parts.append(f'<mark>{html.escape(hit.group())}</mark>')
+        pos = hit.end()
+    parts.append(html.escape(text[pos:window_end]))
+    parts.append('…' if window_end < len(text) else '')
+    return ''.join(parts)
+
+
+class SearchIndex(SidecarStore):
+    """Positional inverted index for a portfolio"""
+    FILENAME = SEARCH_FILENAME
+    SCHEMA = SCHEMA
+
+    def __init__(self, portfolio_path, postings_cache_bytes=POSTINGS_CACHE_BYTES):
+        super().__init__(portfolio_path)
+        # (generation, {doc_id: length}) so queries don't have to read document lengths from disk
+        self._lengths = (None, {})
+        # common terms have postings in most documents, keep recently queried ones decoded in memory
+        self._postings = LRUCache(postings_cache_bytes, postings_size)
+
+    def drop_rows(self, conn, batch_path, build_key=None):
+        doc_ids = [row[0] for row in conn.execute('SELECT doc_id FROM documents WHERE batch = ?', (batch_path,))]
+        conn.executemany('DELETE FROM postings WHERE doc_id = ?', [(doc_id,) for doc_id in doc_ids])
+        conn.executemany('DELETE FROM texts WHERE doc_id = ?', [(doc_id,) for doc_id in doc_ids])
+        conn.execute('DELETE FROM documents WHERE batch = ?', (batch_path,))
+
+    def write_rows(self, conn, batch_path, documents, build_key=None):
+        for accession, doc_index, doc_type, filing_date, length, text, postings in documents:
+            doc_id = conn.execute('INSERT INTO documents (accession, doc_index, batch, type, filing_date, length) '
+                                  'VALUES (?, ?, ?, ?, ?, ?)',
+                                  (accession, doc_index, batch_path, doc_type, filing_date, length)).lastrowid
+            conn.execute('INSERT INTO texts VALUES (?, ?)', (doc_id, text))
+            conn.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)',
+                             [(term, doc_id, tf, positions) for term, tf, positions in postings])
+
+    def updated(self, conn):
+        # a new generation invalidates the cached postings and document lengths
+        conn.execute('INSERT OR REPLACE INTO stats SELECT 0, COUNT(*), COALESCE(SUM(length), 0), '
+                     '(SELECT COALESCE(MAX(generation), 0) + 1 FROM stats) FROM documents')
+
+    def build(self, workers=None, progress=print):
+        """Index new or changed batches and forget removed ones. Returns the number of batches indexed."""
+        return self.build_batches(index_batch, workers=workers, progress=progress)
+
+    def document_lengths(self, conn, generation):
+        if self._lengths[0] != generation:
+            self._lengths = (generation, dict(conn.execute('SELECT doc_id, length FROM documents').fetchall()))
+        return self._lengths[1]
+
+    def postings(self, conn, generation, term, with_positions=False):
+        """{doc_id: tf}, or {doc_id: (tf, positions blob)} with positions, for one term"""
+        def load():
+            if with_positions:
+                return {row[0]: (row[1], row[2]) for row in
+                        conn.execute('SELECT doc_id, tf, positions FROM postings WHERE term = ?', (term,))}
+            return dict(conn.execute('SELECT doc_id, tf FROM postings WHERE term = ?', (term,)).fetchall())
+        return self._postings.get_or_load((generation, term, with_positions), load)
+
+    def phrase_documents(self, conn, generation, clause):
+        """Set of documents containing the terms of clause consecutively"""
+        def load():
+            term_positions = [self.postings(conn, generation, term, with_positions=True) for term in clause]
+            common = set(term_positions[0]).intersection(*term_positions[1:])
+            return {doc_id for doc_id in common
+                    if phrase_matches([decode_positions(postings[doc_id][1], postings[doc_id][0]) for postings in term_positions])}
+        return self._postings.get_or_load((generation, 'phrase', tuple(clause)), load)
+
+    def search(self, query, limit=20, offset=0):
+        """Return (results, total) for a query, ranked by bm25. Each result has a snippet with the terms marked."""
+        clauses = parse_query(query)
+        if not clauses or not self.exists():
+            return [], 0
+
+        terms = list(dict.fromkeys(term for clause in clauses for term in clause))
+
+        with self.connect() as conn:
+            stats = conn.execute('SELECT documents, total_length, generation FROM stats').fetchone()
+            if stats is None or not stats['documents']:
+                return [], 0
+            total_docs = stats['documents']
+            average_length = stats['total_length'] / total_docs or 1
+            generation = stats['generation']
+
+            frequencies = {}
+            for term in terms:
+                frequencies[term] = self.postings(conn, generation, term)
+                if not frequencies[term]:
+                    return [], 0
+
+            # rarest term first so the candidate set shrinks as fast as possible
+            candidates = None
+            for term in sorted(terms, key=lambda t: len(frequencies[t])):
+                candidates = set(frequencies[term]) if candidates is None else candidates & frequencies[term].keys()
+                if not candidates:
+                    return [], 0
+
+            for clause in clauses:
+                if len(clause) > 1:
+                    candidates &= self.phrase_documents(conn, generation, clause)
+            if not candidates:
+                return [], 0
+
+            lengths = self.document_lengths(conn, generation)
+            scores = {doc_id: 0.0 for doc_id in candidates}
+            norms = {doc_id: K1 * (1 - B + B * lengths[doc_id] / average_length) for doc_id in candidates}
+            for term in terms:
+                term_frequencies = frequencies[term]
+                idf = math.log(1 + (total_docs - len(term_frequencies) + 0.5) / (len(term_frequencies) + 0.5))
+                for doc_id in candidates:
+                    tf = term_frequencies[doc_id]
+                    scores[doc_id] += idf * tf * (K1 + 1) / (tf + norms[doc_id])
+
+            ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda item: item[1])[offset:]
+
+            results = []
+            for doc_id, doc_score in ranked:
+                document = dict(conn.execute('SELECT accession, doc_index, type, filing_date FROM documents WHERE doc_id = ?',
+                                             (doc_id,)).fetchone())
+                text = zlib.decompress(conn.execute('SELECT text FROM texts WHERE doc_id = ?', (doc_id,)).fetchone()[0]).decode('utf-8')
+                document['score'] = round(doc_score, 4)
+                document['snippet'] = make_snippet(text, terms)
+                results.append(document)
+
+        return results, len(candidates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the full-text search index of a portfolio.')
+    parser.add_argument('portfolio')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--query', default=None, help='run a query instead of building')
+    args = parser.parse_args()
+
+    index = SearchIndex(args.portfolio)
+    if args.query is not None:
+        results, total = index.search(args.query)
+        print(f"{total} documents")
+        for result in results:
+            print(f"{result['score']:8.3f}  {result['accession']}/{result['doc_index']}  {result['type']}  {result['filing_date']}")
+        return
+
+    processed = index.build(args.workers)
+    print(f"Processed {processed} batches")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Loughran-McDonald sentiment across a portfolio.
+
+Every document of a chosen type (e.g. all 10-K main documents) is scored as a whole and per top level
+section, and the counts are kept per document type, so a type's sentiment over time is one indexed query.
+
+Usage: python -m secbrowser.sentiment <portfolio> <document type> [--workers N]
+"""
+import argparse
+import json
+
+from .batches import SidecarStore, iter_batch_documents
+from .dictionaries import registry
+from .index import _submission_metadata, normalize_cik
+
+SENTIMENT_FILENAME = 'secbrowser_sentiment.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    path TEXT,
+    document_type TEXT,
+    mtime REAL,
+    size INTEGER,
+    PRIMARY KEY (path, document_type)
+);
+CREATE TABLE IF NOT EXISTS scores (
+    document_type TEXT,
+    accession TEXT,
+    doc_index INTEGER,
+    section TEXT,
+    batch TEXT,
+    filing_date TEXT,
+    cik TEXT,
+    total_words INTEGER,
+    counts TEXT,
+    PRIMARY KEY (document_type, accession, doc_index, section)
+);
+CREATE INDEX IF NOT EXISTS scores_series ON scores (document_type, section, filing_date);
+CREATE INDEX IF NOT EXISTS scores_batch ON scores (batch, document_type);
+"""
+
+# section name used for the whole document
+WHOLE_DOCUMENT = ''
+
+TEXT_KEYS = ('title', 'text', 'textsmall')
+
+
+def section_text(node, parts=None):
+    """Concatenate the text of a doc2dict section and everything nested in it"""
+    if parts is None:
+        parts = []
+    if isinstance(node, dict):
+        for key in TEXT_KEYS:
+            if isinstance(node.get(key), str):
+                parts.append(node[key])
+        contents = node.get('contents')
+        if isinstance(contents, dict):
+            for child in contents.values():
+                section_text(child, parts)
+    return parts
+
+
+def document_sections(document):
+    """(section name, text) for each top level section of a parsed document"""
+    root = document.data.get('document', {}) if document.data else {}
+    for node in root.values():
+        if not isinstance(node, dict):
+            continue
+        name = node.get('standardized_title') or node.get('title') or ''
+        yield str(name).strip(), '\n'.join(section_text(node))
+
+
+def _init_worker():
+    registry.warm(['loughran_mcdonald'])
+
+
+def sentiment_batch(batch_path, document_type):
+    """Worker: score every document of document_type in one batch tar"""
+    from datamule.tags.utils import analyze_lm_sentiment_fragment
+
+    processors = registry.get('loughran_mcdonald')['processor']
+    rows = []
+    for accession, doc_index, metadata, document in iter_batch_documents(batch_path, {document_type}):
+        if not document._data_bool:
+            continue
+        _, filing_date, cik, _ = _submission_metadata(metadata)
+        try:
+            results = [(WHOLE_DOCUMENT, analyze_lm_sentiment_fragment(str(document.text or ''), processors))]
+            seen = set()
+            for name, text in document_sections(document):
+                # repeated titles (e.g. several "signatures") are scored once, under the first
+                if name in seen:
+                    continue
+                seen.add(name)
+                results.append((name, analyze_lm_sentiment_fragment(text, processors)))
+        except Exception as e:
+            print(f"Skipped: {accession}/{document.filename} due to {e}")
+            continue
+
+        for section, counts in results:
+            if not counts:
+                continue
+            total_words = counts.pop('total_words', 0)
+            rows.append((accession, doc_index, section, filing_date, normalize_cik(cik) if cik else '',
+                         total_words, json.dumps(counts, sort_keys=True)))
+    return rows
+
+
+class SentimentStore(SidecarStore):
+    """Cached Loughran-McDonald counts per document and section"""
+    FILENAME = SENTIMENT_FILENAME
+    SCHEMA = SCHEMA
+    BUILD_COLUMN = 'document_type'
+
+    def drop_rows(self, conn, batch_path, build_key=None):
+        if build_key is None:
+            conn.execute('DELETE FROM scores WHERE batch = ?', (batch_path,))
+        else:
+            conn.execute('DELETE FROM scores WHERE batch = ? AND document_type = ?', (batch_path, build_key))
+
+    def write_rows(self, conn, batch_path, rows, build_key=None):
+        conn.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         [(build_key, *row[:3], batch_path, *row[3:]) for row in rows])
+
+    def build(self, document_type, workers=None, progress=print):
+        """Score documents of document_type in new or changed batches. Returns the number of batches scored."""
+        return self.build_batches(sentiment_batch, args=(document_type,), build_key=document_type, workers=workers,
+                                  progress=progress, initializer=_init_worker)
+
+    def document_types(self):
+        if not self.exists():
+            return []
+        with self.connect() as conn:
+            return [row[0] for row in conn.execute('SELECT DISTINCT document_type FROM processed ORDER BY 1')]
+
+    def sections(self, document_type, limit=50):
+        """Section names for a document type, most common first"""
+        if not self.exists():
+            return []
+        with self.connect() as conn:
+            rows = conn.execute("SELECT section, COUNT(*) FROM scores WHERE document_type = ? AND section != '' "
+                                'GROUP BY section ORDER BY 2 DESC LIMIT ?', (document_type, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def series(self, document_type, section=WHOLE_DOCUMENT, cik=None):
+        """Compact, column oriented time series ordered by filing date.
+
+        Each category is a list of counts per thousand words, aligned with dates and accessions.
+        """
+        if not self.exists():
+            return {'dates': [], 'accessions': [], 'doc_indexes': [], 'total_words': [], 'categories': {}}
+
+        query = 'SELECT accession, doc_index, filing_date, total_words, counts FROM scores WHERE document_type = ? AND section = ?'
+        params = [document_type, section]
+        if cik:
+            query += ' AND cik = ?'
+            params.append(normalize_cik(cik))
+        query += ' ORDER BY filing_date, accession'
+
+        with self.connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        series = {'dates': [], 'accessions': [], 'doc_indexes': [], 'total_words': [], 'categories': {}}
+        for i, row in enumerate(rows):
+            series['dates'].append(row['filing_date'])
+            series['accessions'].append(row['accession'])
+            series['doc_indexes'].append(row['doc_index'])
+            series['total_words'].append(row['total_words'])
+            for category, count in json.loads(row['counts']).items():
+                values = series['categories'].setdefault(category, [0] * len(rows))
+                values[i] = round(1000 * count / row['total_words'], 3) if row['total_words'] else 0
+        return series
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score Loughran-McDonald sentiment for every document of a type in a portfolio.')
+    parser.add_argument('portfolio')
+    parser.add_argument('document_type')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    processed = SentimentStore(args.portfolio).build(args.document_type, args.workers)
+    print(f"Processed {processed} batches")
+
+
+if __name__ == '__main__':
+    main()
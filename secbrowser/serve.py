@@ -0,0 +1,228 @@
+"""Production serving: a pre-forking, multi-threaded WSGI server for running secbrowser behind a load balancer.
+
+The parent binds the socket, loads the portfolio index and warms the tagging dictionaries once, then forks
+the workers, so they share that memory copy-on-write. Each worker answers requests from a bounded thread
+pool and opens the derived indexes read-only and memory mapped, so the page cache holding them is shared too.
+The parent stays the one writer of the portfolio index, indexing new batches as they appear. The portfolio is
+fixed for the life of the server.
+SIGTERM (or Ctrl-C) stops accepting connections and lets in-flight requests, long renders included, finish.
+
+Usage: python -m secbrowser.serve <portfolio> [--host 0.0.0.0] [--port 8000] [--workers N] [--threads N] [--backlog N]
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, get_sockaddr, select_address_family
+
+from . import db
+
+# connections accepted per worker beyond the ones being handled, waiting for a thread
+BACKLOG_PER_THREAD = 4
+
+BUSY_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\nContent-Type: text/plain\r\nContent-Length: 20\r\n'
+                 b'Retry-After: 1\r\nConnection: close\r\n\r\nServer is overloaded')
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug's server with requests handled on a fixed size thread pool instead of a thread per request.
+
+    At most threads + backlog connections are held at once, past that they are answered with a 503 straight
+    away rather than queued without bound while every thread is busy.
+    """
+    multithread = True
+
+    def __init__(self, host, port, app, threads=8, backlog=None, fd=None):
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='secbrowser-http')
+        self.slots = threading.BoundedSemaphore(threads + (threads * BACKLOG_PER_THREAD if backlog is None else backlog))
+        super().__init__(host, port, app, fd=fd)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self._reject(request)
+            return
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _reject(self, request):
+        try:
+            request.sendall(BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def drain(self):
+        """Wait for requests already being handled"""
+        self.pool.shutdown(wait=True)
+
+
+def preload(portfolio_path, dictionaries=()):
+    """Everything worth sharing between workers, done once in the parent"""
+    from . import server
+    from .dictionaries import registry
+    from .jobs import default_jobs_db, recover_jobs
+
+    server.cache['portfolio_path'] = portfolio_path
+    server.app.config['SECBROWSER_FIXED_PORTFOLIO'] = True
+    server.get_portfolio_index().refresh()
+    if dictionaries:
+        registry.warm(dictionaries)
+
+    # every worker has a job manager on the same database, recovering it is done here instead
+    server.app.config['SECBROWSER_RECOVER_JOBS'] = False
+    return recover_jobs(default_jobs_db())
+
+
+def run_worker(listener, host, port, threads, multiprocess, queued_jobs=(), backlog=None):
+    """Serve on an already bound socket until SIGTERM/SIGINT, then finish in-flight requests"""
+    from .server import app, get_job_manager
+
+    # a single worker is the only process serving and keeps writing the portfolio index itself
+    db.read_only = multiprocess
+    PooledWSGIServer.multiprocess = multiprocess
+    httpd = PooledWSGIServer(host, port, app, threads=threads, backlog=backlog, fd=listener.fileno())
+
+    if queued_jobs:
+        get_job_manager().resume(queued_jobs)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever to return, so it can't run on the thread serving
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    httpd.serve_forever()
+    httpd.drain()
+    httpd.server_close()
+
+
+def bind(host, port):
+    family = select_address_family(host, port)
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(get_sockaddr(host, port, family))
+    listener.listen(BaseWSGIServer.request_queue_size)
+    listener.set_inheritable(True)
+    return listener
+
+
+def serve(portfolio_path, host='127.0.0.1', port=8000, workers=None, threads=8, dictionaries=(), graceful_timeout=60,
+          backlog=None):
+    from .server import PORTFOLIO_POLL_SECONDS, get_portfolio_index
+
+    workers = workers or os.cpu_count() or 1
+    listener = bind(host, port)
+    queued_jobs = preload(portfolio_path, dictionaries)
+    print(f"Serving {portfolio_path} on http://{host}:{port} with {workers} workers x {threads} threads")
+
+    if workers == 1 or not hasattr(os, 'fork'):
+        run_worker(listener, host, port, threads, False, queued_jobs, backlog)
+        return
+
+    # workers open the portfolio index read-only, the parent keeps it up to date for all of them
+    index = get_portfolio_index()
+    next_refresh = time.monotonic() + PORTFOLIO_POLL_SECONDS
+
+    children = {}
+    stopping = False
+
+    def spawn(number):
+        pid = os.fork()
+        if pid == 0:
+            # the parent's handlers would signal the other workers
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                # only the first worker picks up jobs left queued by the last run
+                run_worker(listener, host, port, threads, True, queued_jobs if number == 0 else (), backlog)
+            finally:
+                # job processes started by this worker are daemonic, end them as a normal exit would
+                for child in multiprocessing.active_children():
+                    child.terminate()
+                os._exit(0)
+        children[pid] = number
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for number in range(workers):
+        spawn(number)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    deadline = None
+    while children:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + graceful_timeout
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if deadline is not None and time.monotonic() > deadline:
+                print("Graceful timeout reached, killing workers", file=sys.stderr)
+                for pid in children:
+                    os.kill(pid, signal.SIGKILL)
+                deadline = float('inf')
+            if not stopping and time.monotonic() >= next_refresh:
+                try:
+                    index.refresh()
+                except Exception as e:
+                    print(f"Could not refresh the portfolio index: {e}", file=sys.stderr)
+                next_refresh = time.monotonic() + PORTFOLIO_POLL_SECONDS
+            time.sleep(0.2)
+            continue
+
+        number = children.pop(pid)
+        if not stopping:
+            print(f"Worker {number} (pid {pid}) exited with status {status}, restarting", file=sys.stderr)
+            spawn(number)
+    listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve secbrowser with several worker processes.')
+    parser.add_argument('portfolio', nargs='?', default=os.environ.get('SECBROWSER_PORTFOLIO'))
+    parser.add_argument('--host', default=os.environ.get('SECBROWSER_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SECBROWSER_PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SECBROWSER_WORKERS', 0)) or None)
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('SECBROWSER_THREADS', 8)))
+    parser.add_argument('--backlog', type=int, default=int(os.environ.get('SECBROWSER_BACKLOG', -1)),
+                        help=f'connections per worker waiting for a thread before new ones get a 503, '
+                             f'{BACKLOG_PER_THREAD} per thread by default')
+    parser.add_argument('--graceful-timeout', type=float, default=60)
+    parser.add_argument('--warm-dictionaries', default=os.environ.get('SECBROWSER_WARM_DICTIONARIES', ''),
+                        help='comma separated dictionaries to load before forking, e.g. loughran_mcdonald')
+    args = parser.parse_args()
+
+    if not args.portfolio:
+        parser.error('a portfolio path is required (argument or SECBROWSER_PORTFOLIO)')
+
+    dictionaries = [name.strip() for name in args.warm_dictionaries.split(',') if name.strip()]
+    serve(os.path.abspath(args.portfolio), args.host, args.port, args.workers, args.threads, dictionaries,
+          args.graceful_timeout, args.backlog if args.backlog >= 0 else None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,30 @@
-from flask import Flask, render_template, request, redirect, Response, jsonify, session
-import tkinter as tk
-from tkinter import filedialog
+from flask import Flask, render_template, stream_template, request, redirect, Response, jsonify, session, g, abort
+from werkzeug.wsgi import wrap_file
+import argparse
+import hashlib
+import io
 import os
-from datamule import Portfolio
+import threading
+import time
+from urllib.parse import urlencode
+from .cache import LRUCache, document_size, submission_size
+from .highlight import bucket_by_fragment, highlight_text
+from .raw import CHUNK_SIZE, MemberFile, choose_encoding, compress_chunks, compress_stream, document_location, is_compressible
+from .json_stream import iter_json, select_path
+from .tables import document_tables, table_summary, table_columns, table_row_count, iter_table_rows, stream_csv, stream_ndjson
+from .render_cache import RenderCache, content_hash, render_key
+from .jobs import JobManager, default_jobs_db, INDEX_KINDS
+from .tag_store import TagStore, dictionary_for, extract_tags, extract_similarity
+from .dictionaries import registry as dictionary_registry
+from .search import SearchIndex
+from .entities import EntityIndex
+from .sentiment import SentimentStore
+from .xbrl_store import XBRLStore
+from .fundamentals import FundamentalsPanel
+from .index import PortfolioIndex, _submission_metadata, normalize_cik
+from .prefetch import Prefetcher, prefetch_order
+from .diff import align, children_items, diff_rows, diff_text, section_items, tree_hashes
+from . import metrics
 
 
 # move to utils
@@ -22,27 +44,18 @@ def get_default_sentiment_color(sentiment_key):
     return loughran_colors.get(sentiment_key, '#888888')
 
 def apply_highlights_to_fragment(text, highlights, fragment_id):
-    """Apply highlighting to a specific text fragment"""
-    fragment_matches = [h for h in highlights if h.get('fragment_id') == fragment_id]
+    """Apply highlighting to a specific text fragment. highlights should be bucketed with bucket_by_fragment"""
+    if not isinstance(highlights, dict):
+        highlights = bucket_by_fragment(highlights)
+
+    fragment_matches = highlights.get(str(fragment_id))
     if not fragment_matches:
         return text
     
-    fragment_matches.sort(key=lambda x: x['start'], reverse=True)
-    
-    highlighted_text = text
-    for match in fragment_matches:
-        start, end = match['start'], match['end']
-        color = match['color']
-        match_type = match['type']
-        original = highlighted_text[start:end]
-        
-        span = f'<span style="background-color: {color}; color: white; padding: 2px; border-radius: 3px;" title="{match_type}: {original}">{original}</span>'
-        highlighted_text = highlighted_text[:start] + span + highlighted_text[end:]
-    
-    return highlighted_text
+    return highlight_text(text, fragment_matches)
 
-def process_document(doc_dict, html, level, highlights=None, parent_id='', sentiment_fragments=None, sentiment_colors=None):
-    """Process document elements recursively"""
+def iter_document(doc_dict, level, highlights=None, parent_id='', sentiment_fragments=None, sentiment_colors=None):
+    """Yield HTML for document elements recursively"""
     # Sort keys to ensure numerical order for items like "1", "2", etc.
     try:
         sorted_keys = sorted(doc_dict.keys(), key=lambda x: (not x.lstrip('-').isdigit(), int(x) if x.lstrip('-').isdigit() else x))
@@ -82,29 +95,29 @@ def process_document(doc_dict, html, level, highlights=None, parent_id='', senti
                 heading_level = min(level, 6)  # Limit to h6
                 if highlights:
                     highlighted_title = apply_highlights_to_fragment(section_title, highlights, key)
-                    html.append(f'<h{heading_level}{title_style}>{highlighted_title}</h{heading_level}>')
+                    yield f'<h{heading_level}{title_style}>{highlighted_title}</h{heading_level}>'
                 else:
-                    html.append(f'<h{heading_level}{title_style}>{section_title}</h{heading_level}>')
+                    yield f'<h{heading_level}{title_style}>{section_title}</h{heading_level}>'
             
             # Process the section content
-            html.append('<div class="section">')
+            yield '<div class="section">'
             
             # Handle direct content fields
             for attr_key, attr_value in value.items():
                 if attr_key not in ["title", "class", "contents", "standardized_title"]:
-                    process_content(attr_key, attr_value, html, highlights, key, sentiment_fragments, sentiment_colors)
+                    yield from iter_content(attr_key, attr_value, highlights, key, sentiment_fragments, sentiment_colors)
             
             # Process contents dictionary if it exists
             if "contents" in value and value["contents"]:
-                process_document(value["contents"], html, level + 1, highlights, current_id, sentiment_fragments, sentiment_colors)
+                yield from iter_document(value["contents"], level + 1, highlights, current_id, sentiment_fragments, sentiment_colors)
                 
-            html.append('</div>')
+            yield '</div>'
         else:
             # Direct content
-            process_content(key, value, html, highlights, key, sentiment_fragments, sentiment_colors)
+            yield from iter_content(key, value, highlights, key, sentiment_fragments, sentiment_colors)
 
-def process_content(content_type, content, html, highlights=None, fragment_id=None, sentiment_fragments=None, sentiment_colors=None):
-    """Process specific content types"""
+def iter_content(content_type, content, highlights=None, fragment_id=None, sentiment_fragments=None, sentiment_colors=None):
+    """Yield HTML for specific content types"""
     # Get sentiment styling for this entire fragment
     fragment_style = ""
     if sentiment_fragments and fragment_id in sentiment_fragments and sentiment_colors:
@@ -129,30 +142,28 @@ def process_content(content_type, content, html, highlights=None, fragment_id=No
     if content_type == "text":
         if highlights and fragment_id:
             highlighted_content = apply_highlights_to_fragment(content, highlights, fragment_id)
-            html.append(f'<div{fragment_style}>{highlighted_content}</div>')
+            yield f'<div{fragment_style}>{highlighted_content}</div>'
         else:
-            html.append(f'<div{fragment_style}>{content}</div>')
+            yield f'<div{fragment_style}>{content}</div>'
     elif content_type == "textsmall":
         if highlights and fragment_id:
             highlighted_content = apply_highlights_to_fragment(content, highlights, fragment_id)
-            html.append(f'<div class="textsmall"{fragment_style}>{highlighted_content}</div>')
+            yield f'<div class="textsmall"{fragment_style}>{highlighted_content}</div>'
         else:
-            html.append(f'<div class="textsmall"{fragment_style}>{content}</div>')
+            yield f'<div class="textsmall"{fragment_style}>{content}</div>'
     elif content_type == "image":
-        process_image(content, html)
+        yield from iter_image(content)
     elif content_type == "table":
-        process_table(content, html)
-    else:
-        pass
+        yield from iter_table(content)
 
-def process_image(image_data, html):
-    """Convert image data to HTML img tag"""
+def iter_image(image_data):
+    """Yield HTML img tag for image data"""
     src = image_data.get('src', '')
     alt = image_data.get('alt', 'Image')
     
-    html.append('<div class="image-wrapper">')
-    html.append(f'<img src="{src}" alt="{alt}" class="document-image">')
-    html.append('</div>')
+    yield '<div class="image-wrapper">'
+    yield f'<img src="{src}" alt="{alt}" class="document-image">'
+    yield '</div>'
 
 def process_table_cell(cell):
     """Process a single table cell that may contain text or image data"""
@@ -173,11 +184,14 @@ def process_table_cell(cell):
         # Cell is a string or other simple type
         return str(cell)
 
-def process_table(table_data, html):
-    """Convert table data to HTML table"""
-    html.append('<table>')
-    
-    # Check if first row should be treated as header
+def table_rows(table_data):
+    """The rows of a table value, doc2dict wraps them together with the table's title and footnotes"""
+    if isinstance(table_data, dict):
+        return table_data.get('data') or []
+    return table_data
+
+def table_has_header(table_data):
+    """Check if first row should be treated as header"""
     has_header = False
     if len(table_data) > 1:
         # Heuristic: if first row contains mostly text content, treat as header
@@ -191,30 +205,41 @@ def process_table(table_data, html):
         
         if text_cells >= len(first_row) / 2:  # At least half the cells have text
             has_header = True
+    return has_header
+
+def iter_table(table_data):
+    """Yield HTML table for table data, one row at a time"""
+    table_data = table_rows(table_data)
+
+    yield '<table>'
     
+    has_header = table_has_header(table_data)
     for i, row in enumerate(table_data):
-        html.append('<tr>')
-        for cell in row:
-            # Use th for header cells, otherwise td
-            tag = 'th' if has_header and i == 0 else 'td'
-            cell_content = process_table_cell(cell)
-            html.append(f'<{tag}>{cell_content}</{tag}>')
-        html.append('</tr>')
+        # Use th for header cells, otherwise td
+        tag = 'th' if has_header and i == 0 else 'td'
+        cells = ''.join(f'<{tag}>{process_table_cell(cell)}</{tag}>' for cell in row)
+        yield f'<tr>{cells}</tr>'
     
-    html.append('</table>')
+    yield '</table>'
 
-def visualize_data_as_html(data, highlights=None, sentiment_fragments=None, sentiment_colors=None):
-    data_dict = data
-    html = []
-    
-    # Add HTML document opening tags and CSS
-    html.append("""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Document Visualization</title>
+def process_document(doc_dict, html, level, highlights=None, parent_id='', sentiment_fragments=None, sentiment_colors=None):
+    """Process document elements recursively"""
+    html.extend(iter_document(doc_dict, level, highlights, parent_id, sentiment_fragments, sentiment_colors))
+
+def process_content(content_type, content, html, highlights=None, fragment_id=None, sentiment_fragments=None, sentiment_colors=None):
+    """Process specific content types"""
+    html.extend(iter_content(content_type, content, highlights, fragment_id, sentiment_fragments, sentiment_colors))
+
+def process_image(image_data, html):
+    """Convert image data to HTML img tag"""
+    html.extend(iter_image(image_data))
+
+def process_table(table_data, html):
+    """Convert table data to HTML table"""
+    html.extend(iter_table(table_data))
+
+# styles of the rendered document, shared by the visualize and diff pages
+VISUALIZE_STYLE = """
         <style>
             body { 
                 font-family: Arial, sans-serif; 
@@ -293,34 +318,246 @@ def visualize_data_as_html(data, highlights=None, sentiment_fragments=None, sent
                 margin: 15px 0;
             }
         </style>
-    </head>
+"""
+
+def iter_visualize_data_as_html(data, highlights=None, sentiment_fragments=None, sentiment_colors=None):
+    """Yield the visualization page piece by piece so it can be streamed"""
+    data_dict = data
+
+    # bucket once so each fragment only looks at its own matches
+    if highlights and not isinstance(highlights, dict):
+        highlights = bucket_by_fragment(highlights)
+    
+    # Add HTML document opening tags and CSS
+    yield """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Document Visualization</title>""" + VISUALIZE_STYLE + """    </head>
     <body>
-    """)
+    """
     
     # Add metadata box
     if "metadata" in data_dict:
-        html.append('<div class="metadata-box">')
-        html.append('<div class="metadata-title">Parser Metadata</div>')
+        yield '<div class="metadata-box">'
+        yield '<div class="metadata-title">Parser Metadata</div>'
         metadata = data_dict["metadata"]
         for key, value in metadata.items():
-            html.append(f'<div><strong>{key}:</strong> {value}</div>')
-        html.append('</div>')
+            yield f'<div><strong>{key}:</strong> {value}</div>'
+        yield '</div>'
     
     # Process the document structure
     if "document" in data_dict:
-        html.append('<div class="document">')
-        process_document(data_dict["document"], html, 1, highlights, '', sentiment_fragments, sentiment_colors)
-        html.append('</div>')
+        yield '<div class="document">'
+        yield from iter_document(data_dict["document"], 1, highlights, '', sentiment_fragments, sentiment_colors)
+        yield '</div>'
     
     # Add HTML closing tags
-    html.append("""
+    yield """
+    </body>
+    </html>
+    """
+
+def visualize_data_as_html(data, highlights=None, sentiment_fragments=None, sentiment_colors=None):
+    return list(iter_visualize_data_as_html(data, highlights, sentiment_fragments, sentiment_colors))
+
+# marks for the diff page, on top of the visualize styles
+DIFF_STYLE = """
+        <style>
+            ins { background-color: #d4f7d4; text-decoration: none; }
+            del { background-color: #f7d4d4; }
+            .diff-inserted { border-left: 4px solid #2e9e2e; padding-left: 10px; background-color: #f3fcf3; }
+            .diff-deleted { border-left: 4px solid #c83232; padding-left: 10px; background-color: #fcf3f3; text-decoration: line-through; }
+            .diff-unchanged { color: #999; font-size: 0.85em; font-style: italic; }
+            td.diff-changed { background-color: #fff8dc; }
+            .diff-summary { background-color: #f8f9fa; border: 1px solid #ddd; padding: 15px; margin: 20px 0; border-radius: 5px; }
+        </style>
+"""
+
+def diff_html(segments):
+    """Text of diff_text segments with removed words in <del> and added ones in <ins>"""
+    html = []
+    for op, text in segments:
+        if op == 'delete':
+            html.append(f'<del>{text}</del>')
+        elif op == 'insert':
+            html.append(f'<ins>{text}</ins>')
+        else:
+            html.append(text)
+    return ''.join(html)
+
+def describe_unchanged(items):
+    """One line standing in for a run of identical sections and content"""
+    titles = [value.get('title') for kind, _, value in items if kind == 'section' and value.get('title')]
+    description = f"{len(items)} unchanged {'item' if len(items) == 1 else 'items'}"
+    if titles:
+        description += ': ' + ', '.join(titles[:3]) + (f' and {len(titles) - 3} more' if len(titles) > 3 else '')
+    return description
+
+def iter_item(item, level):
+    """Yield HTML for one (kind, key, value) item as iter_document would render it"""
+    kind, key, value = item
+    if kind == 'section':
+        yield from iter_document({key: value}, level)
+    else:
+        yield from iter_content(key, value)
+
+def iter_diff_items(old_items, new_items, level, old_hashes, new_hashes, stats, context=False):
+    """Yield HTML for the differences between two lists of sibling sections and content, laid out like iter_document.
+    Identical runs are one line, or collapsed but rendered with context."""
+    for op, old, new in align(old_items, new_items, old_hashes, new_hashes):
+        if op == 'equal':
+            stats['unchanged'] += len(new)
+            if context:
+                yield f'<details class="diff-unchanged"><summary>{describe_unchanged(new)}</summary>'
+                for item in new:
+                    yield from iter_item(item, level)
+                yield '</details>'
+            else:
+                yield f'<div class="diff-unchanged">{describe_unchanged(new)}</div>'
+        elif op in ('deleted', 'inserted'):
+            stats[op] += 1
+            yield f'<div class="diff-{op}">'
+            yield from iter_item(old or new, level)
+            yield '</div>'
+        elif old[0] == 'section':
+            yield from iter_diff_section(old[2], new[2], level, old_hashes, new_hashes, stats, context)
+        else:
+            stats['changed'] += 1
+            yield from iter_diff_content(old[1], old[2], new[2])
+
+def iter_diff_section(old_section, new_section, level, old_hashes, new_hashes, stats, context=False):
+    """Yield HTML for two versions of a section, title and all"""
+    old_title, section_title = old_section.get('title', ''), new_section.get('title', '')
+    if section_title or old_title:
+        heading_level = min(level, 6)
+        title = section_title if old_title == section_title else diff_html(diff_text(old_title, section_title))
+        yield f'<h{heading_level}>{title}</h{heading_level}>'
+
+    yield '<div class="section">'
+    yield from iter_diff_items(section_items(old_section), section_items(new_section), level + 1,
+                               old_hashes, new_hashes, stats, context)
+    yield '</div>'
+
+def iter_diff_content(content_type, old_content, new_content):
+    """Yield HTML for two versions of one piece of content, text diffed by word and tables by cell"""
+    if content_type in ('text', 'textsmall') and isinstance(old_content, str) and isinstance(new_content, str):
+        css_class = ' class="textsmall"' if content_type == 'textsmall' else ''
+        yield f'<div{css_class}>{diff_html(diff_text(old_content, new_content))}</div>'
+    elif content_type == 'table':
+        yield from iter_diff_table(old_content, new_content)
+    else:
+        yield '<div class="diff-deleted">'
+        yield from iter_content(content_type, old_content)
+        yield '</div><div class="diff-inserted">'
+        yield from iter_content(content_type, new_content)
+        yield '</div>'
+
+def iter_diff_table(old_table, new_table):
+    """Yield an HTML table of the new table's rows, with changed cells diffed and removed rows struck through"""
+    new_rows = table_rows(new_table)
+    has_header = table_has_header(new_rows)
+
+    yield '<table>'
+    for i, (op, old_row, new_row) in enumerate(diff_rows(table_rows(old_table), new_rows)):
+        tag = 'th' if has_header and i == 0 else 'td'
+        if op == 'changed':
+            old_cells = [process_table_cell(cell) for cell in old_row]
+            new_cells = [process_table_cell(cell) for cell in new_row]
+            cells = []
+            for k in range(max(len(old_cells), len(new_cells))):
+                old_cell = old_cells[k] if k < len(old_cells) else ''
+                new_cell = new_cells[k] if k < len(new_cells) else ''
+                if old_cell == new_cell:
+                    cells.append(f'<{tag}>{new_cell}</{tag}>')
+                else:
+                    cells.append(f'<{tag} class="diff-changed">{diff_html(diff_text(old_cell, new_cell))}</{tag}>')
+            yield f'<tr>{"".join(cells)}</tr>'
+        else:
+            row = old_row if op == 'deleted' else new_row
+            css_class = f' class="diff-{op}"' if op != 'equal' else ''
+            cells = ''.join(f'<{tag}>{process_table_cell(cell)}</{tag}>' for cell in row)
+            yield f'<tr{css_class}>{cells}</tr>'
+    yield '</table>'
+
+def iter_diff_as_html(old_data, new_data, old_hashes, new_hashes, context=False):
+    """Yield the diff page of two parsed documents piece by piece, in the layout of the visualization page"""
+    yield """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Document Diff</title>""" + VISUALIZE_STYLE + DIFF_STYLE + """    </head>
+    <body>
+    """
+
+    stats = {'changed': 0, 'inserted': 0, 'deleted': 0, 'unchanged': 0}
+    yield '<div class="document">'
+    yield from iter_diff_items(children_items(old_data.get('document') or {}), children_items(new_data.get('document') or {}),
+                               1, old_hashes, new_hashes, stats, context)
+    yield '</div>'
+
+    yield '<div class="diff-summary">'
+    yield (f"<strong>{stats['changed']}</strong> changed, <strong>{stats['inserted']}</strong> added, "
+           f"<strong>{stats['deleted']}</strong> removed, <strong>{stats['unchanged']}</strong> unchanged")
+    yield '</div>'
+
+    yield """
     </body>
     </html>
-    """)
-    return html
+    """
+
+def chunked(parts, chunk_size=64 * 1024):
+    """Join streamed html parts with newlines into chunks of roughly chunk_size characters"""
+    buffer = []
+    buffered = 0
+    for part in parts:
+        buffer.append(part)
+        buffered += len(part)
+        if buffered >= chunk_size:
+            buffer.append('')
+            yield '\n'.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield '\n'.join(buffer)
 app = Flask(__name__)
 
+# no native folder dialogs, the portfolio path comes from the command line, SECBROWSER_PORTFOLIO or /api/portfolio
+app.config['SECBROWSER_HEADLESS'] = os.environ.get('SECBROWSER_HEADLESS', '').lower() in ('1', 'true', 'yes')
+# the current portfolio is per process. secbrowser.serve sets it before forking its workers and fixes it, since
+# opening another would only reach the worker that happened to handle that request.
+app.config['SECBROWSER_FIXED_PORTFOLIO'] = False
+# per phase timings of each response in a Server-Timing header, shown in the browser's network panel
+app.config['SECBROWSER_SERVER_TIMING'] = os.environ.get('SECBROWSER_SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+
+# profiling of single requests on demand, see profiling.py. Without a token nothing is installed.
+if os.environ.get('SECBROWSER_PROFILE_TOKEN'):
+    from .profiling import install as install_profiling
+    install_profiling(app, os.environ['SECBROWSER_PROFILE_TOKEN'],
+                      os.environ.get('SECBROWSER_PROFILE_DIR', os.path.join(os.path.expanduser('~'), '.secbrowser', 'profiles')))
+
 cache = {}
+if os.environ.get('SECBROWSER_PORTFOLIO'):
+    cache['portfolio_path'] = os.path.abspath(os.environ['SECBROWSER_PORTFOLIO'])
+
+# parsed documents and submissions shared across requests, keyed by (portfolio path, accession, document index)
+CACHE_MAX_BYTES = int(os.environ.get('SECBROWSER_CACHE_BYTES', 512 * 1024 * 1024))
+document_cache = LRUCache(CACHE_MAX_BYTES, document_size)
+submission_cache = LRUCache(CACHE_MAX_BYTES // 8, submission_size)
+
+# documents of the submission being viewed are loaded and parsed ahead of the click, 0 workers turns it off
+prefetcher = Prefetcher(int(os.environ.get('SECBROWSER_PREFETCH_WORKERS', 1)))
+PREFETCH_MAX_DOCUMENTS = int(os.environ.get('SECBROWSER_PREFETCH_DOCUMENTS', 10))
+
+# how often the portfolio page looks for new batches, and how long one long poll may wait for them. Only a few
+# polls wait at a time, the others are answered straight away, so open portfolio tabs can't take every thread.
+PORTFOLIO_POLL_SECONDS = float(os.environ.get('SECBROWSER_PORTFOLIO_POLL_SECONDS', 2))
+PORTFOLIO_WAIT_SECONDS = 20
+portfolio_waiters = threading.BoundedSemaphore(int(os.environ.get('SECBROWSER_PORTFOLIO_WAITERS', 2)))
 
 def process_form_list(value):
     """Convert comma-separated string to list, handling None/empty"""
@@ -328,28 +565,200 @@ def process_form_list(value):
         return None
     return [item.strip() for item in value.split(',') if item.strip()]
 
-@app.route('/process_tags', methods=['POST'])
-def process_tags():
+def get_portfolio():
+    """Return the datamule Portfolio for the current portfolio path, opening it on first use"""
+    # datamule is most of a cold start, so it isn't imported until a portfolio is actually opened
+    if 'portfolio' not in cache:
+        from datamule import Portfolio
+        portfolio = Portfolio(cache['portfolio_path'])
+        # datamule uses cpu_count - 1 threads to scan submission folders, which is none on a single core
+        portfolio.MAX_WORKERS = max(1, portfolio.MAX_WORKERS)
+        cache['portfolio'] = portfolio
+    return cache['portfolio']
+
+def open_portfolio(path):
+    """Make path this process's current portfolio, dropping everything loaded from the previous one"""
     global cache
-    document = cache.get('document')
-    document.reset_nlp()
-    
-    if not document:
-        return redirect('/')
-    
-    # Get form data
-    selected_tags = request.form.getlist('tags')
-    selected_similarity = request.form.getlist('similarity')
-    
-    # Get colors for each tag type
-    colors = {}
-    for tag_type in ['tickers', 'persons', 'cusips', 'isins', 'figis']:
-        color_key = f'{tag_type}_color'
-        if color_key in request.form:
-            colors[tag_type] = request.form[color_key]
-    
-    # Set up dictionaries based on form selections
-    from datamule.tags.config import set_dictionaries
+    prefetcher.cancel()
+    cache = {'portfolio_path': path}
+    document_cache.clear()
+    submission_cache.clear()
+
+def choose_folder(title):
+    """Ask for a folder with a native dialog, None if cancelled or there is no display to show one on"""
+    if app.config['SECBROWSER_HEADLESS']:
+        return None
+    try:
+        import tkinter as tk
+        from tkinter import filedialog
+        root = tk.Tk()
+    except Exception as e:
+        print(f"Error opening file dialog: {str(e)}", "error")
+        return None
+
+    root.withdraw()
+    root.attributes('-topmost', True)
+    try:
+        return filedialog.askdirectory(title=title, initialdir=os.getcwd()) or None
+    except Exception as e:
+        print(f"Error opening file dialog: {str(e)}", "error")
+        return None
+    finally:
+        root.destroy()
+
+def get_portfolio_index():
+    """Return the accession index for the current portfolio, opening it on first use"""
+    if 'index' not in cache:
+        cache['index'] = PortfolioIndex(cache['portfolio_path'])
+    return cache['index']
+
+def submission_page_args():
+    """Read the sort, filter and cursor arguments shared by the portfolio page and the listing API"""
+    return {
+        'sort': request.args.get('sort', 'filing_date'),
+        'descending': request.args.get('order', 'desc') != 'asc',
+        'submission_types': process_form_list(request.args.get('type')),
+        'cik': request.args.get('cik') or None,
+        'date_from': request.args.get('date_from') or None,
+        'date_to': request.args.get('date_to') or None,
+        'limit': max(1, min(int(request.args.get('limit', 50)), 1000)),
+        'cursor': request.args.get('cursor') or None,
+    }
+
+def load_submission(accession):
+    portfolio = get_portfolio()
+    index = get_portfolio_index()
+
+    # O(1) lookup for batch tar submissions, linear scan only for loose submission folders
+    with metrics.phase('load_submission'):
+        submission = index.load_submission(portfolio, accession)
+        if submission is None:
+            submission = next((sub for sub in portfolio if sub.accession == accession), None)
+    return submission
+
+def load_document(accession, index):
+    submission = require_submission(accession)
+    if not 0 <= index < len(submission.metadata.content['documents']):
+        abort(404, f'No document {index} in submission {accession}')
+    with metrics.phase('load_document'):
+        document = submission._load_document_by_index(index)
+    metrics.BYTES_READ.inc(len(document.content or b''))
+    return document
+
+def get_submission(accession):
+    key = (cache['portfolio_path'], accession, None)
+    return submission_cache.get_or_load(key, lambda: load_submission(accession))
+
+def require_submission(accession):
+    """get_submission, answering the request with a 404 if the accession isn't in the portfolio"""
+    if 'portfolio_path' not in cache:
+        abort(404, 'No portfolio loaded')
+    submission = get_submission(accession)
+    if submission is None:
+        abort(404, f'No submission {accession} in the portfolio')
+    return submission
+
+def get_document(accession, index):
+    if 'portfolio_path' not in cache:
+        abort(404, 'No portfolio loaded')
+    key = (cache['portfolio_path'], accession, index)
+    # join a prefetch of this document that is under way rather than loading and parsing it twice
+    prefetcher.wait(key)
+    return document_cache.get_or_load(key, lambda: load_document(accession, index))
+
+def prefetch_submission(submission):
+    """Queue the submission's documents to be loaded and parsed in the background, main document first"""
+    content = submission.metadata.content
+    # a quarter of the cache at most, so prefetching can't evict what is being looked at
+    order = prefetch_order(content.get('documents') or [], _submission_metadata(content)[0],
+                           PREFETCH_MAX_DOCUMENTS, document_cache.max_bytes // 4)
+    portfolio_path = cache['portfolio_path']
+    tasks = [((portfolio_path, submission.accession, doc_index),
+              lambda doc_index=doc_index: prefetch_document(portfolio_path, submission.accession, doc_index))
+             for doc_index in order]
+    prefetcher.start(submission.accession, tasks)
+
+def prefetch_document(portfolio_path, accession, index):
+    if cache.get('portfolio_path') != portfolio_path:
+        return
+    key = (portfolio_path, accession, index)
+    document = document_cache.get_or_load(key, lambda: load_document(accession, index))
+    if getattr(document, '_data', None) is None:
+        with metrics.phase('prefetch_parse'):
+            document.data
+        # re-measured now that it holds the parsed tree
+        document_cache.put(key, document)
+
+def parsed_data(document):
+    """document.data, timing the parse when this is the first access"""
+    if getattr(document, '_data', None) is None:
+        with metrics.phase('parse_data'):
+            return document.data
+    return document.data
+
+def section_hashes(document):
+    """tree_hashes of document.data, computed once per document so it can be compared with any number of others"""
+    hashes = getattr(document, '_section_hashes', None)
+    if hashes is None:
+        data = parsed_data(document)
+        with metrics.phase('section_hashes'):
+            hashes = document._section_hashes = tree_hashes(data)
+    return hashes
+
+def get_search_index():
+    if 'search_index' not in cache:
+        cache['search_index'] = SearchIndex(cache['portfolio_path'])
+    return cache['search_index']
+
+def get_entity_index():
+    if 'entity_index' not in cache:
+        cache['entity_index'] = EntityIndex(cache['portfolio_path'])
+    return cache['entity_index']
+
+def get_sentiment_store():
+    if 'sentiment_store' not in cache:
+        cache['sentiment_store'] = SentimentStore(cache['portfolio_path'])
+    return cache['sentiment_store']
+
+def get_xbrl_store():
+    if 'xbrl_store' not in cache:
+        cache['xbrl_store'] = XBRLStore(cache['portfolio_path'])
+    return cache['xbrl_store']
+
+def get_fundamentals_panel():
+    if 'fundamentals_panel' not in cache:
+        cache['fundamentals_panel'] = FundamentalsPanel(cache['portfolio_path'])
+    return cache['fundamentals_panel']
+
+def get_tag_store():
+    """Return the precomputed tag store for the current portfolio"""
+    if 'tag_store' not in cache:
+        cache['tag_store'] = TagStore(cache['portfolio_path'])
+    return cache['tag_store']
+
+def document_tags(document, mode, tag_type, dictionaries):
+    """Tag spans (or similarity for loughran_mcdonald) for a document, precomputed if available, else computed live"""
+    document_args = g.get('document_args')
+    if document_args:
+        # tickers are always found in document.text, so they are only stored once
+        with metrics.phase('tag_lookup'):
+            stored = get_tag_store().get(document_args['accession'], int(document_args['index']),
+                                         'text' if tag_type == 'tickers' else mode, tag_type,
+                                         dictionary_for(tag_type, dictionaries))
+        if stored is not None:
+            metrics.MATCHES_FOUND.inc(len(stored), tag_type=tag_type, source='stored')
+            return stored
+
+    if tag_type == 'loughran_mcdonald':
+        with metrics.phase('similarity'):
+            return extract_similarity(document, mode, dictionaries)
+    with metrics.phase('tag_extraction'):
+        tags = extract_tags(document, mode, tag_type, dictionaries)
+    metrics.MATCHES_FOUND.inc(len(tags), tag_type=tag_type, source='live')
+    return tags
+
+def selected_dictionaries():
+    """Dictionaries picked in the tag form. Each is loaded once by the registry and stays resident."""
     active_dictionaries = []
     
     # Check each dictionary type selection
@@ -367,15 +776,152 @@ def process_tags():
             active_dictionaries.append(selected_dict)
     
     # Also add loughran_mcdonald if similarity is selected
-    if 'loughran_mcdonald' in selected_similarity:
+    if 'loughran_mcdonald' in request.form.getlist('similarity'):
         if 'loughran_mcdonald' not in active_dictionaries:
             active_dictionaries.append('loughran_mcdonald')
+
+    return active_dictionaries
+
+def current_submission():
+    """Resolve the submission for this request from ?accession=, falling back to the last one opened"""
+    accession = request.values.get('accession')
+    if accession is None:
+        return cache.get('submission')
+    return require_submission(accession)
+
+def current_document_key():
+    """(accession, index) for this request from ?accession=&index=, falling back to the last document opened"""
+    accession = request.values.get('accession')
+    index = request.values.get('index')
+    if accession is None or index is None:
+        if 'document_key' not in cache:
+            return None
+        accession, index = cache['document_key']
+
+    try:
+        index = int(index)
+    except ValueError:
+        abort(404, f'No document {index} in submission {accession}')
+    g.document_args = {'accession': accession, 'index': index}
+    return accession, index
+
+def current_document():
+    """Resolve the document for this request from ?accession=&index=, falling back to the last one opened"""
+    key = current_document_key()
+    if key is None:
+        return None
+    return get_document(*key)
+
+def get_job_manager():
+    """Return the background job manager, starting it on first use"""
+    # created lazily so job subprocesses importing this module don't start (and recover) their own
+    if 'job_manager' not in app.extensions:
+        app.extensions['job_manager'] = JobManager(
+            default_jobs_db(),
+            max_workers=int(os.environ.get('SECBROWSER_JOB_WORKERS', 2)),
+            on_finish=on_job_finish,
+            # serve workers share the jobs database, serve.py recovers it once before forking
+            recover=app.config.get('SECBROWSER_RECOVER_JOBS', True),
+        )
+    return app.extensions['job_manager']
+
+def get_render_cache():
+    """Return the cache of rendered pages, keyed by document content hash plus the normalized form options"""
+    # created on first use, scanning the disk tier is no part of importing the app
+    if 'render_cache' not in app.extensions:
+        app.extensions['render_cache'] = RenderCache(
+            memory_bytes=int(os.environ.get('SECBROWSER_RENDER_CACHE_BYTES', 128 * 1024 * 1024)),
+            disk_dir=os.environ.get('SECBROWSER_RENDER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.secbrowser', 'render_cache')),
+            disk_bytes=int(os.environ.get('SECBROWSER_RENDER_CACHE_DISK_BYTES', 2 * 1024 * 1024 * 1024)),
+        )
+    return app.extensions['render_cache']
+
+def on_job_finish(job):
+    # the portfolio changed on disk, so drop anything we loaded from it
+    if job['kind'] not in INDEX_KINDS and job['params'].get('path') == cache.get('portfolio_path'):
+        prefetcher.cancel()
+        cache.pop('portfolio', None)
+        cache.pop('submission', None)
+        cache.pop('document_key', None)
+        document_cache.clear()
+        submission_cache.clear()
+
+def cached_render(kind, document, render, options=None):
+    """Serve a rendered page from the render cache, or render it, streaming it into the cache as it goes.
+    options are anything else the page depends on, on top of the form and the document."""
+    # the page links back to its own accession/index, so those are part of the key too
+    options = {**request.form.to_dict(flat=False), **g.get('document_args', {}), **(options or {})}
+    key = render_key(document, kind, options)
+
+    if request.method in ('GET', 'HEAD') and request.if_none_match.contains(key):
+        response = Response(status=304)
+        response.set_etag(key)
+        return response
+
+    render_cache = get_render_cache()
+    body = render_cache.get(key)
+    if body is None:
+        rendered = render()
+        if isinstance(rendered, str):
+            rendered = [rendered]
+        body = render_cache.tee(key, metrics.timed_iter(f'render_{kind}', rendered))
+
+    response = Response(body, mimetype='text/html')
+    response.set_etag(key)
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    metrics.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+
+    # the rule, not the path, so accessions and table numbers don't each become a label value
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method, status = request.method, response.status_code
+    if app.config['SECBROWSER_SERVER_TIMING']:
+        response.headers['Server-Timing'] = metrics.server_timing(metrics.request_timings() or {},
+                                                                  time.perf_counter() - start)
+
+    # streamed bodies are still being produced here, so the request is timed when the server closes it
+    response.call_on_close(lambda: metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, route=route,
+                                                                   method=method, status=status))
+    return response
+
+@app.context_processor
+def inject_document_query():
+    # lets document pages link to their sub views without relying on shared state
+    document_args = g.get('document_args')
+    return {'document_query': urlencode(document_args) if document_args else ''}
+
+@app.route('/process_tags', methods=['POST'])
+def process_tags():
+    document = current_document()
+    if not document:
+        return redirect('/')
+
+    return cached_render('process_tags', document, lambda: render_tags(document))
+
+def render_tags(document):
+    """Run the selected tag extraction over document.text and render the highlighted text view"""
+    # Get form data
+    selected_tags = request.form.getlist('tags')
+    selected_similarity = request.form.getlist('similarity')
     
-    # Set active dictionaries
-    if active_dictionaries:
-        set_dictionaries(active_dictionaries)
-    else:
-        set_dictionaries([])
+    # Get colors for each tag type
+    colors = {}
+    for tag_type in ['tickers', 'persons', 'cusips', 'isins', 'figis']:
+        color_key = f'{tag_type}_color'
+        if color_key in request.form:
+            colors[tag_type] = request.form[color_key]
+    
+    # Dictionaries chosen in the form, passed to each extraction rather than set globally
+    active_dictionaries = selected_dictionaries()
     
     # Collect all matches with their positions and colors
     all_matches = []
@@ -385,25 +931,18 @@ def process_tags():
         color = colors.get(tag_type, "#C316C6") 
         
         if tag_type == 'tickers':
-            # Tickers work differently - need to extract from the ticker object
-            ticker_data = document.text.tags.tickers
-            if ticker_data and hasattr(ticker_data, '_tickers_data') and ticker_data._tickers_data:
-                # Get all ticker matches from the 'all' category
-                ticker_matches = ticker_data._tickers_data.get('all', [])
-                for match_info in ticker_matches:
-                    # Ticker matches should have format (ticker, start, end)
-                    if len(match_info) >= 3:
-                        ticker, start, end = match_info[:3]
-                        all_matches.append({
-                            'match': ticker,
-                            'start': start,
-                            'end': end,
-                            'color': color,
-                            'type': 'tickers'
-                        })
+            # Ticker matches come from the 'all' category, as (ticker, start, end)
+            for ticker, start, end in document_tags(document, 'text', 'tickers', active_dictionaries):
+                all_matches.append({
+                    'match': ticker,
+                    'start': start,
+                    'end': end,
+                    'color': color,
+                    'type': 'tickers'
+                })
         
         elif tag_type == 'persons':
-            persons = document.text.tags.persons
+            persons = document_tags(document, 'text', 'persons', active_dictionaries)
             for match, start, end in persons:
                 all_matches.append({
                     'match': match,
@@ -414,7 +953,7 @@ def process_tags():
                 })
         
         elif tag_type == 'cusips':
-            cusips = document.text.tags.cusips
+            cusips = document_tags(document, 'text', 'cusips', active_dictionaries)
             for match, start, end in cusips:
                 all_matches.append({
                     'match': match,
@@ -425,7 +964,7 @@ def process_tags():
                 })
         
         elif tag_type == 'isins':
-            isins = document.text.tags.isins
+            isins = document_tags(document, 'text', 'isins', active_dictionaries)
             for match, start, end in isins:
                 all_matches.append({
                     'match': match,
@@ -436,7 +975,7 @@ def process_tags():
                 })
         
         elif tag_type == 'figis':
-            figis = document.text.tags.figis
+            figis = document_tags(document, 'text', 'figis', active_dictionaries)
             for match, start, end in figis:
                 all_matches.append({
                     'match': match,
@@ -459,32 +998,15 @@ def process_tags():
     for tag_type in tags_summary:
         tags_summary[tag_type] = sorted(list(tags_summary[tag_type]))
     
-    # Sort matches by start position (descending) to avoid position shifts when highlighting
-    all_matches.sort(key=lambda x: x['start'], reverse=True)
-    
-    # Apply highlighting to the text
-    highlighted_text = str(document.text)
-    
-    for match_info in all_matches:
-        start = match_info['start']
-        end = match_info['end']
-        color = match_info['color']
-        match_type = match_info['type']
-        
-        # Create highlighted span
-        original_text = highlighted_text[start:end]
-        highlighted_span = f'<span style="background-color: {color}; color: white; padding: 2px; border-radius: 3px;" title="{match_type}: {original_text}">{original_text}</span>'
-        
-        # Replace the text
-        highlighted_text = highlighted_text[:start] + highlighted_span + highlighted_text[end:]
+    # Apply highlighting to the text in a single pass
+    highlighted_text = highlight_text(str(document.text), all_matches)
     
     # Convert newlines to HTML breaks for display
     highlighted_text = highlighted_text.replace('\n', '<br>')
 
     similarity_results = None
     if 'loughran_mcdonald' in selected_similarity:
-        similarity_results = document.text.similarity.loughran_mcdonald
-        print(f"sim: {similarity_results}")
+        similarity_results = document_tags(document, 'text', 'loughran_mcdonald', active_dictionaries)
     
     return render_template('text.html', 
                      document=document,
@@ -497,47 +1019,107 @@ def process_tags():
                      form_data=request.form,
                      similarity_results=similarity_results)
 
-@app.route('/document/<index>')
+@app.route('/document/<int:index>')
 def document_view(index):
     global cache
 
-    cache['document'] = cache['submission']._load_document_by_index(int(index))
+    accession = request.args.get('accession')
+    if not accession:
+        if cache.get('submission') is None:
+            return redirect('/')
+        accession = cache['submission'].accession
+    document = get_document(accession, index)
+
+    cache['document_key'] = (accession, index)
+    g.document_args = {'accession': accession, 'index': index}
         
     return render_template('document.html', 
-                            document=cache['document'])
+                            document=document)
     
        
 @app.route('/submission/<accession>', methods=['GET', 'POST'])
 def submission_view(accession):
     global cache
 
-    cache['submission'] = next((sub for sub in cache['portfolio'] if sub.accession == accession), None)
+    submission = require_submission(accession)
+    cache['submission'] = submission
+    prefetch_submission(submission)
     
     return render_template('submission.html', submission=cache['submission'])
 
+@app.route('/api/prefetch')
+def prefetch_status_api():
+    return jsonify(prefetcher.status())
+
+@app.route('/api/prefetch/cancel', methods=['POST'])
+def prefetch_cancel_api():
+    """Stop prefetching, e.g. when the user leaves a submission page. With ?accession= only if it is that one."""
+    return jsonify({'cancelled': prefetcher.cancel(request.values.get('accession'))})
+
+def send_document(mimetype):
+    """Send the current document's raw bytes, streamed from the batch tar or file on disk without loading the
+    document, with ETag, Range and gzip/brotli for text types"""
+    key = current_document_key()
+    if key is None:
+        return redirect('/')
+    accession, doc_index = key
+
+    location = document_location(require_submission(accession), doc_index, get_portfolio_index())
+    last_modified = None
+    if location is None:
+        # old style tar submissions, only reachable through datamule
+        content = get_document(accession, doc_index).content
+        file, size = io.BytesIO(content), len(content)
+        etag = hashlib.blake2b(content, digest_size=16).hexdigest()
+    elif location[0] == 'member':
+        _, batch_path, offset, size = location
+        last_modified = os.path.getmtime(batch_path)
+        file = MemberFile(batch_path, offset, size)
+        etag = f'{accession}-{doc_index}-{offset}-{size}-{int(last_modified)}'
+    else:
+        stat = location[1].stat()
+        size, last_modified = stat.st_size, stat.st_mtime
+        # a real file, so the server can use sendfile
+        file = open(location[1], 'rb')
+        etag = f'{accession}-{doc_index}-{size}-{int(last_modified)}'
+
+    # ranges are offsets into the raw bytes, so a range request is never compressed
+    encoding = None if request.range else choose_encoding(request.accept_encodings, mimetype, size)
+    if encoding:
+        response = Response(compress_stream(file, encoding), mimetype=mimetype)
+        response.call_on_close(file.close)
+        response.headers['Content-Encoding'] = encoding
+        response.set_etag(f'{etag}-{encoding}')
+    else:
+        response = Response(wrap_file(request.environ, file, CHUNK_SIZE), mimetype=mimetype, direct_passthrough=True)
+        response.content_length = size
+        response.set_etag(etag)
+
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if is_compressible(mimetype):
+        response.vary.add('Accept-Encoding')
+    response.headers['Content-Disposition'] = 'inline'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response.make_conditional(request, accept_ranges=not encoding, complete_length=None if encoding else size)
+
 @app.route('/document/content')
 def content_view():
-    global cache
-    document = cache.get('document')
-    
-    return Response(
-        document.content,
-        mimetype='text/plain',
-        headers={
-            'Content-Disposition': 'inline',
-            'X-Content-Type-Options': 'nosniff'
-        }
-    )
+    return send_document('text/plain')
 
 @app.route('/document/visualize', methods=['GET', 'POST'])
 def visualize_view():
-    global cache
-    document = cache.get('document')
-    document.reset_nlp()
-    
+    document = current_document()
     if not document:
         return redirect('/')
-    
+
+    return cached_render('visualize', document, lambda: render_visualize(document))
+
+def render_visualize(document):
+    """Render the visualization page, with tags and sentiment when the form was posted"""
+    # parsed up front so the parse is timed apart from tag extraction, which would otherwise trigger it
+    data = parsed_data(document)
+
     if request.method == 'POST':
         # Get form data
         selected_tags = request.form.getlist('tags')
@@ -550,34 +1132,8 @@ def visualize_view():
             if color_key in request.form:
                 colors[tag_type] = request.form[color_key]
         
-        # Set up dictionaries based on form selections
-        from datamule.tags.config import set_dictionaries
-        active_dictionaries = []
-        
-        # Check each dictionary type selection
-        dict_mappings = {
-            'persons_dict': ['ssa_baby_first_names', '8k_2024_persons'],
-            'cusips_dict': ['sc13dg_cusips', '13fhr_information_table_cusips'], 
-            'figis_dict': ['npx_figis'],
-            'isins_dict': ['npx_isins'],
-            'sentiment_dict': ['loughran_mcdonald']
-        }
-        
-        for dict_type, dict_options in dict_mappings.items():
-            selected_dict = request.form.get(dict_type)
-            if selected_dict and selected_dict != 'none' and selected_dict in dict_options:
-                active_dictionaries.append(selected_dict)
-        
-        # Also add loughran_mcdonald if similarity is selected
-        if 'loughran_mcdonald' in selected_similarity:
-            if 'loughran_mcdonald' not in active_dictionaries:
-                active_dictionaries.append('loughran_mcdonald')
-        
-        # Set active dictionaries
-        if active_dictionaries:
-            set_dictionaries(active_dictionaries)
-        else:
-            set_dictionaries([])
+        # Dictionaries chosen in the form, passed to each extraction rather than set globally
+        active_dictionaries = selected_dictionaries()
         
         # Collect all matches with their positions and colors from document.data
         all_matches = []
@@ -587,24 +1143,19 @@ def visualize_view():
             color = colors.get(tag_type, '#000000')
             
             if tag_type == 'tickers':
-                # Tickers work differently - need to extract from the ticker object
-                ticker_data = document.data.tags.tickers
-                if ticker_data and hasattr(ticker_data, '_tickers_data') and ticker_data._tickers_data:
-                    ticker_matches = ticker_data._tickers_data.get('all', [])
-                    for match_info in ticker_matches:
-                        if len(match_info) >= 3:
-                            ticker, start, end = match_info[:3]
-                            all_matches.append({
-                                'match': ticker,
-                                'fragment_id': None,
-                                'start': start,
-                                'end': end,
-                                'color': color,
-                                'type': 'tickers'
-                            })
+                # Ticker matches come from the full text, so they have no fragment
+                for ticker, start, end in document_tags(document, 'data', 'tickers', active_dictionaries):
+                    all_matches.append({
+                        'match': ticker,
+                        'fragment_id': None,
+                        'start': start,
+                        'end': end,
+                        'color': color,
+                        'type': 'tickers'
+                    })
             
             elif tag_type == 'persons':
-                persons = document.data.tags.persons
+                persons = document_tags(document, 'data', 'persons', active_dictionaries)
                 for match, fragment_id, start, end in persons:
                     all_matches.append({
                         'match': match,
@@ -616,7 +1167,7 @@ def visualize_view():
                     })
             
             elif tag_type == 'cusips':
-                cusips = document.data.tags.cusips
+                cusips = document_tags(document, 'data', 'cusips', active_dictionaries)
                 for match, fragment_id, start, end in cusips:
                     all_matches.append({
                         'match': match,
@@ -628,7 +1179,7 @@ def visualize_view():
                     })
             
             elif tag_type == 'isins':
-                isins = document.data.tags.isins
+                isins = document_tags(document, 'data', 'isins', active_dictionaries)
                 for match, fragment_id, start, end in isins:
                     all_matches.append({
                         'match': match,
@@ -640,7 +1191,7 @@ def visualize_view():
                     })
             
             elif tag_type == 'figis':
-                figis = document.data.tags.figis
+                figis = document_tags(document, 'data', 'figis', active_dictionaries)
                 for match, fragment_id, start, end in figis:
                     all_matches.append({
                         'match': match,
@@ -668,7 +1219,7 @@ def visualize_view():
         similarity_results = None
         available_sentiment_keys = []
         if 'loughran_mcdonald' in selected_similarity:
-            similarity_results = document.data.similarity.loughran_mcdonald
+            similarity_results = document_tags(document, 'data', 'loughran_mcdonald', active_dictionaries)
             if similarity_results:
                 # Extract available keys from first fragment (excluding fragment_id and total_words)
                 first_fragment = similarity_results[0] if similarity_results else {}
@@ -701,10 +1252,10 @@ def visualize_view():
                 if fragment_id is not None:
                     sentiment_fragments[fragment_id] = fragment_data
         
-        # Generate visualization HTML with highlighting
-        data_visualization = '\n'.join(visualize_data_as_html(document.data, all_matches, sentiment_fragments, sentiment_colors))
+        # Stream visualization HTML with highlighting
+        data_visualization = chunked(metrics.timed_iter('visualize_html', iter_visualize_data_as_html(data, all_matches, sentiment_fragments, sentiment_colors)))
         
-        return render_template('visualize.html', 
+        return stream_template('visualize.html', 
                              document=document,
                              data_visualization=data_visualization,
                              matches_found=len(all_matches),
@@ -719,24 +1270,104 @@ def visualize_view():
                              sentiment_colors=sentiment_colors)
     
     else:
-        # Default GET request - show standard visualization
-        html = visualize_data_as_html(document.data)
-        return render_template('visualize.html', 
+        # Default GET request - stream standard visualization
+        html = chunked(metrics.timed_iter('visualize_html', iter_visualize_data_as_html(data)))
+        return stream_template('visualize.html', 
                              document=document,
-                             data_visualization='\n'.join(html))
+                             data_visualization=html)
     
+@app.route('/document/diff')
+def diff_view():
+    """The current document against its counterpart in another filing (?against=<accession>&against_index=),
+    by default the same filer's previous filing of the same type"""
+    key = current_document_key()
+    if key is None:
+        return redirect('/')
+    accession, doc_index = key
+    document = get_document(accession, doc_index)
+
+    against = request.args.get('against', '').strip()
+    if not against:
+        previous = get_portfolio_index().previous_filing(accession)
+        if previous is None:
+            return render_template('diff.html', document=document,
+                                   error='No earlier filing of this type by this filer in the portfolio, enter one to compare with.')
+        against = previous['accession']
+
+    against_submission = get_submission(against)
+    if against_submission is None:
+        return render_template('diff.html', document=document, against=against, error=f'No submission {against} in the portfolio.'), 404
+
+    documents = against_submission.metadata.content.get('documents') or []
+    against_index = request.args.get('against_index', type=int)
+    if against_index is None:
+        document_type = get_submission(accession).metadata.content['documents'][doc_index].get('type')
+        against_index = counterpart_index(documents, document_type, doc_index)
+    if not 0 <= against_index < len(documents):
+        return render_template('diff.html', document=document, against=against,
+                               error=f'{against} has no document {against_index}.'), 404
+
+    old_document = get_document(against, against_index)
+    context = request.args.get('context', '').lower() in ('1', 'true', 'yes')
+    # the other document is part of what is rendered, so its content is part of the key
+    options = {'against': against, 'against_index': against_index, 'against_hash': content_hash(old_document), 'context': context}
+    return cached_render('diff', document, lambda: render_diff(old_document, document, against, against_index, context), options)
+
+def counterpart_index(documents, document_type, fallback):
+    """Index of the document of the same type (the 10-K for a 10-K, EX-21 for EX-21), else of the same position"""
+    for doc_index, doc in enumerate(documents):
+        if doc.get('type') == document_type:
+            return doc_index
+    return fallback if fallback < len(documents) else 0
+
+def render_diff(old_document, document, against, against_index, context):
+    """Render the diff page of two documents, streamed"""
+    old_data, data = parsed_data(old_document), parsed_data(document)
+    if not all(isinstance(d, dict) and d.get('document') for d in (old_data, data)):
+        return stream_template('diff.html', document=document, old_document=old_document, against=against,
+                               against_index=against_index, context=context,
+                               error='Only documents parsed into sections (html and text) can be compared.')
+
+    old_hashes, new_hashes = section_hashes(old_document), section_hashes(document)
+    html = chunked(metrics.timed_iter('diff_html', iter_diff_as_html(old_data, data, old_hashes, new_hashes, context)))
+    return stream_template('diff.html', document=document, old_document=old_document, against=against,
+                           against_index=against_index, context=context, data_diff=html)
+
 @app.route('/document/data')
 def data_view():
-    global cache
-    document = cache.get('document')
-    
-    return jsonify(document.data)
+    document = current_document()
+    if not document:
+        return redirect('/')
+
+    # ?path=document.part1.item7 sends just that section
+    data = parsed_data(document)
+    path = request.args.get('path', '').strip()
+    if path:
+        try:
+            data = select_path(data, path)
+        except KeyError:
+            return jsonify({'error': f'No such path: {path}'}), 404
+
+    body = iter_json(data)
+    encoding = choose_encoding(request.accept_encodings, 'application/json')
+    if encoding:
+        body = compress_chunks(body, encoding)
+
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 @app.route('/document/open')
 def open_view():
-    global cache
-    document = cache.get('document')
-    
+    key = current_document_key()
+    if key is None:
+        return redirect('/')
+    accession, doc_index = key
+    doc = require_submission(accession).metadata.content['documents'][doc_index]
+    extension = os.path.splitext(doc.get('filename') or doc['sequence'] + '.txt')[1]
+
     # Manual mapping since mimetypes is being unreliable
     ext_to_mime = {
         '.htm': 'text/html',
@@ -754,97 +1385,323 @@ def open_view():
         '.xml': 'text/xml'
     }
     
-    mime_type = ext_to_mime.get(document.extension.lower(), 'text/plain')
-    
-    print(f"Extension: {document.extension}")
-    print(f"Mime type: {mime_type}")
+    mime_type = ext_to_mime.get(extension.lower(), 'text/plain')
 
-    return Response(
-        document.content,
-        mimetype=mime_type,
-        headers={
-            'Content-Disposition': 'inline',
-            'X-Content-Type-Options': 'nosniff'
-        }
-    )
+    return send_document(mime_type)
 @app.route('/document/text')
 def text_view():
-    global cache
-    document = cache.get('document')
-    document.text
+    document = current_document()
+    if not document:
+        return redirect('/')
+    if getattr(document, '_text', None) is None:
+        parsed_data(document)
+        with metrics.phase('flatten_text'):
+            document.text
     
     return render_template('text.html', document=document)
 
 @app.route('/document/tables')
 def tables_view():
-    global cache
-    document = cache.get('document')
-    return render_template('tables.html', tables=document.tables)
+    document = current_document()
+    if not document:
+        return redirect('/')
+    # only names and sizes, the rows are fetched per table from /api/document/tables/<n>
+    return cached_render('tables', document, lambda: render_template('tables.html', tables=table_summary(document_tables(document))))
+
+def current_table(table_index):
+    document = current_document()
+    if document is None:
+        return None
+    tables = document_tables(document)
+    if not 0 <= table_index < len(tables):
+        return None
+    return tables[table_index]
+
+@app.route('/api/document/tables/<int:table_index>')
+def table_rows_api(table_index):
+    table = current_table(table_index)
+    if table is None:
+        return jsonify({'error': 'No such table'}), 404
+
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    total = table_row_count(table)
+    return jsonify({
+        'name': table.name,
+        'columns': table_columns(table),
+        'total': total,
+        'offset': offset,
+        'rows': list(iter_table_rows(table, offset, limit)),
+        'next_offset': offset + limit if offset + limit < total else None,
+    })
+
+@app.route('/document/tables/<int:table_index>.<any(csv, ndjson):fmt>')
+def table_export(table_index, fmt):
+    table = current_table(table_index)
+    if table is None:
+        return 'No such table', 404
+
+    args = g.document_args
+    filename = f"{args['accession']}_{args['index']}_table{table_index}.{fmt}"
+    if fmt == 'csv':
+        body, mimetype = stream_csv(table), 'text/csv'
+    else:
+        body, mimetype = stream_ndjson(table), 'application/x-ndjson'
+    return Response(body, mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
     
 @app.route('/xbrl')
 def xbrl_view():
-    global cache
-    submission = cache.get('submission')
-    submission.xbrl
-    
-    return render_template('xbrl.html', submission=submission)
+    submission = current_submission()
+    if submission is None:
+        return redirect('/')
+    store = get_xbrl_store().ensure(submission)
+
+    filters = xbrl_filters()
+    facts, next_cursor, total = store.facts(submission.accession, **filters)
+    return render_template('xbrl.html', submission=submission, facts=facts, next_cursor=next_cursor, total=total,
+                           units=store.units(submission.accession), cik=store.cik(submission.accession), filters=filters)
+
+def xbrl_filters():
+    """Concept prefix, period, unit and paging arguments shared by the XBRL page and API"""
+    limit = request.args.get('limit', 100, type=int)
+    return {
+        'concept': request.args.get('concept', '').strip() or None,
+        'period': request.args.get('period', '').strip() or None,
+        'unit': request.args.get('unit', '').strip() or None,
+        'limit': max(1, min(limit, 1000)),
+        'cursor': request.args.get('cursor', type=int),
+    }
+
+@app.route('/api/xbrl')
+def xbrl_api():
+    submission = current_submission()
+    if submission is None:
+        return jsonify({'error': 'No submission open'}), 404
+    store = get_xbrl_store().ensure(submission)
+
+    facts, next_cursor, total = store.facts(submission.accession, **xbrl_filters())
+    return jsonify({'accession': submission.accession, 'total': total, 'next_cursor': next_cursor, 'facts': facts})
+
+@app.route('/api/xbrl/concept/<concept>')
+def xbrl_concept_api(concept):
+    """Every stored value of a concept across submissions, e.g. us-gaap:Revenues for one CIK"""
+    if 'portfolio_path' not in cache:
+        return jsonify({'error': 'No portfolio loaded'}), 400
+    facts = get_xbrl_store().concept_history(concept, request.args.get('cik'),
+                                             include_dimensions=request.args.get('dimensions') == '1')
+    return jsonify({'concept': concept, 'cik': request.args.get('cik'), 'facts': facts})
 
 @app.route('/fundamentals')
 def fundamentals_view():
-    global cache
-    submission = cache.get('submission')  
-    submission.fundamentals
+    submission = current_submission()
+    if submission is None:
+        return redirect('/')
+
+    # precomputed panel first, parsing the XBRL only for filings it doesn't cover
+    fundamentals = get_fundamentals_panel().filing(submission.accession)
+    if fundamentals is None:
+        fundamentals = submission.parse_fundamentals()
+
+    cik = _submission_metadata(submission.metadata.content)[2]
+    return render_template('fundamentals.html', submission=submission, fundamentals=fundamentals,
+                           cik=normalize_cik(cik) if cik else '')
+
+@app.route('/fundamentals/history')
+def fundamentals_history_view():
+    """A metric's history for one CIK across every filing in the portfolio, from the precomputed panel"""
+    if 'portfolio_path' not in cache:
+        return redirect('/')
+
+    panel = get_fundamentals_panel()
+    cik = request.args.get('cik', '').strip()
+    metric = request.args.get('metric', '').strip()
+    statement = request.args.get('statement') or None
+    history = panel.history(cik, metric, statement) if cik and metric else []
 
-    return render_template('fundamentals.html', submission=submission)
+    return render_template('fundamentals_history.html', cik=cik, metric=metric, statement=statement, history=history,
+                           ciks=panel.ciks(), metrics=panel.metrics(cik) if cik else [], built=panel.exists())
+
+@app.route('/api/fundamentals/<cik>/<metric>')
+def fundamentals_history_api(cik, metric):
+    if 'portfolio_path' not in cache:
+        return jsonify({'error': 'No portfolio loaded'}), 400
+    history = get_fundamentals_panel().history(cik, metric, request.args.get('statement') or None)
+    return jsonify({'cik': normalize_cik(cik), 'metric': metric, 'history': history})
 
 @app.route('/portfolio', methods=['GET', 'POST'])
 def portfolio_view():
     global cache
     
+    if 'portfolio_path' not in cache:
+        return redirect('/')
+
     portfolio_path = cache['portfolio_path']
-    portfolio = cache.setdefault('portfolio', Portfolio(portfolio_path))
+    portfolio = get_portfolio()
+
+    # pick up batches added since the last visit, the page then polls /api/portfolio/events for ones added later
+    index = get_portfolio_index()
+    index.refresh()
     
     # Handle POST actions (compress, decompress, delete)
     if request.method == 'POST':
         action = request.form.get('action')
-        if action == 'compress':
-            portfolio.compress()
-        elif action == 'decompress':
-            portfolio.decompress()
+        if action in ('compress', 'decompress'):
+            get_job_manager().submit(action, path=portfolio_path)
+            return redirect('/jobs')
+        elif action in ('build_search', 'build_xbrl', 'build_fundamentals'):
+            get_job_manager().submit(action, path=portfolio_path)
+            return redirect('/jobs')
+        elif action in ('precompute_tags', 'build_entities'):
+            dictionaries = process_form_list(request.form.get('dictionaries')) or []
+            get_job_manager().submit(action, path=portfolio_path, dictionaries=dictionaries)
+            return redirect('/jobs')
         elif action == 'delete':
-            portfolio.delete()
+            # release our tar handles before the job removes the folder
+            portfolio._close_batch_handles()
+            get_job_manager().submit('delete', path=portfolio_path)
             # Reset global variables
             cache = {}
+            document_cache.clear()
+            submission_cache.clear()
             return redirect('/')
         
         return redirect('/portfolio')
         
+    try:
+        submissions, next_cursor = index.page(**submission_page_args())
+    except ValueError:
+        return redirect('/portfolio')
+
     return render_template('portfolio.html',
-        portfolio = portfolio
+        portfolio = portfolio,
+        submissions = submissions,
+        total_submissions = index.count(),
+        indexed_since = index.last_indexed(),
+        poll_ms = int(PORTFOLIO_POLL_SECONDS * 1000),
+        next_cursor = next_cursor,
+        filters = {k: v for k, v in request.args.items() if k != 'cursor'}
     )
 
+@app.route('/api/submissions')
+def submissions_api():
+    index = get_portfolio_index()
+    index.refresh()
+    try:
+        submissions, next_cursor = index.page(**submission_page_args())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    for sub in submissions:
+        sub.pop('batch', None)
+    return jsonify({'submissions': submissions, 'next_cursor': next_cursor})
+
+@app.route('/api/portfolio/events')
+def portfolio_events():
+    """Long poll for the batches indexed after since, e.g. while a download is still writing them. Waits up to
+    PORTFOLIO_WAIT_SECONDS for one, returns the batches with their submissions and the since to poll with next."""
+    if 'portfolio_path' not in cache:
+        return jsonify({'error': 'No portfolio loaded'}), 400
+    index = get_portfolio_index()
+    since = request.args.get('since', 0, type=float)
+
+    deadline = time.monotonic() + PORTFOLIO_WAIT_SECONDS
+    waiting = portfolio_waiters.acquire(blocking=False)
+    try:
+        while True:
+            index.refresh()
+            batches = index.indexed_since(since)
+            # stop waiting when another portfolio is opened
+            if batches or not waiting or time.monotonic() >= deadline or cache.get('index') is not index:
+                break
+            time.sleep(PORTFOLIO_POLL_SECONDS)
+    finally:
+        if waiting:
+            portfolio_waiters.release()
+
+    return jsonify({
+        'since': batches[-1][1] if batches else since,
+        'total': index.count(),
+        'batches': [{'batch': os.path.basename(path), 'submissions': index.batch_submissions(path)} for path, _ in batches],
+    })
+
+@app.route('/search')
+def search_view():
+    if 'portfolio_path' not in cache:
+        return redirect('/')
+
+    query = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = 20
+
+    index = get_search_index()
+    start = time.perf_counter()
+    results, total = index.search(query, limit=per_page, offset=(page - 1) * per_page)
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    return render_template('search.html', query=query, results=results, total=total, page=page,
+                           per_page=per_page, elapsed_ms=elapsed_ms, indexed=index.exists())
+
+@app.route('/api/search')
+def search_api():
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    results, total = get_search_index().search(request.args.get('q', ''), limit=limit, offset=offset)
+    return jsonify({'results': results, 'total': total})
+
+@app.route('/entities')
+def entities_view():
+    if 'portfolio_path' not in cache:
+        return redirect('/')
+
+    entity_type = request.args.get('type', 'cusips')
+    value = request.args.get('value', '').strip()
+    index = get_entity_index()
+    mentions = index.lookup(entity_type, value, with_offsets=False) if value else []
+
+    return render_template('entities.html', entity_type=entity_type, value=value, mentions=mentions,
+                           top=index.top(entity_type) if not value else [], indexed=index.exists())
+
+@app.route('/api/entities/<entity_type>/<path:value>')
+def entities_api(entity_type, value):
+    limit = max(1, min(request.args.get('limit', 1000, type=int), 10000))
+    mentions = get_entity_index().lookup(entity_type, value, limit=limit)
+    return jsonify({'type': entity_type, 'value': value, 'documents': mentions})
+
+@app.route('/sentiment', methods=['GET', 'POST'])
+def sentiment_view():
+    if 'portfolio_path' not in cache:
+        return redirect('/')
+
+    if request.method == 'POST':
+        document_type = request.form.get('document_type', '').strip()
+        if document_type:
+            get_job_manager().submit('build_sentiment', path=cache['portfolio_path'], document_type=document_type)
+            return redirect('/jobs')
+        return redirect('/sentiment')
+
+    store = get_sentiment_store()
+    document_types = store.document_types()
+    document_type = request.args.get('type') or (document_types[0] if document_types else '')
+    section = request.args.get('section', '')
+    series = store.series(document_type, section, request.args.get('cik'))
+
+    return render_template('sentiment.html', document_types=document_types, document_type=document_type,
+                           sections=store.sections(document_type), section=section, series=series)
+
+@app.route('/api/sentiment')
+def sentiment_api():
+    store = get_sentiment_store()
+    return jsonify(store.series(request.args.get('type', '10-K'), request.args.get('section', ''), request.args.get('cik')))
+
 @app.route('/download', methods=['GET', 'POST'])
 def download_submissions():
     if request.method == 'POST':
         # Handle download folder browsing
         if 'browse_download_folder' in request.form:
-            root = tk.Tk()
-            root.withdraw()
-            root.attributes('-topmost', True)
-            
-            try:
-                folder_path = filedialog.askdirectory(
-                    title="Select Download Folder",
-                    initialdir=os.getcwd()
-                )
-                
-                if folder_path:
-                    return render_template('index.html', download_path=folder_path)
-                    
-            except Exception as e:
-                print(f"Error opening file dialog: {str(e)}", "error")
-            finally:
-                root.destroy()
+            folder_path = choose_folder("Select Download Folder")
+            if folder_path:
+                return render_template('index.html', download_path=folder_path,
+                                       headless=app.config['SECBROWSER_HEADLESS'])
         
         # Handle download submission
         elif 'download_submissions' in request.form:
@@ -856,9 +1713,6 @@ def download_submissions():
                 print("Download directory and portfolio name are required", "error")
                 return redirect('/')
             
-            # Create portfolio instance for downloading
-            download_portfolio = Portfolio(os.path.join(download_dir, folder_name))
-            
             # Process form parameters
             kwargs = {}
             
@@ -906,45 +1760,125 @@ def download_submissions():
             # Remove None values
             kwargs = {k: v for k, v in kwargs.items() if v is not None}
             
-            # Start download
-            download_portfolio.download_submissions(**kwargs)
+            # Start download in the background
+            get_job_manager().submit('download', path=os.path.join(download_dir, folder_name), kwargs=kwargs)
             
             # Optionally set this as the current portfolio
-            cache['portfolio_path'] = os.path.join(download_dir, folder_name)
-            return redirect('/portfolio')
+            if not app.config['SECBROWSER_FIXED_PORTFOLIO']:
+                cache['portfolio_path'] = os.path.join(download_dir, folder_name)
+            return redirect('/jobs')
     
     # note sure i need this
     return redirect('/')
 
+@app.route('/metrics')
+def metrics_view():
+    """Prometheus scrape endpoint: request and phase latency histograms plus cache counters"""
+    render_cache = get_render_cache()
+    caches = {
+        'document': document_cache.stats(),
+        'submission': submission_cache.stats(),
+        'render': {'hits': render_cache.hits, 'misses': render_cache.misses, 'bytes': render_cache.memory.current_bytes},
+    }
+    extra = [
+        ('secbrowser_cache_lookups_total', 'counter', 'Cache lookups by cache and result',
+         [({'cache': name, 'result': result}, stats[key]) for name, stats in caches.items()
+          for result, key in (('hit', 'hits'), ('miss', 'misses'))]),
+        ('secbrowser_cache_bytes', 'gauge', 'Estimated bytes held in memory by each cache',
+         [({'cache': name}, stats['bytes']) for name, stats in caches.items()]),
+    ]
+    return Response(metrics.exposition(extra), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/dictionaries')
+def dictionaries_api():
+    return jsonify(dictionary_registry.stats())
+
+@app.route('/jobs')
+def jobs_view():
+    return render_template('jobs.html', jobs=get_job_manager().list())
+
+@app.route('/api/jobs')
+def jobs_api():
+    return jsonify(get_job_manager().list(limit=request.args.get('limit', 100, type=int)))
+
+@app.route('/api/jobs/<job_id>')
+def job_status_api(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel_api(job_id):
+    cancelled = get_job_manager().cancel(job_id)
+    if 'redirect' in request.form:
+        return redirect('/jobs')
+    return jsonify({'id': job_id, 'cancelled': cancelled})
+
+@app.route('/api/jobs/<job_id>/retry', methods=['POST'])
+def job_retry_api(job_id):
+    new_id = get_job_manager().retry(job_id)
+    if 'redirect' in request.form:
+        return redirect('/jobs')
+    if new_id is None:
+        return jsonify({'error': 'job not found or still active'}), 409
+    return jsonify({'id': new_id}), 202
+
+@app.route('/api/portfolio', methods=['GET', 'POST'])
+def portfolio_api():
+    """The current portfolio path, or open another one by posting its path (form field or JSON)"""
+    if request.method == 'POST':
+        if app.config['SECBROWSER_FIXED_PORTFOLIO']:
+            return jsonify({'error': 'the portfolio is fixed by secbrowser.serve, restart it to serve another'}), 409
+        path = request.values.get('path') or (request.get_json(silent=True) or {}).get('path')
+        if not path or not os.path.isdir(path):
+            return jsonify({'error': 'path must be an existing directory'}), 400
+        open_portfolio(os.path.abspath(path))
+    return jsonify({'path': cache.get('portfolio_path')})
+
 @app.route('/', methods=['GET', 'POST'])
 def landing_page():
-    global cache
-    
-    if request.method == 'POST' and 'browse_folder' in request.form:
-        root = tk.Tk()
-        root.withdraw()
-        root.attributes('-topmost', True)
-        
-        try:
-            folder_path = filedialog.askdirectory(
-                title="Select Portfolio Folder",
-                initialdir=os.getcwd()
-            )
-            
-            if folder_path:
-                # reset cache
-                cache = {}
+    if request.method == 'POST':
+        if app.config['SECBROWSER_FIXED_PORTFOLIO']:
+            return 'The portfolio is fixed by secbrowser.serve, restart it to serve another', 409
+        if 'browse_folder' in request.form:
+            folder_path = choose_folder("Select Portfolio Folder")
+        else:
+            folder_path = request.form.get('portfolio_path', '').strip()
 
-                # set path
-                cache['portfolio_path'] = folder_path
-                return redirect('/portfolio')
-                
-        except Exception as e:
-            print(f"Error opening file dialog: {str(e)}", "error")
-        finally:
-            root.destroy()
+        if folder_path and os.path.isdir(folder_path):
+            open_portfolio(os.path.abspath(folder_path))
+            return redirect('/portfolio')
+        if folder_path:
+            print(f"Not a directory: {folder_path}", "error")
     
-    return render_template('index.html')
+    return render_template('index.html', headless=app.config['SECBROWSER_HEADLESS'])
+
+def run_server(portfolio_path=None, host='127.0.0.1', port=5000, headless=None, debug=True):
+    if portfolio_path:
+        cache['portfolio_path'] = os.path.abspath(portfolio_path)
+    if headless is not None:
+        app.config['SECBROWSER_HEADLESS'] = headless
+
+    # with the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests, so only it warms
+    # and picks up the jobs left queued or interrupted by the last run
+    if os.environ.get('WERKZEUG_RUN_MAIN') or not debug:
+        get_job_manager()
+        warm = process_form_list(os.environ.get('SECBROWSER_WARM_DICTIONARIES'))
+        if warm:
+            threading.Thread(target=dictionary_registry.warm, args=(warm,), daemon=True).start()
+    app.run(host=host, port=port, debug=debug)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the secbrowser development server.')
+    parser.add_argument('portfolio', nargs='?', default=os.environ.get('SECBROWSER_PORTFOLIO'))
+    parser.add_argument('--host', default=os.environ.get('SECBROWSER_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SECBROWSER_PORT', 5000)))
+    parser.add_argument('--headless', action='store_true', default=None,
+                        help='never open native folder dialogs, e.g. on a server without a display')
+    parser.add_argument('--no-debug', dest='debug', action='store_false')
+    args = parser.parse_args()
+    run_server(args.portfolio, args.host, args.port, args.headless, args.debug)
 
-def run_server():
-    app.run(debug=True)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
\ No newline at end of file
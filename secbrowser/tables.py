@@ -0,0 +1,122 @@
+"""Table access for /document/tables: a cheap summary of every table, row paging, and streaming CSV/NDJSON export."""
+import csv
+import io
+import json
+
+# what doc2dict calls the parts of a table in data tuples, and the add_table argument each one goes to
+TABLE_PARTS = {'table_title': 'name', 'table_data': 'data', 'table_preamble': 'preamble',
+               'table_postamble': 'postamble', 'table_footnote': 'footnotes', 'table_footnotes': 'footnotes'}
+
+
+def _text_node(value):
+    """datamule's Table expects text parts as doc2dict nodes, newer doc2dict hands them over as plain strings"""
+    return {'text': value} if isinstance(value, str) else value
+
+
+def _footnotes(values):
+    footnotes = []
+    for value in values:
+        # either a node, or a list of [footnote id, text] pairs
+        if isinstance(value, dict):
+            footnotes.append(value)
+        elif isinstance(value, list):
+            footnotes.extend({'footnote_id': pair[0], 'text': pair[-1]} for pair in value
+                             if isinstance(pair, (list, tuple)) and pair)
+        elif isinstance(value, str):
+            footnotes.append({'text': value})
+    return footnotes
+
+
+def _tables_from_tuples(document):
+    """Group table data tuples by id, like datamule's parse_tables, without assuming how many fields a tuple has"""
+    from datamule.tables.tables import Tables
+
+    parts_by_id = {}
+    for data_tuple in document.data_tuples or []:
+        part = TABLE_PARTS.get(data_tuple[1])
+        if part is None:
+            continue
+        parts = parts_by_id.setdefault(data_tuple[0], {'footnotes': []})
+        if part == 'footnotes':
+            parts['footnotes'].append(data_tuple[2])
+        else:
+            parts[part] = data_tuple[2]
+
+    tables = Tables(document_type=document.type, accession=document.accession)
+    for parts in parts_by_id.values():
+        if 'data' not in parts:
+            continue
+        tables.add_table(data=parts['data'], name=parts.get('name') or 'extracted_table',
+                         footnotes=_footnotes(parts['footnotes']) or None,
+                         preamble=_text_node(parts.get('preamble')), postamble=_text_node(parts.get('postamble')))
+    return tables
+
+
+def document_tables(document):
+    """The document's datamule Table objects, parsed once and kept on the document"""
+    try:
+        return document.tables.tables
+    except ValueError:
+        # newer doc2dict data tuples carry extra fields that datamule's parse_tables can't unpack
+        document._tables = _tables_from_tuples(document)
+        return document._tables.tables
+
+
+def table_columns(table):
+    """Column names: the keys of xml rows, or the first row of an html table"""
+    if not table.data:
+        return []
+    if isinstance(table.data[0], dict):
+        return [column for column in table.data[0].keys() if column != '_table']
+    return [str(value) for value in table.data[0]]
+
+
+def table_row_count(table):
+    if table.data and not isinstance(table.data[0], dict):
+        return len(table.data) - 1
+    return len(table.data)
+
+
+def iter_table_rows(table, offset=0, limit=None):
+    """Rows as lists aligned with table_columns, starting at offset, without copying the table"""
+    columns = table_columns(table)
+    dict_rows = bool(table.data) and isinstance(table.data[0], dict)
+    start = offset if dict_rows else offset + 1
+    stop = len(table.data) if limit is None else min(len(table.data), start + limit)
+    for i in range(start, stop):
+        row = table.data[i]
+        if dict_rows:
+            yield [row.get(column) for column in columns]
+        else:
+            yield list(row)
+
+
+def table_summary(tables):
+    """Name, row and column counts for every table, which is all the tables page needs up front"""
+    return [{'index': i, 'name': table.name, 'rows': table_row_count(table), 'columns': len(table_columns(table)),
+             'preamble': table.preamble} for i, table in enumerate(tables)]
+
+
+def stream_csv(table):
+    """Yield a table as CSV, a row at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if table.data:
+        writer.writerow(table_columns(table))
+    for row in iter_table_rows(table):
+        writer.writerow(['' if value is None else value for value in row])
+        if buffer.tell() > 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_ndjson(table):
+    """Yield a table as newline delimited JSON objects keyed by column"""
+    # html header cells can be blank or repeated, which would drop values from the objects
+    columns = []
+    for i, column in enumerate(table_columns(table)):
+        columns.append(column if column and column not in columns else f'column_{i}')
+    for row in iter_table_rows(table):
+        yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
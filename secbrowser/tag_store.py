@@ -0,0 +1,173 @@
+"""Precomputed tag spans: datamule's tickers, persons, cusips, isins and figis and Loughran-McDonald
+similarity for every document, in both text and data mode, per set of dictionaries. Views read spans from
+here and only fall back to computing them live.
+
+Usage: python -m secbrowser.tag_store <portfolio> [--dictionaries name,name] [--workers N]
+"""
+import argparse
+import json
+import zlib
+
+from .batches import SidecarStore, iter_batch_documents
+from .dictionaries import registry
+
+TAGS_FILENAME = 'secbrowser_tags.db'
+
+TAG_TYPES = ['tickers', 'persons', 'cusips', 'isins', 'figis']
+
+# dictionaries each tag type can use, in the order datamule gives them precedence
+TAG_DICTIONARIES = {
+    'persons': ['8k_2024_persons', 'ssa_baby_first_names'],
+    'cusips': ['sc13dg_cusips', '13fhr_information_table_cusips'],
+    'figis': ['npx_figis'],
+    'isins': ['npx_isins'],
+    'loughran_mcdonald': ['loughran_mcdonald'],
+}
+
+MODES = ('text', 'data')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    path TEXT,
+    dictionaries TEXT,
+    mtime REAL,
+    size INTEGER,
+    PRIMARY KEY (path, dictionaries)
+);
+CREATE TABLE IF NOT EXISTS spans (
+    accession TEXT,
+    doc_index INTEGER,
+    mode TEXT,
+    tag_type TEXT,
+    dictionary TEXT,
+    batch TEXT,
+    payload BLOB,
+    PRIMARY KEY (accession, doc_index, mode, tag_type, dictionary)
+);
+CREATE INDEX IF NOT EXISTS spans_batch ON spans (batch);
+"""
+
+
+def dictionary_for(tag_type, dictionaries):
+    """Name of the dictionary datamule will use for tag_type given the active dictionaries, or 'none'"""
+    for name in TAG_DICTIONARIES.get(tag_type, []):
+        if name in dictionaries:
+            return name
+    return 'none'
+
+
+def extract_tags(document, mode, tag_type, dictionaries=()):
+    """Run datamule's extraction for one tag type with the given dictionaries and return plain tuples.
+
+    text mode gives (match, start, end), data mode gives (match, fragment_id, start, end).
+    Tickers always come from the full text, as (ticker, start, end).
+    """
+    tags = registry.tags(document, mode, dictionaries)
+    if tag_type == 'tickers':
+        ticker_data = tags.tickers
+        if ticker_data and hasattr(ticker_data, '_tickers_data') and ticker_data._tickers_data:
+            return [tuple(match_info[:3]) for match_info in ticker_data._tickers_data.get('all', []) if len(match_info) >= 3]
+        return []
+    return [tuple(match) for match in getattr(tags, tag_type)]
+
+
+def extract_similarity(document, mode, dictionaries=()):
+    return registry.similarity(document, mode, dictionaries).loughran_mcdonald
+
+
+def pack(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def unpack(payload):
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+
+def dictionaries_key(dictionaries):
+    return ','.join(sorted(dictionaries))
+
+
+class TagStore(SidecarStore):
+    """Precomputed tag spans, keyed by accession + document index"""
+    FILENAME = TAGS_FILENAME
+    SCHEMA = SCHEMA
+    BUILD_COLUMN = 'dictionaries'
+
+    def get(self, accession, doc_index, mode, tag_type, dictionary='none'):
+        """Return stored spans, or None if this document was not precomputed with that dictionary"""
+        if not self.path.exists():
+            return None
+        with self.connect() as conn:
+            row = conn.execute('SELECT payload FROM spans WHERE accession = ? AND doc_index = ? AND mode = ? '
+                               'AND tag_type = ? AND dictionary = ?',
+                               (accession, doc_index, mode, tag_type, dictionary)).fetchone()
+        if row is None:
+            return None
+        value = unpack(row[0])
+        # json turns tuples into lists
+        return [tuple(item) for item in value] if isinstance(value, list) and tag_type != 'loughran_mcdonald' else value
+
+    def drop_rows(self, conn, batch_path, build_key=None):
+        # rebuilding with one dictionary set replaces its spans by primary key, the spans other sets computed
+        # for the batch stay valid
+        if build_key is None:
+            conn.execute('DELETE FROM spans WHERE batch = ?', (batch_path,))
+
+    def write_rows(self, conn, batch_path, rows, build_key=None):
+        conn.executemany('INSERT OR REPLACE INTO spans VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         [(*row[:5], batch_path, row[5]) for row in rows])
+
+
+def _init_worker(dictionaries):
+    registry.warm(dictionaries)
+
+
+def _tag_document(document, accession, doc_index, dictionaries):
+    rows = []
+    for mode in MODES:
+        for tag_type in TAG_TYPES:
+            # tickers don't depend on the mode, store them once
+            if tag_type == 'tickers' and mode == 'data':
+                continue
+            rows.append((accession, doc_index, mode, tag_type, dictionary_for(tag_type, dictionaries),
+                         pack(extract_tags(document, mode, tag_type, dictionaries))))
+        if 'loughran_mcdonald' in dictionaries:
+            rows.append((accession, doc_index, mode, 'loughran_mcdonald', 'loughran_mcdonald',
+                         pack(extract_similarity(document, mode, dictionaries))))
+    return rows
+
+
+def tag_batch(batch_path, dictionaries):
+    """Worker: tag every parseable document in one batch tar. Returns rows for TagStore.write_batch."""
+    rows = []
+    for accession, doc_index, metadata, document in iter_batch_documents(batch_path):
+        if not document._data_bool:
+            continue
+        try:
+            rows.extend(_tag_document(document, accession, doc_index, dictionaries))
+        except Exception as e:
+            print(f"Skipped: {accession}/{document.filename} due to {e}")
+    return rows
+
+
+def precompute(portfolio_path, dictionaries=(), workers=None, progress=print):
+    """Tag all new or changed batches of a portfolio. Returns the number of batches processed."""
+    return TagStore(portfolio_path).build_batches(tag_batch, args=(tuple(dictionaries),), build_key=dictionaries_key(dictionaries),
+                                                  workers=workers, progress=progress, initializer=_init_worker,
+                                                  initargs=(tuple(dictionaries),))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute tag spans for every document in a portfolio.')
+    parser.add_argument('portfolio')
+    parser.add_argument('--dictionaries', default='', help='comma separated datamule dictionaries, e.g. 8k_2024_persons,loughran_mcdonald')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    dictionaries = [name.strip() for name in args.dictionaries.split(',') if name.strip()]
+    processed = precompute(args.portfolio, dictionaries, args.workers)
+    print(f"Processed {processed} batches")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""Typed XBRL fact store for a portfolio.
+
+Parsed facts are kept with one typed column per attribute (concept, value, numeric
+value, unit, period, context, dimensions, decimals) and concept names dictionary encoded, so a submission's
+facts can be paged and filtered without parsing its XBRL again, and a concept can be queried across filings.
+
+Submissions are stored the first time /xbrl opens them, or all at once with a build:
+python -m secbrowser.xbrl_store <portfolio> [--workers N]
+"""
+import argparse
+import json
+import sqlite3
+from decimal import Decimal, InvalidOperation
+
+from . import db
+from .batches import SidecarStore, iter_batch_documents
+from .cache import LRUCache
+from .index import _submission_metadata, normalize_cik
+
+XBRL_FILENAME = 'secbrowser_xbrl.db'
+
+# scratch stores a read-only process keeps, so reopening a filing doesn't parse its XBRL again
+SCRATCH_STORE_BYTES = 64 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    accession TEXT PRIMARY KEY,
+    batch TEXT,
+    cik TEXT,
+    filing_date TEXT,
+    fact_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS concepts (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS facts (
+    id INTEGER PRIMARY KEY,
+    accession TEXT,
+    concept_id INTEGER,
+    value TEXT,
+    value_number REAL,
+    unit TEXT,
+    period_start TEXT,
+    period_end TEXT,
+    instant INTEGER,
+    context TEXT,
+    dimensions TEXT,
+    decimals INTEGER
+);
+CREATE INDEX IF NOT EXISTS facts_accession ON facts (accession, id);
+CREATE INDEX IF NOT EXISTS facts_concept ON facts (concept_id, accession);
+CREATE INDEX IF NOT EXISTS submissions_cik ON submissions (cik, filing_date);
+CREATE INDEX IF NOT EXISTS submissions_batch ON submissions (batch);
+"""
+
+# context keys that have their own columns, anything else describes a dimension
+CONTEXT_KEYS = ('_contextref', 'entity_identifier', 'period_startdate', 'period_enddate', 'period_instant')
+
+
+def is_xbrl_document(doc):
+    """Same test datamule's Submission uses to find the instance document"""
+    return doc.get('type') in ('EX-100.INS', 'EX-101.INS') or doc.get('filename', '').endswith('_htm.xml')
+
+
+def numeric_value(value, attributes):
+    """The fact as a number, with scale and sign applied, or None for text facts"""
+    if value is None:
+        return None
+    try:
+        number = Decimal(str(value).replace(',', '').strip())
+    except InvalidOperation:
+        return None
+    if attributes.get('scale') not in (None, ''):
+        try:
+            number *= Decimal(10) ** int(attributes['scale'])
+        except ValueError:
+            pass
+    if attributes.get('sign') == '-':
+        number = -number
+    return float(number)
+
+
+def fact_rows(records):
+    """Turn secxbrl records into (concept, value, value_number, unit, period_start, period_end, instant,
+    context, dimensions, decimals) tuples"""
+    rows = []
+    for record in records or []:
+        attributes = record.get('_attributes') or {}
+        concept = attributes.get('name')
+        if not concept:
+            continue
+        context = record.get('_context') or {}
+        value = record.get('_val')
+
+        instant = context.get('period_instant')
+        dimensions = {key: value for key, value in context.items() if key not in CONTEXT_KEYS}
+        decimals = attributes.get('decimals')
+        try:
+            decimals = int(decimals)
+        except (TypeError, ValueError):
+            # INF or missing
+            decimals = None
+
+        rows.append((
+            concept,
+            value,
+            numeric_value(value, attributes),
+            attributes.get('unitRef') or attributes.get('unitref'),
+            None if instant else context.get('period_startdate'),
+            instant or context.get('period_enddate'),
+            1 if instant else 0,
+            context.get('_contextref'),
+            json.dumps(dimensions, sort_keys=True) if dimensions else None,
+            decimals,
+        ))
+    return rows
+
+
+def xbrl_batch(batch_path):
+    """Worker: parse the XBRL instance of every submission in one batch tar"""
+    from secxbrl import parse_inline_xbrl
+
+    submissions = []
+    seen = set()
+    for accession, doc_index, metadata, document in iter_batch_documents(batch_path, select=is_xbrl_document):
+        # datamule only reads the first instance document of a submission
+        if accession in seen:
+            continue
+        seen.add(accession)
+        _, filing_date, cik, _ = _submission_metadata(metadata)
+        try:
+            records = parse_inline_xbrl(content=document.content, file_type='extracted_inline')
+        except Exception as e:
+            print(f"Skipped: {accession}/{document.filename} due to {e}")
+            continue
+        submissions.append((accession, normalize_cik(cik) if cik else '', filing_date, fact_rows(records)))
+    return submissions
+
+
+def scratch_store_size(store):
+    """Rough in-memory footprint of a ScratchXBRLStore in bytes"""
+    return 64 * 1024 + 512 * store.fact_count
+
+
+class XBRLStore(SidecarStore):
+    """Per-portfolio store of XBRL facts"""
+    FILENAME = XBRL_FILENAME
+    SCHEMA = SCHEMA
+
+    def __init__(self, portfolio_path):
+        super().__init__(portfolio_path)
+        self._scratch_stores = LRUCache(SCRATCH_STORE_BYTES, scratch_store_size)
+
+    def _concept_ids(self, conn, names):
+        conn.executemany('INSERT OR IGNORE INTO concepts (name) VALUES (?)', [(name,) for name in set(names)])
+        ids = {}
+        for name in set(names):
+            ids[name] = conn.execute('SELECT id FROM concepts WHERE name = ?', (name,)).fetchone()[0]
+        return ids
+
+    def _write_submission(self, conn, accession, batch, cik, filing_date, rows):
+        conn.execute('DELETE FROM facts WHERE accession = ?', (accession,))
+        ids = self._concept_ids(conn, [row[0] for row in rows])
+        conn.executemany('INSERT INTO facts (accession, concept_id, value, value_number, unit, period_start, period_end, '
+                         'instant, context, dimensions, decimals) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         [(accession, ids[row[0]], *row[1:]) for row in rows])
+        conn.execute('INSERT OR REPLACE INTO submissions VALUES (?, ?, ?, ?, ?)', (accession, batch, cik, filing_date, len(rows)))
+
+    def has(self, accession):
+        if not self.exists():
+            return False
+        with self.connect() as conn:
+            return conn.execute('SELECT 1 FROM submissions WHERE accession = ?', (accession,)).fetchone() is not None
+
+    def ensure(self, submission):
+        """The store to read a submission's facts from, storing them first if they aren't stored yet. Parses the
+        XBRL only on first use.
+
+        Processes that only read the index files (secbrowser.serve's workers) get a scratch store holding just
+        this submission instead, kept in an LRU until a build_xbrl job stores them for good.
+        """
+        if self.has(submission.accession):
+            return self
+        if db.read_only:
+            store = self._scratch_stores.get(submission.accession)
+            if store is not None:
+                return store
+            store = ScratchXBRLStore(self.portfolio_path)
+        else:
+            store = self
+        metadata = submission.metadata.content
+        _, filing_date, cik, _ = _submission_metadata(metadata)
+        rows = fact_rows(submission.xbrl) if submission._xbrl_bool else []
+        with store.connect() as conn:
+            store._write_submission(conn, submission.accession, None, normalize_cik(cik) if cik else '', filing_date, rows)
+        if store is not self:
+            store.fact_count = len(rows)
+            self._scratch_stores.put(submission.accession, store)
+        return store
+
+    def drop_rows(self, conn, batch_path, build_key=None):
+        conn.execute('DELETE FROM facts WHERE accession IN (SELECT accession FROM submissions WHERE batch = ?)', (batch_path,))
+        conn.execute('DELETE FROM submissions WHERE batch = ?', (batch_path,))
+
+    def write_rows(self, conn, batch_path, submissions, build_key=None):
+        for accession, cik, filing_date, rows in submissions:
+            self._write_submission(conn, accession, batch_path, cik, filing_date, rows)
+
+    def build(self, workers=None, progress=print):
+        """Store the facts of every submission in new or changed batches. Returns the number of batches processed."""
+        return self.build_batches(xbrl_batch, workers=workers, progress=progress)
+
+    def facts(self, accession, concept=None, period=None, unit=None, limit=100, cursor=None):
+        """Return (facts, next_cursor, total) for one page of a submission's facts.
+
+        concept matches as a prefix (us-gaap:Rev), period matches the period end (or instant) date.
+        """
+        where = ['f.accession = ?']
+        params = [accession]
+        if concept:
+            where.append("c.name LIKE ? ESCAPE '\\'")
+            params.append(concept.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if period:
+            where.append('f.period_end = ?')
+            params.append(period)
+        if unit:
+            where.append('f.unit = ?')
+            params.append(unit)
+
+        query = ('SELECT f.id, c.name AS concept, f.value, f.value_number, f.unit, f.period_start, f.period_end, f.instant, '
+                 'f.context, f.dimensions, f.decimals FROM facts f JOIN concepts c ON c.id = f.concept_id '
+                 f'WHERE {" AND ".join(where)}')
+        with self.connect() as conn:
+            total = conn.execute(f'SELECT COUNT(*) FROM facts f JOIN concepts c ON c.id = f.concept_id WHERE {" AND ".join(where)}',
+                                 params).fetchone()[0]
+            if cursor is not None:
+                query += ' AND f.id > ?'
+                params.append(int(cursor))
+            rows = conn.execute(query + ' ORDER BY f.id LIMIT ?', (*params, limit + 1)).fetchall()
+
+        facts = [self._fact(row) for row in rows[:limit]]
+        next_cursor = facts[-1]['id'] if len(rows) > limit else None
+        return facts, next_cursor, total
+
+    def cik(self, accession):
+        with self.connect() as conn:
+            row = conn.execute('SELECT cik FROM submissions WHERE accession = ?', (accession,)).fetchone()
+        return row['cik'] if row else ''
+
+    def units(self, accession):
+        with self.connect() as conn:
+            return [row[0] for row in conn.execute('SELECT DISTINCT unit FROM facts WHERE accession = ? AND unit IS NOT NULL '
+                                                   'ORDER BY 1', (accession,))]
+
+    def concept_history(self, concept, cik=None, include_dimensions=False, limit=10000):
+        """Every stored value of a concept, optionally for one CIK, oldest period first"""
+        where = ['c.name = ?']
+        params = [concept]
+        if cik:
+            where.append('s.cik = ?')
+            params.append(normalize_cik(cik))
+        if not include_dimensions:
+            where.append('f.dimensions IS NULL')
+
+        with self.connect() as conn:
+            rows = conn.execute('SELECT f.id, c.name AS concept, f.value, f.value_number, f.unit, f.period_start, f.period_end, '
+                                'f.instant, f.context, f.dimensions, f.decimals, s.accession, s.cik, s.filing_date '
+                                'FROM concepts c JOIN facts f ON f.concept_id = c.id JOIN submissions s ON s.accession = f.accession '
+                                f'WHERE {" AND ".join(where)} ORDER BY f.period_end, s.filing_date LIMIT ?',
+                                (*params, limit)).fetchall()
+        return [self._fact(row) for row in rows]
+
+    def _fact(self, row):
+        fact = dict(row)
+        fact['instant'] = bool(fact['instant'])
+        if fact['dimensions']:
+            fact['dimensions'] = json.loads(fact['dimensions'])
+        return fact
+
+
+class ScratchXBRLStore(XBRLStore):
+    """An XBRLStore in a private in-memory database, for a process that can't write the portfolio's"""
+    def __init__(self, portfolio_path):
+        super().__init__(portfolio_path)
+        self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(SCHEMA)
+        self.fact_count = 0
+
+    def connect(self):
+        # the with block commits, it doesn't close
+        return self._conn
+
+    def exists(self):
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store the XBRL facts of every submission in a portfolio.')
+    parser.add_argument('portfolio')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    processed = XBRLStore(args.portfolio).build(args.workers)
+    print(f"Processed {processed} batches")
+
+
+if __name__ == '__main__':
+    main()
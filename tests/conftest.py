@@ -0,0 +1,44 @@
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+# read by secbrowser.server at import, so set before any test imports it. Nothing is written to the home directory
+# or the bundled portfolios.
+_scratch = tempfile.mkdtemp(prefix='secbrowser-tests-')
+os.environ.setdefault('SECBROWSER_RENDER_CACHE_DIR', os.path.join(_scratch, 'render_cache'))
+os.environ.setdefault('SECBROWSER_JOBS_DB', os.path.join(_scratch, 'jobs.db'))
+os.environ.setdefault('SECBROWSER_PREFETCH_WORKERS', '0')
+os.environ.setdefault('SECBROWSER_HEADLESS', '1')
+
+# the 10-K in test/batch_001_001.tar
+ACCESSION = '000104746904035975'
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_scratch, ignore_errors=True)
+
+
+@pytest.fixture
+def portfolio_path(tmp_path):
+    """A copy of one bundled batch tar, opened as the server's portfolio"""
+    from secbrowser import server
+
+    path = tmp_path / 'portfolio'
+    path.mkdir()
+    shutil.copy(REPO / 'test' / 'batch_001_001.tar', path)
+    server.open_portfolio(str(path))
+    return path
+
+
+@pytest.fixture
+def client(portfolio_path):
+    from secbrowser import server
+
+    return server.app.test_client()
@@ -0,0 +1,82 @@
+import pytest
+
+from secbrowser.batches import SidecarStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (path TEXT, kind TEXT, mtime REAL, size INTEGER, PRIMARY KEY (path, kind));
+CREATE TABLE IF NOT EXISTS rows (batch TEXT, kind TEXT, value TEXT);
+"""
+
+
+class Store(SidecarStore):
+    FILENAME = 'secbrowser_test.db'
+    SCHEMA = SCHEMA
+    BUILD_COLUMN = 'kind'
+
+    def drop_rows(self, conn, batch_path, build_key=None):
+        if build_key is None:
+            conn.execute('DELETE FROM rows WHERE batch = ?', (batch_path,))
+        else:
+            conn.execute('DELETE FROM rows WHERE batch = ? AND kind = ?', (batch_path, build_key))
+
+    def write_rows(self, conn, batch_path, rows, build_key=None):
+        conn.executemany('INSERT INTO rows VALUES (?, ?, ?)', [(batch_path, build_key, value) for value in rows])
+
+    def values(self):
+        with self.connect() as conn:
+            return sorted(tuple(row) for row in conn.execute('SELECT kind, value FROM rows'))
+
+
+def make_batch(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b'tar')
+    return str(path)
+
+
+def test_pending_batches_per_build_key(tmp_path):
+    store = Store(tmp_path)
+    batch = make_batch(tmp_path, 'batch_001.tar')
+    [(path, signature)] = store.pending_batches('a')
+
+    store.write_batch(path, signature, ['x'], 'a')
+
+    assert store.pending_batches('a') == []
+    assert store.pending_batches('b') == [(batch, signature)]
+
+
+def test_rewriting_a_batch_replaces_its_rows(tmp_path):
+    store = Store(tmp_path)
+    make_batch(tmp_path, 'batch_001.tar')
+    [(path, signature)] = store.pending_batches('a')
+
+    store.write_batch(path, signature, ['x'], 'a')
+    store.write_batch(path, signature, ['y'], 'b')
+    store.write_batch(path, signature, ['z'], 'a')
+
+    assert store.values() == [('a', 'z'), ('b', 'y')]
+
+
+def test_missing_batches_are_dropped(tmp_path):
+    store = Store(tmp_path)
+    kept, removed = make_batch(tmp_path, 'batch_001.tar'), make_batch(tmp_path, 'batch_002.tar')
+    for path, signature in store.pending_batches('a'):
+        store.write_batch(path, signature, [path], 'a')
+
+    (tmp_path / 'batch_002.tar').unlink()
+    store.drop_missing_batches()
+
+    assert store.values() == [('a', kept)]
+    with store.connect() as conn:
+        assert [row['path'] for row in conn.execute('SELECT path FROM processed')] == [kept]
+
+
+def test_a_store_missing_its_row_methods_fails_at_construction(tmp_path):
+    class Incomplete(SidecarStore):
+        FILENAME = 'secbrowser_test.db'
+        SCHEMA = SCHEMA
+
+        def write_rows(self, conn, batch_path, rows, build_key=None):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete(tmp_path)
@@ -0,0 +1,34 @@
+from secbrowser.cache import LRUCache
+
+
+def test_get_or_load_caches_loaded_value():
+    cache = LRUCache(100, len)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return 'abc'
+
+    assert cache.get_or_load('k', loader) == 'abc'
+    assert cache.get_or_load('k', loader) == 'abc'
+    assert len(calls) == 1
+
+
+def test_get_or_load_does_not_cache_none():
+    # sizeof would fail on None, and a missing value may turn up later
+    cache = LRUCache(100, lambda value: len(value.metadata))
+
+    assert cache.get_or_load('k', lambda: None) is None
+    assert 'k' not in cache
+    assert cache.current_bytes == 0
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(5, len)
+    cache.put('a', 'aa')
+    cache.put('b', 'bb')
+    cache.get('a')
+    cache.put('c', 'cc')
+
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
@@ -0,0 +1,33 @@
+import sys
+import tracemalloc
+
+from secbrowser import dictionaries
+
+
+def test_deep_sizeof_counts_contents():
+    words = {f'word{i}' for i in range(1000)}
+    assert dictionaries.deep_sizeof(words) >= sys.getsizeof(words) + sum(sys.getsizeof(w) for w in words)
+
+
+def test_deep_sizeof_counts_shared_objects_once():
+    words = {f'word{i}' for i in range(1000)}
+    assert dictionaries.deep_sizeof([words, words]) < 2 * dictionaries.deep_sizeof(words)
+
+
+def test_deep_sizeof_follows_attributes():
+    class Processor:
+        def __init__(self):
+            self.trie = {'a': {'b': {'_keyword_': 'ab'}}}
+
+    assert dictionaries.deep_sizeof(Processor()) > dictionaries.deep_sizeof(Processor().trie)
+
+
+def test_load_does_not_trace_allocations(monkeypatch):
+    monkeypatch.setattr(dictionaries, 'build_dictionary', lambda name: {'data': {'a', 'b'}, 'processor': None})
+    registry = dictionaries.DictionaryRegistry()
+
+    registry.get('npx_figis')
+
+    assert not tracemalloc.is_tracing()
+    assert registry.stats()['npx_figis']['loaded']
+    assert registry.stats()['npx_figis']['bytes'] > 0
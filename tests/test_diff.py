@@ -0,0 +1,83 @@
+from conftest import ACCESSION
+from secbrowser.diff import align, children_items, diff_rows, diff_text, tree_hashes
+
+
+def section(title, *texts, **subsections):
+    contents = {str(i): {'title': t, 'contents': {'text': body}} for i, (t, body) in enumerate(subsections.items())}
+    node = {'title': title, 'class': 'section', 'contents': contents}
+    if texts:
+        node['text'] = ' '.join(texts)
+    return node
+
+
+def tree(*sections):
+    return {'document': {str(i * 10): s for i, s in enumerate(sections)}}
+
+
+def diff(old, new):
+    """align's output for two trees' top level sections, by title"""
+    ops = []
+    old_items, new_items = children_items(old['document']), children_items(new['document'])
+    for op, old_run, new_run in align(old_items, new_items, tree_hashes(old), tree_hashes(new)):
+        if op == 'equal':
+            ops.append((op, [item[2]['title'] for item in old_run]))
+        else:
+            ops.append((op, old_run and old_run[2]['title'], new_run and new_run[2]['title']))
+    return ops
+
+
+def test_section_hashes_ignore_whitespace_and_position():
+    old = tree(section('Item 1', 'Apple   makes\nphones.'))
+    new = tree(section('Cover'), section('Item 1', 'Apple makes phones.'))
+    old_hashes, new_hashes = tree_hashes(old), tree_hashes(new)
+
+    assert old_hashes[id(old['document']['0'])] == new_hashes[id(new['document']['10'])]
+    assert new_hashes[id(new['document']['0'])] != new_hashes[id(new['document']['10'])]
+
+
+def test_unchanged_sections_are_matched_whole():
+    old = tree(section('Item 1', 'Business.'), section('Item 1A', 'Risks.'), section('Item 7', 'Results.'))
+    new = tree(section('Item 1', 'Business.'), section('Item 1A', 'New risks.'), section('Item 2', 'Properties.'),
+               section('Item 7', 'Results.'))
+
+    assert diff(old, new) == [
+        ('equal', ['Item 1']),
+        ('changed', 'Item 1A', 'Item 1A'),
+        ('inserted', None, 'Item 2'),
+        ('equal', ['Item 7']),
+    ]
+
+
+def test_sections_that_lost_their_counterpart_are_deleted():
+    old = tree(section('Item 1', 'Business.'), section('Item 9B', 'Other.'))
+    new = tree(section('Item 1', 'Business.'))
+    assert diff(old, new) == [('equal', ['Item 1']), ('deleted', 'Item 9B', None)]
+
+
+def test_diff_text_by_word_ignores_whitespace():
+    assert diff_text('Net  sales rose.', 'Net sales rose.') == [('equal', 'Net sales rose.')]
+    segments = diff_text('Net sales rose 5%.', 'Net sales fell 5%.')
+    assert ''.join(text for op, text in segments if op != 'insert') == 'Net sales rose 5%.'
+    assert ''.join(text for op, text in segments if op != 'delete') == 'Net sales fell 5%.'
+    assert ('delete', 'rose ') in segments and ('insert', 'fell ') in segments
+
+
+def test_diff_text_by_sentence_then_word():
+    old = 'Revenue grew. Margins were flat. Headcount rose.'
+    new = 'Revenue grew. Margins were lower. Headcount rose.'
+    segments = diff_text(old, new, by_sentence=True)
+    assert [op for op, _ in segments] == ['equal', 'delete', 'insert', 'equal']
+    assert ('delete', 'flat. ') in segments
+
+
+def test_diff_rows():
+    old = [['Sales', '1'], ['Costs', '2'], ['Tax', '3']]
+    new = [['Sales', '1'], ['Costs', '4'], ['Tax', '3'], ['Net', '5']]
+    assert [op for op, _, _ in diff_rows(old, new)] == ['equal', 'changed', 'equal', 'inserted']
+
+
+def test_diff_view_of_a_document_against_itself(client):
+    response = client.get(f'/document/diff?accession={ACCESSION}&index=0&against={ACCESSION}&against_index=0')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert '<strong>0</strong> changed, <strong>0</strong> added, <strong>0</strong> removed' in body
@@ -0,0 +1,50 @@
+import re
+
+from secbrowser.highlight import bucket_by_fragment, highlight_text, resolve_spans
+
+
+def match(start, end, type='persons', color='red'):
+    return {'start': start, 'end': end, 'type': type, 'color': color}
+
+
+def spans(text, matches):
+    return [(start, end) for start, end, _ in resolve_spans(matches, len(text))]
+
+
+def plain(html):
+    return re.sub(r'<[^>]+>', '', html)
+
+
+def test_nested_matches_become_nested_spans():
+    text = 'Apple Inc. Board'
+    html = highlight_text(text, [match(0, 5, 'tickers'), match(0, 10)])
+
+    assert spans(text, [match(0, 5, 'tickers'), match(0, 10)]) == [(0, 10), (0, 5)]
+    assert html.count('<span') == html.count('</span>') == 2
+    assert html.index('title="persons: Apple Inc."') < html.index('title="tickers: Apple"')
+    assert plain(html) == text
+
+
+def test_overlapping_match_is_split_at_the_enclosing_end():
+    text = 'abcdefghij'
+    assert spans(text, [match(0, 6), match(4, 9, 'cusips')]) == [(0, 6), (4, 6), (6, 9)]
+
+    html = highlight_text(text, [match(0, 6), match(4, 9, 'cusips')])
+    assert plain(html) == text
+    assert html.count('<span') == html.count('</span>') == 3
+
+
+def test_duplicates_are_dropped_but_other_types_kept():
+    text = 'abcdefghij'
+    assert spans(text, [match(2, 5), match(2, 5), match(2, 5, 'tickers')]) == [(2, 5), (2, 5)]
+    assert highlight_text(text, [match(2, 5), match(2, 5)]).count('<span') == 1
+
+
+def test_matches_are_clipped_to_the_text():
+    assert spans('abc', [match(-2, 2), match(2, 10), match(5, 8)]) == [(0, 2), (2, 3)]
+    assert highlight_text('abc', []) == 'abc'
+
+
+def test_bucket_by_fragment_compares_ids_as_strings():
+    buckets = bucket_by_fragment([{'fragment_id': 3}, {'fragment_id': '3'}, {'fragment_id': None}, {}])
+    assert list(buckets) == ['3'] and len(buckets['3']) == 2
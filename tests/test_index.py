@@ -0,0 +1,41 @@
+import shutil
+
+import pytest
+
+from conftest import ACCESSION, REPO
+from secbrowser import db
+from secbrowser.index import PortfolioIndex
+
+
+@pytest.fixture
+def read_only():
+    db.read_only = True
+    yield
+    db.read_only = False
+
+
+def test_refresh_indexes_new_batches(tmp_path):
+    shutil.copy(REPO / 'test' / 'batch_001_001.tar', tmp_path)
+    index = PortfolioIndex(tmp_path)
+
+    assert index.refresh() == 1
+    assert index.lookup(ACCESSION)['batch'] == str(tmp_path / 'batch_001_001.tar')
+    assert [row['accession'] for row in index.batch_submissions(str(tmp_path / 'batch_001_001.tar'))] == [ACCESSION]
+
+
+def test_readers_only_follow_the_owner(tmp_path, read_only):
+    db.read_only = False
+    owner = PortfolioIndex(tmp_path)
+    db.read_only = True
+    reader = PortfolioIndex(tmp_path)
+    shutil.copy(REPO / 'test' / 'batch_001_001.tar', tmp_path)
+
+    assert reader.refresh() == 0
+    assert reader.indexed_since(0) == []
+
+    db.read_only = False
+    owner.refresh()
+    db.read_only = True
+    assert [path for path, _ in reader.indexed_since(0)] == [str(tmp_path / 'batch_001_001.tar')]
+    assert reader.indexed_since(reader.last_indexed()) == []
+    assert reader.lookup(ACCESSION) is not None
@@ -0,0 +1,97 @@
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import time
+
+from secbrowser import jobs
+
+
+def sleep_forever():
+    time.sleep(60)
+
+
+def job_with_pool(pid_file):
+    """Stands in for an indexer job: a job process that started a worker of its own"""
+    signal.signal(signal.SIGTERM, jobs.terminate_children)
+    worker = multiprocessing.get_context('spawn').Process(target=sleep_forever)
+    worker.start()
+    with open(pid_file, 'w') as f:
+        f.write(str(worker.pid))
+    time.sleep(60)
+
+
+def test_terminating_a_job_ends_its_workers(tmp_path):
+    pid_file = tmp_path / 'worker.pid'
+    process = multiprocessing.get_context('spawn').Process(target=job_with_pool, args=(str(pid_file),))
+    process.start()
+
+    deadline = time.monotonic() + 30
+    while not pid_file.exists() or not pid_file.read_text():
+        assert time.monotonic() < deadline, 'job never started its worker'
+        time.sleep(0.05)
+    worker_pid = int(pid_file.read_text())
+
+    process.terminate()
+    process.join(30)
+
+    assert process.exitcode == 128 + signal.SIGTERM
+    try:
+        os.kill(worker_pid, 0)
+    except ProcessLookupError:
+        pass
+    else:
+        raise AssertionError('the job\'s worker outlived it')
+
+
+def test_recover_jobs(tmp_path):
+    db_path = tmp_path / 'jobs.db'
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(jobs.SCHEMA)
+        for job_id, status, created in (('a', 'running', 1), ('b', 'queued', 3), ('c', 'queued', 2), ('d', 'done', 0)):
+            conn.execute('INSERT INTO jobs (id, kind, params, status, created) VALUES (?, ?, ?, ?, ?)',
+                         (job_id, 'compress', json.dumps({'path': str(tmp_path)}), status, created))
+
+    assert jobs.recover_jobs(db_path) == ['c', 'b']
+    with sqlite3.connect(db_path) as conn:
+        statuses = dict(conn.execute('SELECT id, status FROM jobs'))
+    assert statuses == {'a': 'interrupted', 'b': 'queued', 'c': 'queued', 'd': 'done'}
+
+
+def manager_holding_jobs(tmp_path, monkeypatch, finished):
+    """A manager whose scheduled jobs wait until the test runs them"""
+    manager = jobs.JobManager(tmp_path / 'jobs.db', poll_interval=0.05, on_finish=finished.append, recover=False)
+    scheduled = []
+    monkeypatch.setattr(manager._executor, 'submit', lambda fn, *args: scheduled.append((fn, args)))
+    return manager, scheduled
+
+
+def test_cancelling_a_queued_job_finishes_it(tmp_path, monkeypatch):
+    finished = []
+    manager, scheduled = manager_holding_jobs(tmp_path, monkeypatch, finished)
+    job_id = manager.submit('compress', path=str(tmp_path))
+
+    assert manager.cancel(job_id)
+    for fn, args in scheduled:
+        fn(*args)
+
+    assert [(job['id'], job['status']) for job in finished] == [(job_id, 'cancelled')]
+    assert manager._cancel_events == {}
+
+
+def test_a_supervisor_error_fails_the_job(tmp_path, monkeypatch):
+    finished = []
+    manager, scheduled = manager_holding_jobs(tmp_path, monkeypatch, finished)
+    job_id = manager.submit('compress', path=str(tmp_path))
+
+    def no_processes(*args, **kwargs):
+        raise OSError('no processes left')
+    monkeypatch.setattr(manager._context, 'Process', no_processes)
+    for fn, args in scheduled:
+        fn(*args)
+
+    job = manager.get(job_id)
+    assert (job['status'], job['error']) == ('failed', 'no processes left')
+    assert [job['id'] for job in finished] == [job_id]
+    assert manager._cancel_events == {}
@@ -0,0 +1,59 @@
+import gzip
+import json
+
+import pytest
+
+from conftest import ACCESSION
+from secbrowser import json_stream
+from secbrowser.json_stream import iter_json, select_path
+
+DATA = f'/document/data?accession={ACCESSION}&index=0'
+
+TREE = {'document': {-1: {'title': 'Cover'}, 25: {'title': 'Item 1', 'contents': [{'text': 'a'}, {'text': 'b'}]}},
+        'metadata': {'parser': 'doc2dict'}}
+
+
+def test_select_path():
+    assert select_path(TREE, '') is TREE
+    assert select_path(TREE, 'metadata.parser') == 'doc2dict'
+    # integer section ids and list indexes, negative ones included
+    assert select_path(TREE, 'document.-1.title') == 'Cover'
+    assert select_path(TREE, 'document.25.contents.1.text') == 'b'
+    assert select_path(TREE, 'document.25.contents.-2') == {'text': 'a'}
+
+    for path in ('document.26', 'document.25.contents.2', 'metadata.parser.x', 'document.25.contents.first'):
+        with pytest.raises(KeyError):
+            select_path(TREE, path)
+
+
+def test_iter_json_matches_the_stdlib_encoder(monkeypatch):
+    expected = json.loads(json.dumps(TREE))
+    assert json.loads(b''.join(iter_json(TREE))) == expected
+
+    # small chunks and the stdlib backend give the same document
+    monkeypatch.setattr(json_stream, 'CHUNK_SIZE', 8)
+    monkeypatch.setattr(json_stream, 'orjson', None)
+    chunks = list(iter_json(TREE))
+    assert len(chunks) > 1
+    assert json.loads(b''.join(chunks)) == expected
+    assert json.loads(b''.join(iter_json({'big': 2 ** 70, 'empty': [], 'none': None}))) == {'big': 2 ** 70, 'empty': [], 'none': None}
+
+
+def test_data_view_selects_a_path(client):
+    document = json.loads(client.get(DATA).data)['document']
+    section = next(key for key in document if key != '-1')
+
+    response = client.get(f'{DATA}&path=document.{section}.title')
+    assert response.status_code == 200
+    assert response.get_json() == document[section]['title']
+
+    response = client.get(f'{DATA}&path=document.no-such-section')
+    assert response.status_code == 404
+    assert response.get_json() == {'error': 'No such path: document.no-such-section'}
+
+
+def test_data_view_compresses(client):
+    plain = client.get(DATA).data
+    response = client.get(DATA, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain
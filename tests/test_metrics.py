@@ -0,0 +1,40 @@
+import re
+
+from conftest import ACCESSION
+
+
+def sample(body, name, **labels):
+    """The value of one sample in a Prometheus text exposition, or None"""
+    for line in body.splitlines():
+        match = re.fullmatch(rf'{name}\{{(.*)\}} (\S+)', line)
+        if match and all(f'{key}="{value}"' in match.group(1).split(',') for key, value in labels.items()):
+            return float(match.group(2))
+    return None
+
+
+def test_metrics_expose_route_timings(client):
+    before = client.get('/metrics').get_data(as_text=True)
+    count = sample(before, 'secbrowser_request_duration_seconds_count', route='/document/text', status='200') or 0
+
+    response = client.get(f'/document/text?accession={ACCESSION}&index=0')
+    assert response.status_code == 200
+    response.close()
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert body.count('# TYPE secbrowser_request_duration_seconds histogram') == 1
+    assert sample(body, 'secbrowser_request_duration_seconds_count', route='/document/text', method='GET', status='200') == count + 1
+    assert sample(body, 'secbrowser_request_duration_seconds_sum', route='/document/text', method='GET', status='200') > 0
+    # the phases inside the view are timed too
+    assert sample(body, 'secbrowser_phase_duration_seconds_count', phase='load_document') >= 1
+    assert sample(body, 'secbrowser_cache_lookups_total', cache='document', result='hit') is not None
+
+
+def test_server_timing_header(client):
+    from secbrowser import server
+
+    server.app.config['SECBROWSER_SERVER_TIMING'] = True
+    try:
+        response = client.get(f'/document/text?accession={ACCESSION}&index=0')
+    finally:
+        server.app.config['SECBROWSER_SERVER_TIMING'] = False
+    assert 'total;dur=' in response.headers['Server-Timing']
@@ -0,0 +1,79 @@
+import threading
+
+from conftest import ACCESSION
+from secbrowser.prefetch import Prefetcher, prefetch_order
+
+
+def doc(sequence, type='EX-99', filename=None, size=1000):
+    return {'sequence': str(sequence), 'type': type, 'filename': filename or f'd{sequence}.htm', 'secsgml_size_bytes': size}
+
+
+def test_prefetch_order_puts_the_main_document_first():
+    documents = [doc(1, 'EX-21'), doc(2, 'GRAPHIC', 'logo.jpg'), doc(3, '10-K'), doc(4), doc(5, 'EX-99', 'x.pdf')]
+    assert prefetch_order(documents, '10-K', 10, 10 ** 9) == [2, 0, 3]
+
+
+def test_prefetch_order_stops_at_the_limits():
+    documents = [doc(i, size=1000) for i in range(1, 6)]
+    assert prefetch_order(documents, '10-K', 2, 10 ** 9) == [0, 1]
+    # estimated parsed size is three times the raw size
+    assert prefetch_order(documents, '10-K', 10, 7000) == [0, 1]
+    # the first document is prefetched whatever its size
+    assert prefetch_order(documents, '10-K', 10, 10) == [0]
+
+
+def blocking_task(started, release, done, key):
+    def task():
+        started.set()
+        release.wait(10)
+        done.append(key)
+    return key, task
+
+
+def test_starting_another_batch_drops_the_queued_tasks():
+    prefetcher = Prefetcher(1)
+    started, release, done = threading.Event(), threading.Event(), []
+    prefetcher.start('a', [blocking_task(started, release, done, 'a0'), ('a1', lambda: done.append('a1'))])
+    assert started.wait(10)
+
+    b_ran = threading.Event()
+    prefetcher.start('b', [('b0', b_ran.set)])
+    release.set()
+    assert b_ran.wait(10)
+    # a0 was already running, so it finished, a1 never ran
+    assert done == ['a0']
+
+
+def test_wait_joins_a_running_task_and_takes_a_queued_one():
+    prefetcher = Prefetcher(1)
+    started, release, done = threading.Event(), threading.Event(), []
+    prefetcher.start('a', [blocking_task(started, release, done, 'a0'), ('a1', lambda: done.append('a1'))])
+    assert started.wait(10)
+
+    # the request thread loads a1 itself
+    prefetcher.wait('a1')
+    threading.Timer(0.05, release.set).start()
+    prefetcher.wait('a0')
+    assert done == ['a0']
+    assert prefetcher.status() == {'name': 'a', 'queued': 0, 'running': 0, 'done': 1}
+
+
+def test_no_workers_prefetches_nothing():
+    done = []
+    prefetcher = Prefetcher(0)
+    prefetcher.start('a', [('a0', lambda: done.append('a0'))])
+    prefetcher.wait('a0')
+    assert done == [] and prefetcher.status()['name'] is None
+
+
+def test_submission_page_prefetches_its_documents(client, monkeypatch):
+    from secbrowser import server
+
+    prefetcher = Prefetcher(1)
+    monkeypatch.setattr(server, 'prefetcher', prefetcher)
+    assert client.get(f'/submission/{ACCESSION}').status_code == 200
+
+    key = (server.cache['portfolio_path'], ACCESSION, 0)
+    prefetcher.wait(key)
+    document = server.document_cache.get(key)
+    assert document is not None and document._data is not None
@@ -0,0 +1,50 @@
+from flask import Flask, Response
+
+from secbrowser.profiling import install
+
+TOKEN = 'secret-token'
+
+
+def profiled_app(directory):
+    app = Flask(__name__)
+
+    @app.route('/page')
+    def page():
+        return Response((f'<p>{i}</p>' for i in range(3)), mimetype='text/html')
+
+    install(app, TOKEN, directory)
+    return app.test_client()
+
+
+def test_profiling_rejects_a_missing_or_wrong_token(tmp_path):
+    client = profiled_app(tmp_path / 'profiles')
+
+    assert client.get('/page?_profile=cprofile').status_code == 403
+    assert client.get('/page?_profile=cprofile&_profile_token=guess').status_code == 403
+    assert client.get('/page', headers={'X-Secbrowser-Profile': 'sample',
+                                        'X-Secbrowser-Profile-Token': 'secret'}).status_code == 403
+    assert client.get('/api/profiles').status_code == 403
+    assert client.get('/api/profiles?_profile_token=guess').status_code == 403
+    assert not (tmp_path / 'profiles').exists()
+
+
+def test_requests_without_a_profile_mode_pass_through(tmp_path):
+    client = profiled_app(tmp_path / 'profiles')
+    response = client.get('/page')
+    assert response.data == b'<p>0</p><p>1</p><p>2</p>'
+    assert 'X-Profile-Id' not in response.headers
+
+
+def test_profiled_request_is_stored(tmp_path):
+    client = profiled_app(tmp_path / 'profiles')
+
+    assert client.get(f'/page?_profile=flame&_profile_token={TOKEN}').status_code == 400
+
+    response = client.get('/page', headers={'X-Secbrowser-Profile': 'cprofile', 'X-Secbrowser-Profile-Token': TOKEN})
+    assert response.data == b'<p>0</p><p>1</p><p>2</p>'
+    profile_id = response.headers['X-Profile-Id']
+    response.close()
+
+    listing = client.get('/api/profiles', headers={'X-Secbrowser-Profile-Token': TOKEN}).get_json()
+    assert listing == [{'id': profile_id, 'files': [f'{profile_id}.prof', f'{profile_id}.txt']}]
+    assert client.get(f'/api/profiles/{profile_id}.txt?_profile_token={TOKEN}').status_code == 200
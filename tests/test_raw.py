@@ -0,0 +1,65 @@
+import gzip
+
+from conftest import ACCESSION
+
+CONTENT = f'/document/content?accession={ACCESSION}&index=0'
+
+
+def full_content(client):
+    response = client.get(CONTENT)
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert int(response.headers['Content-Length']) == len(response.data)
+    return response
+
+
+def test_content_is_the_raw_document(client):
+    from secbrowser import server
+
+    response = full_content(client)
+    assert response.data == server.get_document(ACCESSION, 0).content
+    assert response.mimetype == 'text/plain'
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
+
+
+def test_range_request(client):
+    content = full_content(client).data
+
+    response = client.get(CONTENT, headers={'Range': 'bytes=100-199', 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(content)}'
+    # ranges are into the raw bytes, so never compressed
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == content[100:200]
+
+    response = client.get(CONTENT, headers={'Range': 'bytes=-50'})
+    assert response.data == content[-50:]
+
+    response = client.get(CONTENT, headers={'Range': f'bytes={len(content) + 10}-'})
+    assert response.status_code == 416
+
+
+def test_etag_revalidation(client):
+    etag = full_content(client).headers['ETag']
+
+    response = client.get(CONTENT, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_gzip_when_accepted(client):
+    content = full_content(client).data
+
+    response = client.get(CONTENT, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == content
+    # a compressed body is a different representation, with its own validator
+    assert response.headers['ETag'] != full_content(client).headers['ETag']
+
+
+def test_open_sends_the_document_type(client):
+    response = client.get(f'/document/open?accession={ACCESSION}&index=0')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/html'
+    assert response.data == full_content(client).data
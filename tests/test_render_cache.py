@@ -0,0 +1,63 @@
+from secbrowser import render_cache
+from secbrowser.render_cache import RenderCache, render_key
+
+
+class Document:
+    content = b'<html>10-K</html>'
+
+
+def test_render_key_depends_on_content_kind_and_options():
+    document = Document()
+    key = render_key(document, 'visualize', {'tags': ['persons', 'cusips']})
+
+    assert key == render_key(document, 'visualize', {'tags': ['cusips', 'persons']})
+    assert key != render_key(document, 'tables', {'tags': ['persons', 'cusips']})
+    assert key != render_key(document, 'visualize', {})
+
+
+def test_render_key_changes_with_render_version(monkeypatch):
+    # pages cached on disk by an older install must not be served by a newer one
+    document = Document()
+    key = render_key(document, 'visualize', {})
+    monkeypatch.setattr(render_cache, 'render_version', lambda: 'another-version')
+
+    assert render_key(document, 'visualize', {}) != key
+
+
+def test_tee_publishes_only_complete_renders(tmp_path):
+    cache = RenderCache(memory_bytes=1024, disk_dir=tmp_path, disk_bytes=1024 * 1024)
+
+    assert b''.join(c.encode() for c in cache.tee('ab' * 8, ['<p>', 'page</p>'])) == b'<p>page</p>'
+    assert cache.get('ab' * 8) == b'<p>page</p>'
+
+    partial = cache.tee('cd' * 8, ['<p>', 'page</p>'])
+    next(partial)
+    partial.close()
+    assert cache.get('cd' * 8) is None
+
+
+def test_tee_fills_the_memory_tier(tmp_path):
+    cache = RenderCache(memory_bytes=1024, disk_dir=tmp_path, disk_bytes=1024 * 1024)
+    list(cache.tee('ab' * 8, ['<p>', 'page</p>']))
+    (tmp_path / 'ab' / f"{'ab' * 8}.html").unlink()
+
+    assert cache.get('ab' * 8) == b'<p>page</p>'
+
+    # pages bigger than the memory tier are only on disk
+    list(cache.tee('cd' * 8, ['x' * 1000, 'x' * 1000]))
+    assert 'cd' * 8 not in cache.memory
+    assert cache.get('cd' * 8) == b'x' * 2000
+
+
+def test_server_creates_the_render_cache_on_first_use(tmp_path, monkeypatch):
+    from secbrowser import server
+
+    monkeypatch.setenv('SECBROWSER_RENDER_CACHE_DIR', str(tmp_path / 'render_cache'))
+    # put back whatever the app had once the test is over
+    monkeypatch.setitem(server.app.extensions, 'render_cache', None)
+    del server.app.extensions['render_cache']
+    assert not (tmp_path / 'render_cache').exists()
+
+    render_cache = server.get_render_cache()
+    assert render_cache.disk_dir == tmp_path / 'render_cache' and render_cache.disk_dir.is_dir()
+    assert server.get_render_cache() is render_cache
@@ -0,0 +1,78 @@
+import zlib
+
+from secbrowser.search import SearchIndex, encode_positions, index_document, parse_query
+
+
+def indexed(accession, text, doc_index=0):
+    """A document as index_batch returns it"""
+    length, positions = index_document(text)
+    postings = [(term, len(term_positions), encode_positions(term_positions)) for term, term_positions in positions.items()]
+    return accession, doc_index, '10-K', '2024-01-01', length, zlib.compress(text.encode('utf-8')), postings
+
+
+def write_batch(index, tmp_path, name, documents, content=b'tar'):
+    path = tmp_path / name
+    path.write_bytes(content)
+    [(batch_path, signature)] = [item for item in index.pending_batches() if item[0] == str(path)]
+    index.write_batch(batch_path, signature, documents)
+
+
+def accessions(results):
+    return [result['accession'] for result in results]
+
+
+def test_bm25_ranks_frequent_terms_in_short_documents_first(tmp_path):
+    index = SearchIndex(tmp_path)
+    write_batch(index, tmp_path, 'batch_001.tar', [
+        indexed('once', 'revenue grew this year while costs were flat and margins held ' * 3),
+        indexed('often', 'revenue revenue revenue grew'),
+        indexed('never', 'costs were flat'),
+    ])
+
+    results, total = index.search('revenue')
+
+    assert total == 2
+    assert accessions(results) == ['often', 'once']
+    assert results[0]['score'] > results[1]['score']
+    assert '<mark>revenue</mark>' in results[0]['snippet']
+
+
+def test_phrase_queries_need_consecutive_terms(tmp_path):
+    index = SearchIndex(tmp_path)
+    write_batch(index, tmp_path, 'batch_001.tar', [
+        indexed('phrase', 'the company reported net income of ten dollars'),
+        indexed('apart', 'income was not net of taxes'),
+    ])
+
+    assert accessions(index.search('"net income"')[0]) == ['phrase']
+    assert sorted(accessions(index.search('net income')[0])) == ['apart', 'phrase']
+    # a bare word that tokenizes into several terms is a phrase too
+    assert parse_query('10-K "net income" tax') == [['10', 'k'], ['net', 'income'], ['tax']]
+
+
+def test_a_changed_batch_is_reindexed_and_the_others_kept(tmp_path):
+    index = SearchIndex(tmp_path)
+    write_batch(index, tmp_path, 'batch_001.tar', [indexed('kept', 'lithium supply')])
+    write_batch(index, tmp_path, 'batch_002.tar', [indexed('old', 'cobalt supply')])
+    assert index.pending_batches() == []
+
+    # a download rewrote the second batch
+    (tmp_path / 'batch_002.tar').write_bytes(b'a larger tar')
+    assert [path for path, _ in index.pending_batches()] == [str(tmp_path / 'batch_002.tar')]
+    write_batch(index, tmp_path, 'batch_002.tar', [indexed('new', 'nickel supply')], content=b'a larger tar')
+
+    assert index.search('cobalt') == ([], 0)
+    assert accessions(index.search('nickel')[0]) == ['new']
+    assert sorted(accessions(index.search('supply')[0])) == ['kept', 'new']
+
+
+def test_removed_batches_are_forgotten(tmp_path):
+    index = SearchIndex(tmp_path)
+    write_batch(index, tmp_path, 'batch_001.tar', [indexed('gone', 'graphite')])
+    index.search('graphite')
+
+    (tmp_path / 'batch_001.tar').unlink()
+    index.drop_missing_batches()
+
+    # the cached postings belong to the previous generation
+    assert index.search('graphite') == ([], 0)
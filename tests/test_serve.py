@@ -0,0 +1,32 @@
+import socket
+import threading
+
+from secbrowser.serve import PooledWSGIServer
+
+
+def test_connections_past_the_backlog_get_503():
+    release = threading.Event()
+
+    def app(environ, start_response):
+        release.wait(10)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    httpd = PooledWSGIServer('127.0.0.1', 0, app, threads=1, backlog=0)
+    busy_client, busy = socket.socketpair()
+    turned_away_client, turned_away = socket.socketpair()
+    try:
+        busy_client.sendall(b'GET / HTTP/1.0\r\n\r\n')
+        httpd.process_request(busy, ('127.0.0.1', 0))
+        httpd.process_request(turned_away, ('127.0.0.1', 0))
+
+        assert turned_away_client.recv(1024).startswith(b'HTTP/1.1 503')
+
+        release.set()
+        assert b'200 OK' in busy_client.recv(1024)
+    finally:
+        release.set()
+        httpd.drain()
+        httpd.server_close()
+        for sock in (busy_client, turned_away_client):
+            sock.close()
@@ -0,0 +1,105 @@
+from conftest import ACCESSION
+
+
+def test_submission_page(client):
+    response = client.get(f'/submission/{ACCESSION}')
+    assert response.status_code == 200
+    assert ACCESSION.encode() in response.data
+
+
+def test_unknown_accession_is_404(client):
+    assert client.get('/submission/000000000000000000').status_code == 404
+    assert client.get('/document/0?accession=000000000000000000').status_code == 404
+    assert client.get('/document/content?accession=000000000000000000&index=0').status_code == 404
+
+
+def test_diff_against_unknown_accession_is_404(client):
+    response = client.get(f'/document/diff?accession={ACCESSION}&index=0&against=000000000000000000')
+    assert response.status_code == 404
+    assert b'No submission 000000000000000000' in response.data
+
+
+def test_xbrl_is_not_written_by_read_only_workers(client, portfolio_path):
+    from secbrowser import db, server
+    from secbrowser.xbrl_store import ScratchXBRLStore
+
+    submission = server.get_portfolio_index().load_submission(server.get_portfolio(), ACCESSION)
+    db.read_only = True
+    try:
+        store = server.get_xbrl_store().ensure(submission)
+        # reopening the filing reads the same scratch store rather than parsing the XBRL again
+        assert server.get_xbrl_store().ensure(submission) is store
+    finally:
+        db.read_only = False
+
+    assert isinstance(store, ScratchXBRLStore)
+    assert store.has(ACCESSION)
+    assert not server.get_xbrl_store().has(ACCESSION)
+
+
+def test_fixed_portfolio_is_not_switched(client, portfolio_path, tmp_path):
+    from secbrowser import server
+
+    server.app.config['SECBROWSER_FIXED_PORTFOLIO'] = True
+    try:
+        response = client.post('/api/portfolio', data={'path': str(tmp_path)})
+    finally:
+        server.app.config['SECBROWSER_FIXED_PORTFOLIO'] = False
+
+    assert response.status_code == 409
+    assert client.get('/api/portfolio').get_json()['path'] == str(portfolio_path)
+
+
+def test_portfolio_page_indexes_before_rendering(client):
+    response = client.get('/portfolio')
+    assert response.status_code == 200
+    assert ACCESSION.encode() in response.data
+
+
+def test_portfolio_events_long_poll(client, portfolio_path, monkeypatch):
+    from secbrowser import server
+
+    monkeypatch.setattr(server, 'PORTFOLIO_WAIT_SECONDS', 0)
+    first = client.get('/api/portfolio/events?since=0').get_json()
+    assert first['total'] == 1
+    assert [batch['batch'] for batch in first['batches']] == ['batch_001_001.tar']
+    assert first['batches'][0]['submissions'][0]['accession'] == ACCESSION
+
+    again = client.get(f"/api/portfolio/events?since={first['since']}").get_json()
+    assert again == {'since': first['since'], 'total': 1, 'batches': []}
+
+
+def test_search_routes_ignore_malformed_numbers(client):
+    assert client.get('/search?q=revenue&page=two').status_code == 200
+    response = client.get('/api/search?q=revenue&limit=many&offset=-')
+    assert response.status_code == 200
+    assert response.get_json() == {'results': [], 'total': 0}
+
+
+def test_entities_api_ignores_a_malformed_limit(client):
+    response = client.get('/api/entities/cusips/037833100?limit=all')
+    assert response.status_code == 200
+    assert response.get_json()['documents'] == []
+
+
+def test_jobs_api_ignores_a_malformed_limit(client):
+    response = client.get('/api/jobs?limit=all')
+    assert response.status_code == 200
+    assert isinstance(response.get_json(), list)
+
+
+def test_views_without_an_open_submission_redirect(monkeypatch):
+    from secbrowser import server
+
+    monkeypatch.setattr(server, 'cache', {})
+    client = server.app.test_client()
+    for url in ('/document/0', '/document/text', '/document/tables', '/xbrl', '/fundamentals'):
+        response = client.get(url)
+        assert response.status_code == 302, url
+    assert client.get('/api/xbrl').status_code == 404
+    assert client.get(f'/document/0?accession={ACCESSION}').status_code == 404
+
+
+def test_unknown_document_index_is_404(client):
+    assert client.get(f'/document/999?accession={ACCESSION}').status_code == 404
+    assert client.get(f'/document/text?accession={ACCESSION}&index=first').status_code == 404
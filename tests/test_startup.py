@@ -0,0 +1,16 @@
+import statistics
+import sys
+
+from conftest import REPO
+
+sys.path.insert(0, str(REPO / 'benchmarks'))
+from bench_startup import BUDGET_MS, probe
+
+
+def test_server_imports_within_budget_and_defers_heavy_modules():
+    # the first import compiles bytecode
+    probe()
+    results = [probe() for _ in range(3)]
+
+    assert sorted({name for result in results for name in result['loaded']}) == []
+    assert statistics.median(result['seconds'] * 1000 for result in results) <= BUDGET_MS
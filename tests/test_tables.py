@@ -0,0 +1,60 @@
+import csv
+import io
+import json
+
+from conftest import ACCESSION
+from secbrowser.tables import iter_table_rows, stream_ndjson, table_row_count
+
+# the 10-K's fourth table has 26 rows under its header
+DOCUMENT = f'accession={ACCESSION}&index=0'
+
+
+class Table:
+    name = 'holdings'
+
+    def __init__(self, data):
+        self.data = data
+
+
+def test_table_rows_page_through_the_table(client):
+    pages = []
+    offset = 0
+    while offset is not None:
+        page = client.get(f'/api/document/tables/3?{DOCUMENT}&offset={offset}&limit=10').get_json()
+        pages.append(page)
+        offset = page['next_offset']
+
+    assert [len(page['rows']) for page in pages] == [10, 10, 6]
+    assert {page['total'] for page in pages} == {26}
+    assert all(len(row) == len(pages[0]['columns']) for page in pages for row in page['rows'])
+
+
+def test_unknown_table_is_404(client):
+    assert client.get(f'/api/document/tables/999?{DOCUMENT}').status_code == 404
+    assert client.get(f'/document/tables/999.csv?{DOCUMENT}').status_code == 404
+
+
+def test_table_exports_match_the_rows_api(client):
+    page = client.get(f'/api/document/tables/3?{DOCUMENT}&limit=1000').get_json()
+
+    response = client.get(f'/document/tables/3.csv?{DOCUMENT}')
+    assert response.mimetype == 'text/csv'
+    assert f'{ACCESSION}_0_table3.csv' in response.headers['Content-Disposition']
+    header, *rows = csv.reader(io.StringIO(response.get_data(as_text=True)))
+    assert header == page['columns']
+    assert rows == [['' if value is None else str(value) for value in row] for row in page['rows']]
+
+    response = client.get(f'/document/tables/3.ndjson?{DOCUMENT}')
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [list(record.values()) for record in records] == page['rows']
+
+
+def test_dict_rows_and_blank_headers():
+    xml_table = Table([{'cusip': '037833100', 'value': 5, '_table': 'x'}, {'cusip': '594918104', 'value': 7}])
+    assert table_row_count(xml_table) == 2
+    assert list(iter_table_rows(xml_table, offset=1)) == [['594918104', 7]]
+
+    html_table = Table([['', 'Year', 'Year'], ['Sales', '1', '2']])
+    assert table_row_count(html_table) == 1
+    assert json.loads(next(stream_ndjson(html_table))) == {'column_0': 'Sales', 'Year': '1', 'column_2': '2'}